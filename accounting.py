@@ -0,0 +1,192 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+from datetime import date, datetime, timedelta
+from pathlib import Path
+from typing import Dict, List, Mapping, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+LEDGER_PATH = Path("/etc/wireguard/traffic.json")
+# Daily buckets older than this are dropped; monthly totals are kept
+DAYS_KEPT = 92
+# Throughput samples and hourly activity are kept for chart periods up to this long
+HISTORY_SECONDS = 7 * 86400
+
+Counters = Tuple[int, int]  # (rx, tx) in bytes, from the server's point of view
+
+
+def parse_period(text: str, today: Optional[date] = None) -> Tuple[str, str]:
+    """Parse a report period into ('day'|'month', key or 'start..end').
+
+    Accepts `today`, `7d`, `month`, `2026-10`, `2026-10-19` and `2026-10-01..2026-10-15`.
+    """
+    today = today or date.today()
+    text = text.strip().lower()
+    if text in ('', 'today'):
+        return 'day', f"{today}..{today}"
+    if text == 'month':
+        return 'day', f"{today.replace(day=1)}..{today}"
+    match = re.match(r'^(\d+)d$', text)
+    if match and int(match.group(1)) > 0:
+        return 'day', f"{today - timedelta(days=int(match.group(1)) - 1)}..{today}"
+    if re.match(r'^\d{4}-\d{2}$', text):
+        return 'month', text
+    match = re.match(r'^(\d{4}-\d{2}-\d{2})(?:\.\.(\d{4}-\d{2}-\d{2}))?$', text)
+    if match:
+        start = date.fromisoformat(match.group(1))
+        end = date.fromisoformat(match.group(2)) if match.group(2) else start
+        if end < start:
+            raise ValueError(f"Invalid period: {text}")
+        return 'day', f"{start}..{end}"
+    raise ValueError(f"Invalid period: {text}")
+
+
+class TrafficLedger:
+    """Monotonic per-client traffic totals by day and by month.
+
+    WireGuard counters restart from zero whenever a peer or the interface is
+    re-created. Each sample adds the growth since the previous one; a counter
+    below its previous value means a reset, and then the whole current value
+    is new traffic. Sampling right before a restart keeps the loss at zero.
+    """
+
+    def __init__(self, path: Path = LEDGER_PATH):
+        self.path = path
+        self._last: Dict[str, Counters] = {}
+        self._days: Dict[str, Dict[str, list]] = {}
+        self._months: Dict[str, Dict[str, list]] = {}
+        self._series: List[list] = []             # [unix time, total bytes/s]
+        self._activity: Dict[str, List[int]] = {}  # client -> hours (unix time // 3600) with traffic
+        self._rates: Dict[str, Tuple[float, float]] = {}
+        self._sampled_at = 0.0
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        with self._lock:
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                self._last = {name: tuple(value) for name, value in data.get('last', {}).items()}
+                self._days = data.get('days', {})
+                self._months = data.get('months', {})
+                self._series = data.get('series', [])
+                self._activity = data.get('activity', {})
+            except FileNotFoundError:
+                pass
+            except (OSError, ValueError) as e:
+                logger.error(f"Error loading traffic ledger {self.path}: {e}")
+
+    def save(self):
+        with self._lock:
+            if not self.path.parent.exists():
+                return
+            tmp_path = self.path.with_name(self.path.name + '.tmp')
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'version': 1, 'last': self._last, 'days': self._days, 'months': self._months,
+                           'series': self._series, 'activity': self._activity},
+                          f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+
+    def sample(self, counters: Mapping[str, Counters], now: Optional[float] = None) -> Dict[str, Counters]:
+        """Account the counters of a `wg show dump` read; returns the growth per client"""
+        now = now or time.time()
+        moment = datetime.fromtimestamp(now)
+        day, month = moment.strftime('%Y-%m-%d'), moment.strftime('%Y-%m')
+        deltas = {}
+        with self._lock:
+            day_bucket = self._days.setdefault(day, {})
+            month_bucket = self._months.setdefault(month, {})
+            for name, (rx, tx) in counters.items():
+                prev_rx, prev_tx = self._last.get(name, (0, 0))
+                delta = (rx - prev_rx if rx >= prev_rx else rx, tx - prev_tx if tx >= prev_tx else tx)
+                deltas[name] = delta
+                if delta[0] or delta[1]:
+                    for bucket in (day_bucket, month_bucket):
+                        total = bucket.setdefault(name, [0, 0])
+                        total[0] += delta[0]
+                        total[1] += delta[1]
+            # Peers missing from the dump start from zero when they come back
+            self._last = {name: tuple(value) for name, value in counters.items()}
+            # The first sample after a start covers an unknown span, so it gives no rates
+            elapsed = now - self._sampled_at if self._sampled_at else 0
+            self._rates = {
+                name: (rx / elapsed, tx / elapsed) for name, (rx, tx) in deltas.items()
+            } if elapsed > 0 else {}
+            self._sampled_at = now
+            self._record_history(now, deltas, elapsed)
+            cutoff = (moment.date() - timedelta(days=DAYS_KEPT)).isoformat()
+            for old_day in [key for key in self._days if key < cutoff]:
+                del self._days[old_day]
+        return deltas
+
+    def _record_history(self, now: float, deltas: Dict[str, Counters], elapsed: float):
+        hour = int(now) // 3600
+        for name, (rx, tx) in deltas.items():
+            hours = self._activity.setdefault(name, [])
+            if (rx or tx) and (not hours or hours[-1] != hour):
+                hours.append(hour)
+        if elapsed > 0:
+            self._series.append([int(now), round(sum(rx + tx for rx, tx in deltas.values()) / elapsed, 1)])
+        
+        cutoff = now - HISTORY_SECONDS
+        if self._series and self._series[0][0] < cutoff:
+            self._series = [point for point in self._series if point[0] >= cutoff]
+        for name in list(self._activity):
+            hours = [h for h in self._activity[name] if h * 3600 >= cutoff]
+            if hours:
+                self._activity[name] = hours
+            else:
+                del self._activity[name]
+
+    def series(self, since: float) -> List[Tuple[int, float]]:
+        """Total throughput samples (unix time, bytes/s) newer than `since`"""
+        with self._lock:
+            return [(ts, rate) for ts, rate in self._series if ts >= since]
+
+    def activity(self, since: float) -> Dict[str, List[int]]:
+        """Hours (unix time // 3600) with traffic per client, newer than `since`"""
+        with self._lock:
+            return {name: [h for h in hours if h * 3600 >= since] for name, hours in self._activity.items()}
+
+    @property
+    def sampled_at(self) -> float:
+        return self._sampled_at
+
+    def rates(self) -> Tuple[Dict[str, Tuple[float, float]], float]:
+        """Per-client (rx, tx) bytes/s over the latest sample interval and when it was taken"""
+        with self._lock:
+            return dict(self._rates), self._sampled_at
+
+    def totals(self, kind: str, key: str) -> Dict[str, Counters]:
+        """Per-client (rx, tx) of a period as returned by parse_period"""
+        result: Dict[str, list] = {}
+        with self._lock:
+            if kind == 'month':
+                buckets = [self._months.get(key, {})]
+            else:
+                start, _, end = key.partition('..')
+                buckets = [bucket for day, bucket in self._days.items() if start <= day <= end]
+            for bucket in buckets:
+                for name, (rx, tx) in bucket.items():
+                    total = result.setdefault(name, [0, 0])
+                    total[0] += rx
+                    total[1] += tx
+        return {name: (rx, tx) for name, (rx, tx) in result.items()}
+
+    def dump(self) -> dict:
+        with self._lock:
+            return json.loads(json.dumps({'days': self._days, 'months': self._months}))
+
+    def replace(self, data: dict):
+        """Restore history from a backup; live counters are re-baselined on the next sample"""
+        with self._lock:
+            self._days = data.get('days', {})
+            self._months = data.get('months', {})
+            self._last = {}
+        self.save()
@@ -0,0 +1,207 @@
+import ipaddress
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+class AddressPoolError(ValueError):
+    """Raised when an address cannot be parsed, assigned or allocated"""
+
+
+class AddressPool:
+    """CIDR-aware allocator for WireGuard client addresses.
+
+    Host addresses are addressed by their index inside the network: index 1 is
+    the server, clients start right after it. Allocation, lookup and release
+    are constant-time: occupancy is kept in a bytearray, released indexes are
+    reused from a stack and fresh ones come from a high-water cursor.
+
+    With an optional IPv6 (ULA) network every index also maps to a paired v6
+    address, so dual-stack clients need no separate allocation.
+    """
+
+    def __init__(self, network: str, reserved: int = 1, network6: Optional[str] = None):
+        self.network = ipaddress.ip_network(network, strict=False)
+        if self.network.version != 4:
+            raise AddressPoolError(f"IPv4 network expected: {network}")
+        if self.network.prefixlen > 30:
+            raise AddressPoolError(f"Network {network} is too small for clients")
+
+        self.network6 = ipaddress.ip_network(network6, strict=False) if network6 else None
+        if self.network6 is not None:
+            if self.network6.version != 6:
+                raise AddressPoolError(f"IPv6 network expected: {network6}")
+            if self.network6.num_addresses < self.network.num_addresses:
+                raise AddressPoolError(f"Network {network6} is smaller than {network}")
+            self._base6 = int(self.network6.network_address)
+
+        self._base = int(self.network.network_address)
+        self._first = 1 + reserved
+        self._last = self.network.num_addresses - 2  # exclude broadcast
+        self._used = bytearray(self.network.num_addresses)
+        self._next = self._first
+        self._released: List[int] = []
+        self._by_index: Dict[int, str] = {}
+        self._by_name: Dict[str, int] = {}
+        self._lock = threading.RLock()
+
+    @property
+    def prefixlen(self) -> int:
+        return self.network.prefixlen
+
+    @property
+    def prefixlen6(self) -> Optional[int]:
+        return self.network6.prefixlen if self.network6 is not None else None
+
+    @property
+    def server_address(self) -> str:
+        return str(ipaddress.ip_address(self._base + 1))
+
+    @property
+    def server_address6(self) -> Optional[str]:
+        return self.address6_at(1)
+
+    @property
+    def capacity(self) -> int:
+        return self._last - self._first + 1
+
+    @property
+    def free_count(self) -> int:
+        return self.capacity - len(self._by_index)
+
+    def __len__(self) -> int:
+        return len(self._by_index)
+
+    def __contains__(self, name) -> bool:
+        """Whether a client name holds an address (use lookup() for addresses)"""
+        return name in self._by_name
+
+    def index_of(self, address) -> int:
+        """Return the host index of a client address (v4 or paired v6) inside the pool"""
+        try:
+            ip = ipaddress.ip_address(str(address).strip())
+        except ValueError:
+            raise AddressPoolError(f"Invalid IP address: {address}")
+        if ip.version == 6:
+            if self.network6 is None or ip not in self.network6:
+                raise AddressPoolError(f"{ip} is outside of the IPv6 pool")
+            index = int(ip) - self._base6
+        elif ip in self.network:
+            index = int(ip) - self._base
+        else:
+            raise AddressPoolError(f"{ip} is outside of {self.network}")
+        if not self._first <= index <= self._last:
+            raise AddressPoolError(f"{ip} is reserved")
+        return index
+
+    def address_at(self, index: int) -> str:
+        return str(ipaddress.ip_address(self._base + index))
+
+    def address6_at(self, index: int) -> Optional[str]:
+        if self.network6 is None:
+            return None
+        return str(ipaddress.ip_address(self._base6 + index))
+
+    def address6_of(self, address) -> Optional[str]:
+        """Return the IPv6 address paired with a client address"""
+        return self.address6_at(self.index_of(address))
+
+    def parse_address(self, text: str) -> str:
+        """Parse a full (v4 or paired v6) address, or a last-octet shorthand when the pool is a /24"""
+        text = str(text).strip()
+        if text.isdigit():
+            if self.prefixlen != 24:
+                raise AddressPoolError(
+                    f"Octet shorthand is only supported for /24 pools, use a full address in {self.network}"
+                )
+            return self.address_at(self.index_of(self.address_at(int(text))))
+        return self.address_at(self.index_of(text))
+
+    def lookup(self, address) -> Optional[str]:
+        """Return the client name holding an address, if any"""
+        try:
+            index = self.index_of(address)
+        except AddressPoolError:
+            return None
+        return self._by_index.get(index)
+
+    def address_of(self, name: str) -> Optional[str]:
+        index = self._by_name.get(name)
+        return self.address_at(index) if index is not None else None
+
+    def is_free(self, address) -> bool:
+        return not self._used[self.index_of(address)]
+
+    def assign(self, name: str, address) -> str:
+        """Reserve a specific address for a client"""
+        with self._lock:
+            index = self.index_of(address)
+            if self._used[index]:
+                raise AddressPoolError(f"{self.address_at(index)} is already in use by {self._by_index[index]}")
+            if name in self._by_name:
+                raise AddressPoolError(f"Client {name} already has an address")
+            self._take(index, name)
+            return self.address_at(index)
+
+    def allocate(self, name: str) -> str:
+        """Reserve the next free address for a client"""
+        with self._lock:
+            if name in self._by_name:
+                raise AddressPoolError(f"Client {name} already has an address")
+            while self._released:
+                index = self._released.pop()
+                if not self._used[index]:
+                    self._take(index, name)
+                    return self.address_at(index)
+            while self._next <= self._last and self._used[self._next]:
+                self._next += 1
+            if self._next > self._last:
+                raise AddressPoolError(f"No free addresses left in {self.network}")
+            index = self._next
+            self._next += 1
+            self._take(index, name)
+            return self.address_at(index)
+
+    def release(self, address) -> Optional[str]:
+        """Free an address and return the name of the client that held it"""
+        with self._lock:
+            try:
+                index = self.index_of(address)
+            except AddressPoolError:
+                return None
+            name = self._by_index.pop(index, None)
+            if name is None:
+                return None
+            self._used[index] = 0
+            self._by_name.pop(name, None)
+            if index < self._next:
+                self._released.append(index)
+            return name
+
+    def clear(self):
+        with self._lock:
+            self._used = bytearray(self.network.num_addresses)
+            self._by_index.clear()
+            self._by_name.clear()
+            self._released.clear()
+            self._next = self._first
+
+    def items(self) -> List[Tuple[str, str]]:
+        """Snapshot of (client name, address) pairs"""
+        with self._lock:
+            return [(name, self.address_at(index)) for name, index in self._by_name.items()]
+
+    def free_addresses(self, start: int = 0) -> Iterator[str]:
+        """Yield free addresses in ascending order, skipping the first `start` of them"""
+        skipped = 0
+        for index in range(self._first, self._last + 1):
+            if self._used[index]:
+                continue
+            if skipped < start:
+                skipped += 1
+                continue
+            yield self.address_at(index)
+
+    def _take(self, index: int, name: str):
+        self._used[index] = 1
+        self._by_index[index] = name
+        self._by_name[name] = index
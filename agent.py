@@ -0,0 +1,323 @@
+import hashlib
+import heapq
+import hmac
+import ipaddress
+import json
+import logging
+import re
+import secrets
+import ssl
+import sys
+import threading
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Peer operations a node exposes; each maps to a `rpc_<method>` on the service object
+RPC_METHODS = ('info', 'create_client', 'delete_client', 'dump_stats', 'backup')
+
+# Maximum accepted clock skew for signed requests, seconds
+MAX_SKEW = 300
+
+# Every request carries a fresh random nonce; an agent accepts each nonce once
+NONCE_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+# Timestamp slot of reply signatures: binds a reply to its request nonce and never passes as a request
+REPLY = 'reply'
+
+
+class AgentError(Exception):
+    """Raised when a node cannot be reached or rejects a call"""
+
+
+def sign(secret: str, timestamp: str, nonce: str, body: bytes) -> str:
+    return hmac.new(secret.encode(), b'.'.join((timestamp.encode(), nonce.encode(), body)), hashlib.sha256).hexdigest()
+
+
+def is_loopback(host: str) -> bool:
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host.strip('[]')).is_loopback
+    except ValueError:
+        return False
+
+
+class NonceCache:
+    """Nonces of accepted requests, kept until their timestamp leaves the skew window"""
+
+    def __init__(self):
+        self._expires: Dict[str, float] = {}
+        self._heap: List[Tuple[float, str]] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._expires)
+
+    def add(self, nonce: str, expires: float, now: Optional[float] = None) -> bool:
+        """Remember a nonce until `expires`; False if it is already remembered"""
+        now = time.time() if now is None else now
+        with self._lock:
+            while self._heap and self._heap[0][0] < now:
+                del self._expires[heapq.heappop(self._heap)[1]]
+            if nonce in self._expires:
+                return False
+            self._expires[nonce] = expires
+            heapq.heappush(self._heap, (expires, nonce))
+            return True
+
+
+def dispatch(service, method: str, params: dict):
+    if method not in RPC_METHODS:
+        raise AgentError(f"Unknown method: {method}")
+    return getattr(service, f"rpc_{method}")(**params)
+
+
+class LocalNode:
+    """Node backed by the WireGuard instance on this host, no RPC involved"""
+
+    def __init__(self, service, name: str = 'local'):
+        self.service = service
+        self.name = name
+
+    def call(self, method: str, **params):
+        return dispatch(self.service, method, params)
+
+
+class AgentClient:
+    """Node reached through a remote agent over signed HTTP(S) RPC"""
+
+    def __init__(self, name: str, url: str, secret: str, timeout: float = 30,
+                 context: Optional[ssl.SSLContext] = None):
+        self.name = name
+        self.url = url.rstrip('/') + '/rpc'
+        self.secret = secret
+        self.timeout = timeout
+        self.context = context
+
+    def call(self, method: str, **params):
+        body = json.dumps({'method': method, 'params': params}).encode()
+        timestamp = str(int(time.time()))
+        nonce = secrets.token_hex(16)
+        request = urllib.request.Request(self.url, data=body, method='POST', headers={
+            'Content-Type': 'application/json',
+            'X-Agent-Timestamp': timestamp,
+            'X-Agent-Nonce': nonce,
+            'X-Agent-Signature': sign(self.secret, timestamp, nonce, body),
+        })
+        try:
+            with urllib.request.urlopen(request, timeout=self.timeout, context=self.context) as response:
+                data = response.read()
+                signature = response.headers.get('X-Agent-Signature', '')
+        except urllib.error.HTTPError as e:
+            raise AgentError(f"{self.name}: HTTP {e.code}")
+        except (urllib.error.URLError, OSError) as e:
+            raise AgentError(f"{self.name}: {e}")
+
+        if not hmac.compare_digest(sign(self.secret, REPLY, nonce, data), signature):
+            raise AgentError(f"{self.name}: reply signature mismatch")
+        try:
+            reply = json.loads(data.decode())
+        except ValueError as e:
+            raise AgentError(f"{self.name}: {e}")
+        if not reply.get('ok'):
+            raise AgentError(f"{self.name}: {reply.get('error', 'unknown error')}")
+        return reply.get('result')
+
+
+class NodeFleet:
+    """Set of nodes driven by one bot: parallel fan-out and client placement"""
+
+    def __init__(self, nodes: List, placement: str = 'peers'):
+        self.nodes = {node.name: node for node in nodes}
+        self.placement = placement
+        self._executor = ThreadPoolExecutor(max_workers=max(4, len(nodes)))
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def get(self, name: str):
+        return self.nodes.get(name)
+
+    def fan_out(self, method: str, **params) -> Dict[str, Tuple[bool, object]]:
+        """Call a method on every node in parallel: {node: (ok, result or error text)}"""
+        futures = {name: self._executor.submit(node.call, method, **params) for name, node in self.nodes.items()}
+        results = {}
+        for name, future in futures.items():
+            try:
+                results[name] = (True, future.result())
+            except Exception as e:
+                logger.warning(f"Node {name} failed on {method}: {e}")
+                results[name] = (False, str(e))
+        return results
+
+    def load(self) -> Dict[str, dict]:
+        """Current info of every reachable node"""
+        return {name: info for name, (ok, info) in self.fan_out('info').items() if ok}
+
+    def pick_node(self, load: Optional[Dict[str, dict]] = None) -> Optional[str]:
+        """Node with the lowest peer count (or traffic) that still has free addresses"""
+        if load is None:
+            load = self.load()
+        candidates = [(name, info) for name, info in load.items() if info.get('free', 0) > 0]
+        if not candidates:
+            return None
+        key = 'traffic' if self.placement == 'traffic' else 'peers'
+        return min(candidates, key=lambda item: (item[1].get(key, 0), item[1].get('peers', 0)))[0]
+
+    def place(self, count: int) -> List[Optional[str]]:
+        """Spread `count` new clients over the fleet using one load query"""
+        load = self.load()
+        placement = []
+        for _ in range(count):
+            name = self.pick_node(load)
+            placement.append(name)
+            if name is not None:
+                load[name]['peers'] = load[name].get('peers', 0) + 1
+                load[name]['free'] = load[name].get('free', 0) - 1
+        return placement
+
+
+def parse_agents(spec: str, secret: str, cafile: str = '') -> List[AgentClient]:
+    """Parse WG_AGENTS: comma separated `name=https://host:port` entries.
+
+    `cafile` verifies agents with self-signed certificates; plain http is
+    only meant for loopback addresses (e.g. the end of an SSH tunnel).
+    """
+    context = ssl.create_default_context(cafile=cafile or None)
+    agents = []
+    for item in spec.split(','):
+        item = item.strip()
+        if not item:
+            continue
+        name, sep, url = item.partition('=')
+        if not sep:
+            name, url = item, item
+        name, url = name.strip(), url.strip()
+        parts = urllib.parse.urlsplit(url)
+        if parts.scheme == 'http' and not is_loopback(parts.hostname or ''):
+            logger.warning(f"Agent {name} is reached over plain HTTP: use https:// or a tunnel")
+        agents.append(AgentClient(name, url, secret, context=context))
+    return agents
+
+
+class AgentRequestHandler(BaseHTTPRequestHandler):
+    server_version = 'wg-agent/1.0'
+    timeout = 30
+
+    def setup(self):
+        super().setup()
+        # TLS handshakes run here, in the request thread, not in the accept loop
+        if isinstance(self.request, ssl.SSLSocket):
+            self.request.do_handshake()
+
+    def do_POST(self):
+        if self.path != '/rpc':
+            self._reply(404, {'ok': False, 'error': 'not found'})
+            return
+
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length)
+        timestamp = self.headers.get('X-Agent-Timestamp', '')
+        nonce = self.headers.get('X-Agent-Nonce', '')
+        signature = self.headers.get('X-Agent-Signature', '')
+
+        if not self.server.authenticate(timestamp, nonce, body, signature):
+            logger.warning(f"Rejected unauthenticated or replayed RPC from {self.client_address[0]}")
+            self._reply(401, {'ok': False, 'error': 'unauthorized'})
+            return
+
+        try:
+            request = json.loads(body.decode())
+            result = dispatch(self.server.service, request.get('method', ''), request.get('params') or {})
+            self._reply(200, {'ok': True, 'result': result}, nonce)
+        except Exception as e:
+            logger.error(f"RPC {body[:100]!r} failed: {e}")
+            self._reply(200, {'ok': False, 'error': str(e)}, nonce)
+
+    def _reply(self, status: int, payload: dict, nonce: Optional[str] = None):
+        data = json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        if nonce is not None:
+            self.send_header('X-Agent-Signature', sign(self.server.secret, REPLY, nonce, data))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        logger.info(f"{self.client_address[0]} {format % args}")
+
+
+class AgentServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address: Tuple[str, int], service, secret: str, tls: Optional[ssl.SSLContext] = None):
+        super().__init__(address, AgentRequestHandler)
+        self.service = service
+        self.secret = secret
+        self.nonces = NonceCache()
+        if tls is not None:
+            self.socket = tls.wrap_socket(self.socket, server_side=True, do_handshake_on_connect=False)
+
+    def authenticate(self, timestamp: str, nonce: str, body: bytes, signature: str,
+                     now: Optional[float] = None) -> bool:
+        """Check the signature and clock skew of a request and that its nonce is fresh"""
+        now = time.time() if now is None else now
+        try:
+            sent = int(timestamp)
+        except ValueError:
+            return False
+        if abs(now - sent) > MAX_SKEW or not NONCE_PATTERN.match(nonce):
+            return False
+        if not hmac.compare_digest(sign(self.secret, timestamp, nonce, body), signature):
+            return False
+        # Only signed requests take a slot, so the cache is bounded by genuine traffic
+        return self.nonces.add(nonce, sent + MAX_SKEW, now)
+
+    def handle_error(self, request, client_address):
+        # Failed TLS handshakes and dropped connections: one line instead of a traceback
+        logger.warning(f"Connection from {client_address[0]} failed: {sys.exc_info()[1]}")
+
+
+def main():
+    from config import (wg_agent_listen, wg_agent_secret, wg_agent_tls_cert, wg_agent_tls_key,
+                        wg_address_pool, wg_address_pool6)
+    from main import WireGuardBot
+
+    if not wg_agent_secret:
+        logger.error("WG_AGENT_SECRET is not configured")
+        return
+
+    host, _, port = wg_agent_listen.rpartition(':')
+    host = host or '127.0.0.1'
+    tls = None
+    if wg_agent_tls_cert:
+        tls = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        tls.load_cert_chain(wg_agent_tls_cert, wg_agent_tls_key or None)
+    elif not is_loopback(host):
+        # Replies carry client keys (backup): never send them in the clear
+        logger.error("WG_AGENT_LISTEN is not a loopback address: set WG_AGENT_TLS_CERT or use an SSH tunnel")
+        return
+
+    service = WireGuardBot(None, [], wg_address_pool, wg_address_pool6)
+    # Client expiry and last-seen tracking run on the node that holds the clients
+    service.apply_firewall()
+    service.apply_shaping()
+    service.start_background_jobs()
+    server = AgentServer((host, int(port)), service, wg_agent_secret, tls)
+    logger.info(f"WireGuard agent listening on {'https' if tls else 'http'}://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Agent stopped by user")
+
+
+if __name__ == "__main__":
+    main()
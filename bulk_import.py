@@ -0,0 +1,60 @@
+import csv
+import io
+from typing import Dict, Iterator, List, NamedTuple, Optional
+
+# Column order of a CSV without a header row
+IMPORT_COLUMNS = ('name', 'address', 'profile', 'expires', 'tags', 'rate', 'route', 'psk')
+CSV_DELIMITERS = (',', ';', '\t')
+
+
+class ImportRow(NamedTuple):
+    line: int
+    name: str
+    values: Dict[str, str]           # CSV cells by column name
+    fields: Optional[List[str]] = None  # TXT rows: the colon fields after the name, as in bulk creation
+
+
+def iter_import_rows(stream: io.TextIOBase) -> Iterator[ImportRow]:
+    """Yield client rows of an uploaded CSV or TXT file one at a time.
+
+    A file whose first data line contains a comma, semicolon or tab is CSV,
+    with an optional `name,...` header naming its columns; any other file is
+    read as the `name:field:field` lines of bulk creation. Empty lines and
+    `#` comments are skipped; `@` directives are left to the TXT caller.
+    """
+    first = None
+    line_number = 0
+    for line_number, line in enumerate(stream, 1):
+        if line.strip() and not line.lstrip().startswith('#'):
+            first = line
+            break
+    if first is None:
+        return
+
+    delimiter = next((d for d in CSV_DELIMITERS if d in first), None)
+    if delimiter is None:
+        for number, line in enumerate(_chain(first, stream), line_number):
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            name, *fields = [field.strip() for field in line.split(':')]
+            yield ImportRow(number, name, {}, fields)
+        return
+
+    reader = csv.reader(_chain(first, stream), delimiter=delimiter)
+    columns = IMPORT_COLUMNS
+    for cells in reader:
+        number = line_number + reader.line_num - 1
+        cells = [cell.strip() for cell in cells]
+        if not any(cells) or cells[0].startswith('#'):
+            continue
+        if number == line_number and cells[0].lower() == 'name':
+            columns = tuple(cell.lower() for cell in cells)
+            continue
+        values = {column: cell for column, cell in zip(columns, cells) if cell}
+        yield ImportRow(number, values.pop('name', ''), values)
+
+
+def _chain(first: str, rest) -> Iterator[str]:
+    yield first
+    yield from rest
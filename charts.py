@@ -0,0 +1,125 @@
+import io
+import time
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+BACKGROUND = (255, 255, 255)
+GRID = (225, 225, 225)
+TEXT = (60, 60, 60)
+LINE = (40, 110, 200)
+FILL = (170, 200, 240)
+HEAT = (40, 160, 90)
+MARGIN_LEFT, MARGIN_RIGHT, MARGIN_TOP, MARGIN_BOTTOM = 70, 15, 30, 25
+
+
+def downsample_minmax(points: Sequence[Tuple[float, float]], start: float, end: float,
+                      width: int) -> List[Optional[Tuple[float, float]]]:
+    """Reduce (time, value) points to one (min, max) per pixel column; None where there is no data.
+
+    One pass over the points, so drawing costs O(width) whatever the history length,
+    while peaks that plain averaging would flatten stay visible.
+    """
+    columns: List[Optional[Tuple[float, float]]] = [None] * width
+    span = max(end - start, 1)
+    for ts, value in points:
+        if not start <= ts <= end:
+            continue
+        x = min(int((ts - start) / span * width), width - 1)
+        column = columns[x]
+        columns[x] = (value, value) if column is None else (min(column[0], value), max(column[1], value))
+    return columns
+
+
+def _format_rate(value: float) -> str:
+    for unit in ('B/s', 'KB/s', 'MB/s', 'GB/s'):
+        if value < 1024:
+            return f"{value:.0f} {unit}"
+        value /= 1024
+    return f"{value:.0f} TB/s"
+
+
+def _to_png(image: Image.Image) -> bytes:
+    buffer = io.BytesIO()
+    image.save(buffer, format='PNG', optimize=True)
+    return buffer.getvalue()
+
+
+def render_throughput_chart(points: Sequence[Tuple[float, float]], period: int, now: Optional[float] = None,
+                            title: str = '', width: int = 800, height: int = 300) -> bytes:
+    """Total throughput over the last `period` seconds as a filled min/max band"""
+    now = now or time.time()
+    start = now - period
+    plot_width = width - MARGIN_LEFT - MARGIN_RIGHT
+    plot_height = height - MARGIN_TOP - MARGIN_BOTTOM
+    columns = downsample_minmax(points, start, now, plot_width)
+    peak = max((column[1] for column in columns if column), default=0) or 1
+
+    image = Image.new('RGB', (width, height), BACKGROUND)
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default()
+    draw.text((MARGIN_LEFT, 8), title, fill=TEXT, font=font)
+
+    bottom = MARGIN_TOP + plot_height
+    for i in range(5):
+        y = MARGIN_TOP + plot_height * i // 4
+        draw.line([(MARGIN_LEFT, y), (width - MARGIN_RIGHT, y)], fill=GRID)
+        draw.text((5, y - 6), _format_rate(peak * (4 - i) / 4), fill=TEXT, font=font)
+
+    # Time labels: hours for a day, dates for longer periods
+    ticks = 6 if period <= 86400 else 7
+    for i in range(ticks + 1):
+        x = MARGIN_LEFT + plot_width * i // ticks
+        moment = time.localtime(start + period * i / ticks)
+        draw.line([(x, MARGIN_TOP), (x, bottom)], fill=GRID)
+        label = time.strftime('%H:%M' if period <= 86400 else '%d.%m', moment)
+        draw.text((x - 14, bottom + 6), label, fill=TEXT, font=font)
+
+    previous = None
+    for x, column in enumerate(columns):
+        if column is None:
+            previous = None
+            continue
+        low = bottom - int(column[0] / peak * plot_height)
+        high = bottom - int(column[1] / peak * plot_height)
+        px = MARGIN_LEFT + x
+        draw.line([(px, bottom), (px, low)], fill=FILL)
+        draw.line([(px, low), (px, high)], fill=LINE)
+        if previous is not None:
+            draw.line([previous, (px, high)], fill=LINE)
+        previous = (px, high)
+    return _to_png(image)
+
+
+def render_activity_heatmap(activity: Dict[str, List[int]], hours: int, now: Optional[float] = None,
+                            title: str = '', cell: int = 5, row_height: int = 14) -> bytes:
+    """Clients as rows, hours as columns; a filled cell is an hour with traffic"""
+    now = now or time.time()
+    last_hour = int(now) // 3600
+    first_hour = last_hour - hours + 1
+    rows = sorted(activity.items(), key=lambda item: (-len(item[1]), item[0]))
+
+    width = MARGIN_LEFT + hours * cell + MARGIN_RIGHT
+    height = MARGIN_TOP + max(len(rows), 1) * row_height + MARGIN_BOTTOM
+    image = Image.new('RGB', (width, height), BACKGROUND)
+    draw = ImageDraw.Draw(image)
+    font = ImageFont.load_default()
+    draw.text((MARGIN_LEFT, 8), title, fill=TEXT, font=font)
+
+    for row, (name, active_hours) in enumerate(rows):
+        y = MARGIN_TOP + row * row_height
+        draw.text((5, y + 1), name[:10], fill=TEXT, font=font)
+        draw.rectangle([MARGIN_LEFT, y + 2, MARGIN_LEFT + hours * cell - 1, y + row_height - 3], fill=GRID)
+        for hour in active_hours:
+            if first_hour <= hour <= last_hour:
+                x = MARGIN_LEFT + (hour - first_hour) * cell
+                draw.rectangle([x, y + 2, x + cell - 2, y + row_height - 3], fill=HEAT)
+
+    # A mark at every local midnight
+    bottom = MARGIN_TOP + max(len(rows), 1) * row_height
+    for hour in range(first_hour, last_hour + 1):
+        if time.localtime(hour * 3600).tm_hour == 0:
+            x = MARGIN_LEFT + (hour - first_hour) * cell
+            draw.line([(x, MARGIN_TOP), (x, bottom)], fill=TEXT)
+            draw.text((x + 2, bottom + 6), time.strftime('%d.%m', time.localtime(hour * 3600)), fill=TEXT, font=font)
+    return _to_png(image)
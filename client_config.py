@@ -0,0 +1,92 @@
+import os
+from pathlib import Path
+from typing import Dict, Iterable, NamedTuple, Optional
+
+
+class ConfigProfile(NamedTuple):
+    """Client-side settings shared by a group of clients"""
+    name: str
+    dns: str = '8.8.8.8'
+    mtu: int = 1332
+    keepalive: int = 20
+    endpoint: Optional[str] = None  # host[:port], default is the server's public address
+    route: Optional[str] = None     # route profile, default is full tunnel
+
+
+PROFILE_FIELDS = ('dns', 'mtu', 'keepalive', 'endpoint', 'route')
+
+
+def parse_config_profiles(spec: str, default: ConfigProfile) -> Dict[str, ConfigProfile]:
+    """Parse `mobile:dns=1.1.1.1 1.0.0.1,mtu=1280;office:endpoint=vpn.example.com` on top of the default"""
+    profiles = {'default': default}
+    for item in spec.split(';'):
+        name, sep, fields = item.partition(':')
+        name = name.strip().lower()
+        if not sep or not name:
+            continue
+        values = {}
+        for field in fields.split(','):
+            key, _, value = field.partition('=')
+            key = key.strip().lower()
+            if key not in PROFILE_FIELDS:
+                raise ValueError(f"Unknown config profile field {key} in {name}")
+            if key in ('mtu', 'keepalive'):
+                values[key] = int(value)
+            elif key == 'dns':
+                values[key] = ', '.join(value.split())
+            else:
+                values[key] = value.strip()
+        profiles[name] = default._replace(name=name, **values)
+    return profiles
+
+
+def render_client_config(private_key: str, addresses: Iterable[str], server_public_key: str, endpoint: str,
+                         allowed_ips: Iterable[str], profile: ConfigProfile,
+                         preshared_key: Optional[str] = None) -> str:
+    """Render a client config in memory; byte-for-byte the layout add_cl.sh used to write"""
+    lines = [
+        "[Interface]",
+        f"PrivateKey = {private_key}",
+        f"Address = {', '.join(addresses)}",
+    ]
+    if profile.dns:
+        lines.append(f"DNS = {profile.dns}")
+    if profile.mtu:
+        lines.append(f"MTU = {profile.mtu}")
+    lines += [
+        "",
+        "[Peer]",
+        f"PublicKey = {server_public_key}",
+    ]
+    if preshared_key:
+        lines.append(f"PresharedKey = {preshared_key}")
+    lines += [
+        f"Endpoint = {endpoint}",
+        f"AllowedIPs = {', '.join(allowed_ips)}",
+    ]
+    if profile.keepalive:
+        lines.append(f"PersistentKeepalive = {profile.keepalive}")
+    return "\n".join(lines) + "\n"
+
+
+def write_if_changed(path: Path, text: str) -> bool:
+    """Write a config only when its content differs; returns whether it was written.
+
+    New files are created with 0600 permissions since they hold a private key.
+    """
+    try:
+        if path.read_text(encoding='utf-8') == text:
+            return False
+    except FileNotFoundError:
+        pass
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(text)
+    return True
+
+
+def read_key(path: Path) -> Optional[str]:
+    try:
+        return path.read_text(encoding='utf-8').strip() or None
+    except FileNotFoundError:
+        return None
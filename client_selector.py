@@ -0,0 +1,171 @@
+import fnmatch
+import ipaddress
+import re
+import time
+from typing import Callable, Dict, Iterable, List, NamedTuple, Optional, Sequence, Set, Tuple
+
+from expiry import parse_duration
+from tags import TAG_PATTERN
+
+ALL, NAME, ADDRESS, GLOB, REGEX, RANGE, TAG, IDLE, NEVER = (
+    'all', 'name', 'address', 'glob', 'regex', 'range', 'tag', 'idle', 'never'
+)
+
+ALL_WORDS = {'*', 'all', 'все'}
+NEVER_WORDS = {'never', 'never connected', 'никогда'}
+RANGE_RE = re.compile(r'^([\d.]+)\s*-\s*([\d.]+)$')   # "10-40", "10.0.0.10-10.0.0.40"
+IDLE_RE = re.compile(r'^idle\s*>?\s*(\d+\s*[mhdw]?)$')  # "idle > 30d", "idle>12h", "idle 30"
+
+
+class Term(NamedTuple):
+    kind: str
+    value: object
+    text: str
+
+
+class Selector(NamedTuple):
+    """One line of a deletion list: a client is selected when it matches every term"""
+    line: int
+    text: str
+    terms: Tuple[Term, ...]
+
+
+class Candidate(NamedTuple):
+    name: str
+    address: str
+    tags: Sequence[str] = ()
+    last_seen: int = 0     # latest handshake ever seen, 0 if the client never connected
+    created: int = 0
+
+
+def parse_term(text: str, parse_address: Callable[[str], str]) -> Term:
+    """Parse one selector term; raises ValueError with the reason"""
+    lowered = text.lower()
+    if lowered in ALL_WORDS:
+        return Term(ALL, None, text)
+    if lowered in NEVER_WORDS:
+        return Term(NEVER, None, text)
+    match = IDLE_RE.match(lowered)
+    if match:
+        amount = match.group(1).replace(' ', '')
+        seconds = parse_duration(amount if not amount.isdigit() else amount + 'd')
+        if seconds is None:
+            raise ValueError(f"неверный срок: {text}")
+        return Term(IDLE, seconds, text)
+    if lowered.startswith('tag:'):
+        tag = lowered[4:].strip()
+        if not TAG_PATTERN.match(tag):
+            raise ValueError(f"неверный тег: {tag}")
+        return Term(TAG, tag, text)
+    if lowered.startswith('re:') or (len(text) > 2 and text[0] == text[-1] == '/'):
+        pattern = text[3:] if lowered.startswith('re:') else text[1:-1]
+        try:
+            return Term(REGEX, re.compile(pattern), text)
+        except re.error as e:
+            raise ValueError(f"неверное регулярное выражение: {e}")
+    match = RANGE_RE.match(text)
+    if match:
+        low, high = (int(ipaddress.ip_address(parse_address(part))) for part in match.groups())
+        if low > high:
+            low, high = high, low
+        return Term(RANGE, (low, high), text)
+    if any(char in text for char in '*?['):
+        return Term(GLOB, text, text)
+    if text.isdigit() or '.' in text or ':' in text:
+        return Term(ADDRESS, parse_address(text), text)
+    return Term(NAME, text, text)
+
+
+def parse_selectors(text: str, parse_address: Callable[[str], str]) -> Tuple[List[Selector], List[str]]:
+    """Parse a deletion list into selectors and per-line errors.
+
+    Lines are joined as a union; terms joined by `&` on one line must all
+    match. Empty lines and `#` comments are skipped.
+    """
+    selectors, errors = [], []
+    for number, line in enumerate(text.strip().split('\n'), 1):
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            terms = tuple(parse_term(part.strip(), parse_address) for part in line.split('&') if part.strip())
+        except ValueError as e:
+            errors.append(f"Строка {number}: {e}")
+            continue
+        selectors.append(Selector(number, line, terms))
+    return selectors, errors
+
+
+def required_facts(selectors: Iterable[Selector]) -> Set[str]:
+    """Which optional Candidate fields the selectors look at: 'tags' and/or 'activity'"""
+    kinds = {term.kind for selector in selectors for term in selector.terms}
+    facts = set()
+    if TAG in kinds:
+        facts.add('tags')
+    if kinds & {IDLE, NEVER}:
+        facts.add('activity')
+    return facts
+
+
+def _matches(term: Term, candidate: Candidate, now: float) -> bool:
+    kind = term.kind
+    if kind == ALL:
+        return True
+    if kind == NAME:
+        return candidate.name == term.value
+    if kind == ADDRESS:
+        return candidate.address == term.value
+    if kind == GLOB:
+        return fnmatch.fnmatchcase(candidate.name, term.value)
+    if kind == REGEX:
+        return term.value.search(candidate.name) is not None
+    if kind == RANGE:
+        low, high = term.value
+        return low <= int(ipaddress.ip_address(candidate.address)) <= high
+    if kind == TAG:
+        return term.value in candidate.tags
+    if kind == IDLE:
+        return max(candidate.last_seen, candidate.created) < now - term.value
+    if kind == NEVER:
+        return not candidate.last_seen
+    return False
+
+
+def select(selectors: Sequence[Selector], candidates: Iterable[Candidate], now: Optional[float] = None,
+           tagged: Optional[Callable[[str], Set[str]]] = None) -> Tuple[Dict[str, str], Dict[int, int]]:
+    """Evaluate all selectors in one pass over the clients.
+
+    Lone names and addresses are set lookups, as are lone tags when `tagged`
+    (tag -> client names, e.g. TagIndex.names) is given; every other selector
+    is tested against each candidate. Returns ({name: address}, {line: match count}).
+    """
+    now = now or time.time()
+    names: Dict[str, List[int]] = {}
+    addresses: Dict[str, List[int]] = {}
+    members: Dict[str, List[int]] = {}
+    scans: List[Selector] = []
+    for selector in selectors:
+        term = selector.terms[0] if len(selector.terms) == 1 else None
+        if term is not None and term.kind == NAME:
+            names.setdefault(term.value, []).append(selector.line)
+        elif term is not None and term.kind == ADDRESS:
+            addresses.setdefault(term.value, []).append(selector.line)
+        elif term is not None and term.kind == TAG and tagged is not None:
+            for name in tagged(term.value):
+                members.setdefault(name, []).append(selector.line)
+        else:
+            scans.append(selector)
+
+    selected: Dict[str, str] = {}
+    counts = {selector.line: 0 for selector in selectors}
+    for candidate in candidates:
+        lines = names.get(candidate.name, []) + addresses.get(candidate.address, []) + members.get(candidate.name, [])
+        lines += [
+            selector.line for selector in scans
+            if all(_matches(term, candidate, now) for term in selector.terms)
+        ]
+        if lines:
+            selected[candidate.name] = candidate.address
+            for line in lines:
+                counts[line] += 1
+    return selected, counts
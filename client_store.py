@@ -0,0 +1,78 @@
+import json
+import logging
+import os
+import threading
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class ClientStore:
+    """Per-client metadata persisted as JSON next to the WireGuard configs.
+
+    Keys and configs stay in their own files; this only keeps what cannot be
+    derived from them (last seen time, disabled peer blocks, ...). Writes go
+    to a temporary file that is renamed over the store, with 0600 permissions.
+    """
+
+    def __init__(self, path: str = '/etc/wireguard/clients.json'):
+        self.path = Path(path)
+        self._clients: Dict[str, dict] = {}
+        self._lock = threading.RLock()
+        self.load()
+
+    def load(self):
+        with self._lock:
+            self._clients = {}
+            if not self.path.exists():
+                return
+            try:
+                with open(self.path, 'r', encoding='utf-8') as f:
+                    self._clients = json.load(f).get('clients', {})
+            except (OSError, ValueError) as e:
+                logger.error(f"Error loading client store {self.path}: {e}")
+
+    def save(self):
+        with self._lock:
+            if not self.path.parent.exists():
+                return
+            tmp_path = self.path.with_name(self.path.name + '.tmp')
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump({'version': 1, 'clients': self._clients}, f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, self.path)
+
+    def get(self, name: str) -> dict:
+        with self._lock:
+            return dict(self._clients.get(name, {}))
+
+    def update(self, name: str, save: bool = True, **fields):
+        """Set fields of a client record; None removes a field"""
+        with self._lock:
+            record = self._clients.setdefault(name, {})
+            for key, value in fields.items():
+                if value is None:
+                    record.pop(key, None)
+                else:
+                    record[key] = value
+            if save:
+                self.save()
+
+    def remove(self, name: str, save: bool = True):
+        with self._lock:
+            if self._clients.pop(name, None) is not None and save:
+                self.save()
+
+    def items(self) -> List[Tuple[str, dict]]:
+        with self._lock:
+            return [(name, dict(record)) for name, record in self._clients.items()]
+
+    def dump(self) -> Dict[str, dict]:
+        with self._lock:
+            return json.loads(json.dumps(self._clients))
+
+    def replace(self, clients: Dict[str, dict]):
+        with self._lock:
+            self._clients = dict(clients)
+            self.save()
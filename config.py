@@ -17,6 +17,54 @@ else:
 # WireGuard Configuration
 wg_local_ip_hint: str = os.getenv('WG_LOCAL_IP_HINT', '10.20.20')
 
+# Client address pool in CIDR notation (e.g. 10.64.0.0/16), defaults to the /24 of WG_LOCAL_IP_HINT
+wg_address_pool: str = os.getenv('WG_ADDRESS_POOL') or f'{wg_local_ip_hint}.0/24'
+
+# Optional IPv6 ULA pool (e.g. fd42:42:42::/64); clients get a v6 address paired with their v4 one
+wg_address_pool6: str = os.getenv('WG_ADDRESS_POOL6', '')
+
+# Multi-node fleet: remote agents as comma separated name=https://host:port entries
+wg_agents: str = os.getenv('WG_AGENTS', '')
+wg_agent_secret: str = os.getenv('WG_AGENT_SECRET', '')
+wg_agent_ca: str = os.getenv('WG_AGENT_CA', '')  # CA or self-signed certificate of the agents
+wg_fleet_local: bool = os.getenv('WG_FLEET_LOCAL', '1') != '0'
+wg_placement: str = os.getenv('WG_PLACEMENT', 'peers')  # peers or traffic
+
+# Agent mode (agent.py): listen address; anything but loopback requires a TLS certificate
+wg_agent_listen: str = os.getenv('WG_AGENT_LISTEN', '127.0.0.1:8790')
+wg_agent_tls_cert: str = os.getenv('WG_AGENT_TLS_CERT', '')
+wg_agent_tls_key: str = os.getenv('WG_AGENT_TLS_KEY', '')  # empty if the key is inside the certificate file
+
+# Idle-peer reaper: clients without a handshake for WG_IDLE_DAYS are reported (or disabled)
+wg_idle_days: float = float(os.getenv('WG_IDLE_DAYS') or '90')
+wg_reaper_mode: str = os.getenv('WG_REAPER_MODE') or 'report'  # report or disable
+wg_reaper_interval_hours: float = float(os.getenv('WG_REAPER_INTERVAL_HOURS') or '24')
+
+# Per-client bandwidth shaping (tc HTB): named profiles, uplink rate and the ifb device for uploads
+wg_rate_profiles: str = os.getenv('WG_RATE_PROFILES', '')  # e.g. basic=10m/2m,premium=100m/20m
+wg_link_rate: str = os.getenv('WG_LINK_RATE') or '1g'
+wg_ifb_device: str = os.getenv('WG_IFB_DEVICE') or 'ifb0'
+
+# Firewall backend: iptables (static PostUp rules) or nftables (bot-managed table with per-client access)
+wg_firewall: str = os.getenv('WG_FIREWALL') or 'iptables'
+wg_lan_networks: str = os.getenv('WG_LAN_NETWORKS', '')  # e.g. 192.168.0.0/16,10.0.0.0/8: only "lan" clients reach them
+wg_wan_interface: str = os.getenv('WG_WAN_INTERFACE', '')  # default: interface of the default route
+
+# Split-tunnel route profiles: name=ranges;name=ranges, '-' excludes (aliases: all, lan, rfc1918, multicast)
+wg_route_profiles: str = os.getenv('WG_ROUTE_PROFILES', '')  # e.g. corp=10.10.0.0/16 172.20.0.0/14
+
+# Client config rendering: defaults of the "default" profile and named profiles
+wg_client_dns: str = os.getenv('WG_CLIENT_DNS') or '8.8.8.8'
+wg_client_mtu: int = int(os.getenv('WG_CLIENT_MTU') or '1332')
+wg_client_keepalive: int = int(os.getenv('WG_CLIENT_KEEPALIVE') or '20')
+wg_endpoint: str = os.getenv('WG_ENDPOINT', '')  # host[:port], default: server public IP and ListenPort
+wg_preshared_keys: bool = (os.getenv('WG_PRESHARED_KEYS') or '').lower() in ('1', 'true', 'yes')  # PSK for new clients
+wg_key_pool_size: int = int(os.getenv('WG_KEY_POOL_SIZE') or '16')  # keypairs generated ahead, 0 disables
+wg_presence_interval: int = int(os.getenv('WG_PRESENCE_INTERVAL') or '300')  # seconds between presence digests
+wg_presence_stale_minutes: float = float(os.getenv('WG_PRESENCE_STALE_MINUTES') or '5')  # no handshake -> offline
+wg_endpoint_ttl_hours: float = float(os.getenv('WG_ENDPOINT_TTL_HOURS') or '6')  # re-discovery period of the public IP
+wg_config_profiles: str = os.getenv('WG_CONFIG_PROFILES', '')  # e.g. mobile:mtu=1280,keepalive=25;office:route=corp
+
 # Validation
 if not api_tg:
     print("Warning: TELEGRAM_BOT_TOKEN environment variable not set")
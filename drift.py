@@ -0,0 +1,111 @@
+import re
+from typing import Dict, List, Mapping, NamedTuple, Optional, Set, Tuple
+
+from peer_stats import PeerStat
+
+MISSING_PEER = 'missing_peer'            # client config without a [Peer] in wg0.conf
+ORPHAN_PEER = 'orphan_peer'              # [Peer] whose address belongs to no client
+PEER_KEY = 'peer_key'                    # [Peer] of a client address with another public key
+KEY_PAIR = 'key_pair'                    # *_publickey does not match *_privatekey
+MISSING_KEYS = 'missing_keys'            # client config without its key files
+DUPLICATE_ADDRESS = 'duplicate_address'  # one address held by several clients or peers
+NOT_APPLIED = 'not_applied'              # wg0.conf and the live interface differ
+LISTING = 'listing'                      # configs.txt does not match the client configs
+
+# Fixed by one rewrite of wg0.conf and the key files plus one apply; the rest needs a decision
+REPAIRABLE = {MISSING_PEER, ORPHAN_PEER, PEER_KEY, KEY_PAIR, NOT_APPLIED, LISTING}
+
+LEGACY_LISTING_LINE = re.compile(r'^(\d+\.\d+\.\d+\.\d+)\s*=\s*(\S+)$')   # "10.0.0.2 = name" (add_cl.sh)
+LISTING_LINE = re.compile(r'^\s+([A-Za-z0-9_-]+):\s*(\d+\.\d+\.\d+\.\d+)')  # "  name: 10.0.0.2, fd00::2"
+
+
+class DriftIssue(NamedTuple):
+    kind: str
+    name: Optional[str]     # client name(s), None for a peer no client owns
+    address: Optional[str]
+    detail: str = ''
+
+
+class Sources(NamedTuple):
+    """One read of every place a client lives in"""
+    clients: Mapping[str, str]               # *_cl.conf: name -> address
+    peers: List[Tuple[str, Optional[str]]]   # wg0.conf [Peer] blocks: (public key, address)
+    public_keys: Mapping[str, str]           # *_publickey contents
+    derived_keys: Mapping[str, str]          # public keys derived from *_privatekey
+    live: Optional[Mapping[str, PeerStat]]   # `wg show wg0 dump`, None if the interface is down
+    listing: Optional[Mapping[str, str]]     # configs.txt: name -> address, None without the file
+    disabled: Set[str]                       # clients whose peer is out of wg0.conf on purpose
+
+
+def parse_listing(text: str) -> Dict[str, str]:
+    """Client entries of configs.txt, as written by recreate_configs or appended by add_cl.sh"""
+    entries = {}
+    for line in text.splitlines():
+        match = LISTING_LINE.match(line)
+        if match:
+            entries[match.group(1)] = match.group(2)
+            continue
+        match = LEGACY_LISTING_LINE.match(line.strip())
+        if match:
+            entries[match.group(2)] = match.group(1)
+    return entries
+
+
+def detect_drift(sources: Sources) -> List[DriftIssue]:
+    """Compare all sources through address and key indexes built in one pass over each"""
+    issues = []
+
+    holders: Dict[str, List[str]] = {}
+    for name, address in sources.clients.items():
+        holders.setdefault(address, []).append(name)
+    for address, names in holders.items():
+        if len(names) > 1:
+            issues.append(DriftIssue(DUPLICATE_ADDRESS, ', '.join(sorted(names)), address, '*_cl.conf'))
+
+    peer_keys: Dict[str, List[str]] = {}
+    for public_key, address in sources.peers:
+        peer_keys.setdefault(address or '', []).append(public_key)
+    for address, keys in peer_keys.items():
+        if address and len(keys) > 1:
+            issues.append(DriftIssue(DUPLICATE_ADDRESS, None, address, 'wg0.conf'))
+
+    for name, address in sources.clients.items():
+        public_key, derived = sources.public_keys.get(name), sources.derived_keys.get(name)
+        if public_key is None or derived is None:
+            issues.append(DriftIssue(MISSING_KEYS, name, address,
+                                     'publickey' if public_key is None else 'privatekey'))
+        elif public_key != derived:
+            issues.append(DriftIssue(KEY_PAIR, name, address))
+        expected = derived or public_key
+        if name in sources.disabled:
+            continue
+        keys = peer_keys.get(address)
+        if not keys:
+            issues.append(DriftIssue(MISSING_PEER, name, address))
+        elif expected and expected not in keys:
+            issues.append(DriftIssue(PEER_KEY, name, address, keys[0]))
+
+    for public_key, address in sources.peers:
+        if address not in holders:
+            issues.append(DriftIssue(ORPHAN_PEER, None, address, public_key))
+
+    if sources.live is not None:
+        wanted = dict(sources.peers)
+        for public_key, address in wanted.items():
+            stat = sources.live.get(public_key)
+            if stat is None:
+                issues.append(DriftIssue(NOT_APPLIED, None, address, 'wg0.conf only'))
+            elif stat.address != address:
+                issues.append(DriftIssue(NOT_APPLIED, None, address, f"live {stat.address}"))
+        for public_key, stat in sources.live.items():
+            if public_key not in wanted:
+                issues.append(DriftIssue(NOT_APPLIED, None, stat.address, 'live only'))
+
+    if sources.listing is not None:
+        for name, address in sources.clients.items():
+            if sources.listing.get(name) != address:
+                issues.append(DriftIssue(LISTING, name, address, sources.listing.get(name) or 'missing'))
+        for name, address in sources.listing.items():
+            if name not in sources.clients:
+                issues.append(DriftIssue(LISTING, name, address, 'no client'))
+    return issues
@@ -0,0 +1,131 @@
+import ipaddress
+import json
+import logging
+import os
+import threading
+import time
+import urllib.request
+from pathlib import Path
+from typing import Iterable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Plain-text "what is my IP" services, tried in order: IPv4-only hosts first (like the
+# scripts' `curl -4`), a dual-stack one last for IPv6-only servers
+DISCOVERY_URLS = ('https://api.ipify.org', 'https://ipv4.icanhazip.com', 'https://ifconfig.me/ip')
+CACHE_PATH = Path("/etc/wireguard/endpoint.json")
+FALLBACK = "YOUR_SERVER_IP"
+
+
+def read_variables_address(paths: Iterable[Path] = (Path("variables.sh"), Path("scripts/variables.sh"))) -> Optional[str]:
+    """ip_address_glob written by start_wg.sh"""
+    for variables_path in paths:
+        if not variables_path.exists():
+            continue
+        for line in variables_path.read_text(encoding='utf-8').splitlines():
+            key, _, value = line.partition('=')
+            if key.strip() == 'ip_address_glob' and value.strip():
+                return value.strip().strip('"')
+    return None
+
+
+def parse_address(text: str) -> Optional[str]:
+    """Normalized IP address, None for anything else (error pages, captive portals)"""
+    try:
+        return str(ipaddress.ip_address(text.strip()))
+    except ValueError:
+        return None
+
+
+def format_endpoint(endpoint: str, port: int) -> str:
+    """host[:port] as a config Endpoint: the port is added when missing, IPv6 literals get brackets"""
+    address = parse_address(endpoint.strip('[]'))
+    if address is not None:
+        return f"[{address}]:{port}" if ':' in address else f"{address}:{port}"
+    if endpoint.startswith('['):
+        return endpoint if ']:' in endpoint else f"{endpoint}:{port}"
+    return endpoint if ':' in endpoint else f"{endpoint}:{port}"
+
+
+def discover_public_address(urls: Iterable[str] = DISCOVERY_URLS, timeout: float = 5) -> Optional[str]:
+    for url in urls:
+        try:
+            with urllib.request.urlopen(url, timeout=timeout) as response:
+                text = response.read(64).decode('ascii', 'replace')
+        except (OSError, ValueError) as e:
+            logger.warning(f"Public address lookup via {url} failed: {e}")
+            continue
+        address = parse_address(text)
+        if address:
+            return address
+        logger.warning(f"Public address lookup via {url} returned no address: {text.strip()[:32]!r}")
+    return None
+
+
+class EndpointCache:
+    """Server public address, resolved off the provisioning path.
+
+    An override is returned as is. Otherwise lookups only read the cached
+    value (persisted across restarts); the network is queried by refresh(),
+    which runs from the background scheduler once the TTL has passed.
+    """
+
+    def __init__(self, override: str = '', ttl: float = 6 * 3600, path: Path = CACHE_PATH):
+        self.override = override.strip()
+        self.ttl = ttl
+        self.path = path
+        self._address: Optional[str] = None
+        self._resolved_at = 0.0
+        self._lock = threading.Lock()
+        self._load()
+
+    def _load(self):
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            # A cache written before addresses were validated may hold anything; it is re-resolved then
+            address = parse_address(str(data['address']))
+            if address:
+                self._address, self._resolved_at = address, float(data['resolved_at'])
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Error loading endpoint cache: {e}")
+
+    def _save(self):
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump({'address': self._address, 'resolved_at': int(self._resolved_at)}, f)
+        os.replace(temp_path, self.path)
+
+    def get(self) -> str:
+        """Never blocks on network I/O"""
+        if self.override:
+            return self.override
+        return self._address or read_variables_address() or FALLBACK
+
+    def status(self) -> Tuple[str, float]:
+        """Current address and when it was resolved (0 for an override or a fallback)"""
+        if self.override:
+            return self.override, 0
+        return self.get(), self._resolved_at if self._address else 0
+
+    def stale(self) -> bool:
+        return not self.override and time.time() - self._resolved_at >= self.ttl
+
+    def refresh(self, force: bool = False) -> str:
+        """Re-resolve the address when the TTL has passed; keeps the old value if discovery fails"""
+        if not force and not self.stale():
+            return self.get()
+        address = discover_public_address()
+        if address:
+            with self._lock:
+                changed = address != self._address
+                self._address, self._resolved_at = address, time.time()
+                try:
+                    self._save()
+                except OSError as e:
+                    logger.error(f"Error saving endpoint cache: {e}")
+            if changed:
+                logger.info(f"Public address resolved: {address}")
+        return self.get()
@@ -0,0 +1,74 @@
+import heapq
+import re
+import threading
+from typing import Dict, Iterable, List, Optional, Tuple
+
+DURATION_UNITS = {'m': 60, 'h': 3600, 'd': 86400, 'w': 7 * 86400}
+DURATION_RE = re.compile(r'^(\d+)([mhdw])$')
+
+
+def parse_duration(text: str) -> Optional[int]:
+    """Parse a lifetime like `90m`, `12h`, `30d` or `2w` into seconds; None if it is not one"""
+    match = DURATION_RE.match(text.strip().lower())
+    if not match or int(match.group(1)) == 0:
+        return None
+    return int(match.group(1)) * DURATION_UNITS[match.group(2)]
+
+
+class ExpiryQueue:
+    """Client expiry times in a min-heap.
+
+    Rescheduling or cancelling does not touch the heap: stale entries are
+    skipped when they reach the top, so every operation stays O(log n) and
+    loading n clients is a single O(n) heapify.
+    """
+
+    def __init__(self):
+        self._heap: List[Tuple[int, str]] = []
+        self._expires: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._expires)
+
+    def load(self, items: Iterable[Tuple[str, int]]):
+        with self._lock:
+            self._expires = {name: int(expires) for name, expires in items}
+            self._heap = [(expires, name) for name, expires in self._expires.items()]
+            heapq.heapify(self._heap)
+
+    def expires_at(self, name: str) -> Optional[int]:
+        return self._expires.get(name)
+
+    def schedule(self, name: str, expires: int):
+        with self._lock:
+            self._expires[name] = int(expires)
+            heapq.heappush(self._heap, (int(expires), name))
+            self._compact()
+
+    def cancel(self, name: str):
+        with self._lock:
+            self._expires.pop(name, None)
+
+    def pop_due(self, now: float) -> List[str]:
+        """Remove and return every client whose expiry time has passed"""
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                expires, name = heapq.heappop(self._heap)
+                if self._expires.get(name) == expires:
+                    del self._expires[name]
+                    due.append(name)
+        return due
+
+    def upcoming(self, limit: int = 5) -> List[Tuple[str, int]]:
+        """Nearest expirations as (name, expires), soonest first"""
+        with self._lock:
+            live = ((expires, name) for expires, name in self._heap if self._expires.get(name) == expires)
+            return [(name, expires) for expires, name in heapq.nsmallest(limit, live)]
+
+    def _compact(self):
+        # Rebuild once stale entries outnumber live ones
+        if len(self._heap) > 2 * len(self._expires) + 64:
+            self._heap = [(expires, name) for name, expires in self._expires.items()]
+            heapq.heapify(self._heap)
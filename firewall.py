@@ -0,0 +1,121 @@
+import subprocess
+from typing import Dict, Iterable, List, Optional, Tuple
+
+TABLE = 'wg_bot'
+RULESET_PATH = '/etc/wireguard/wg_bot.nft'
+
+# Client access levels and the verdict each one maps to
+ACCESS_VERDICTS = {
+    'blocked': 'drop',   # no forwarding at all
+    'lan': 'accept',     # allowed into WG_LAN_NETWORKS as well
+}
+
+
+def _family(address: str) -> str:
+    return 'ip6' if ':' in address else 'ip'
+
+
+def _map_name(address: str) -> str:
+    return 'access6' if ':' in address else 'access4'
+
+
+def _elements(items: Iterable[str]) -> str:
+    items = list(items)
+    return f"elements = {{ {', '.join(items)} }}" if items else ""
+
+
+def _names(items: List[str]) -> str:
+    quoted = [f'"{item}"' for item in items]
+    return quoted[0] if len(quoted) == 1 else f"{{ {', '.join(quoted)} }}"
+
+
+def build_ruleset(interfaces: List[str], wan_interface: str, listen_ports: List[int],
+                  access: Dict[str, str], lan_networks: Iterable[str] = ()) -> str:
+    """Render the whole bot table for `nft -f`.
+
+    Per-client access lives in verdict maps keyed by the client address, so a
+    packet is classified with one lookup whatever the number of clients, and
+    changing a client is a single element update. The table is added, deleted
+    and redefined in one script, which nft applies as one transaction.
+    """
+    access4 = [f"{address} : {ACCESS_VERDICTS[level]}" for address, level in access.items() if _family(address) == 'ip']
+    access6 = [f"{address} : {ACCESS_VERDICTS[level]}" for address, level in access.items() if _family(address) == 'ip6']
+    lan4 = [network for network in lan_networks if ':' not in network]
+    lan6 = [network for network in lan_networks if ':' in network]
+    interface = _names(interfaces)
+
+    forward = [
+        f'iifname {interface} ip saddr vmap @access4',
+        f'iifname {interface} ip6 saddr vmap @access6',
+    ]
+    # Without a LAN list every client may reach everything, as with the old iptables rules
+    if lan4:
+        forward.append(f'iifname {interface} ip daddr @lan4 drop')
+    if lan6:
+        forward.append(f'iifname {interface} ip6 daddr @lan6 drop')
+    forward += [
+        f'iifname {interface} accept',
+        f'oifname {interface} ct state established,related accept',
+        f'iifname "{wan_interface}" oifname {interface} accept',
+    ]
+
+    lines = [
+        f"table inet {TABLE}",
+        f"delete table inet {TABLE}",
+        f"table inet {TABLE} {{",
+        f"    map access4 {{ type ipv4_addr : verdict; {_elements(access4)} }}",
+        f"    map access6 {{ type ipv6_addr : verdict; {_elements(access6)} }}",
+        f"    set lan4 {{ type ipv4_addr; flags interval; {_elements(lan4)} }}",
+        f"    set lan6 {{ type ipv6_addr; flags interval; {_elements(lan6)} }}",
+        "    chain input {",
+        "        type filter hook input priority 0; policy accept;",
+        f"        udp dport {{ {', '.join(str(port) for port in listen_ports)} }} accept",
+        "    }",
+        "    chain forward {",
+        "        type filter hook forward priority 0; policy accept;",
+    ]
+    lines += [f"        {rule}" for rule in forward]
+    lines += [
+        "    }",
+        "    chain postrouting {",
+        "        type nat hook postrouting priority srcnat; policy accept;",
+        f'        oifname "{wan_interface}" masquerade',
+        "    }",
+        "}",
+    ]
+    return "\n".join(lines) + "\n"
+
+
+def build_access_update(removed: Iterable[str], added: Dict[str, str]) -> str:
+    """Element changes for the access maps, applied as one transaction.
+
+    `removed` must only hold addresses that are currently in a map: nft
+    rejects deleting missing elements, which would abort the whole batch.
+    """
+    lines = [
+        f"delete element inet {TABLE} {_map_name(address)} {{ {address} }}"
+        for address in removed
+    ]
+    lines += [
+        f"add element inet {TABLE} {_map_name(address)} {{ {address} : {ACCESS_VERDICTS[level]} }}"
+        for address, level in added.items()
+    ]
+    return "\n".join(lines) + "\n" if lines else ""
+
+
+def apply_nft(script: str) -> Tuple[bool, str]:
+    result = subprocess.run(['nft', '-f', '-'], input=script, capture_output=True, text=True)
+    return result.returncode == 0, result.stderr.strip()
+
+
+def detect_wan_interface() -> Optional[str]:
+    """Interface of the default route"""
+    result = subprocess.run(['ip', '-o', 'route', 'show', 'default'], capture_output=True, text=True)
+    fields = result.stdout.split()
+    if 'dev' in fields and fields.index('dev') + 1 < len(fields):
+        return fields[fields.index('dev') + 1]
+    return None
+
+
+def parse_networks(spec: str) -> List[str]:
+    return [network.strip() for network in spec.split(',') if network.strip()]
@@ -0,0 +1,219 @@
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from typing import Any, Callable, Dict, List, NamedTuple, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+JOBS_DIR = Path("/etc/wireguard/jobs")
+
+RUNNING, DONE, CANCELLED, FAILED = 'running', 'done', 'cancelled', 'failed'
+KEEP_FINISHED = 20
+
+
+class Job:
+    """A long operation split into items, checkpointed as it goes"""
+
+    def __init__(self, kind: str, chat_id: int, items: List[Any], params: Optional[dict] = None,
+                 job_id: Optional[str] = None):
+        self.id = job_id or uuid.uuid4().hex[:8]
+        self.kind = kind
+        self.chat_id = chat_id
+        self.items = items
+        self.params = params or {}
+        self.position = 0
+        self.results: Dict[str, list] = {}
+        self.state = RUNNING
+        self.error: Optional[str] = None
+        self.message_id: Optional[int] = None  # progress message
+        self.created = time.time()
+        self.reported_at = 0.0
+        self.checkpointed_at = 0.0
+
+    @property
+    def total(self) -> int:
+        return len(self.items)
+
+    def count(self, bucket: str) -> int:
+        return len(self.results.get(bucket, []))
+
+    def to_dict(self) -> dict:
+        return {
+            'id': self.id, 'kind': self.kind, 'chat_id': self.chat_id, 'items': self.items,
+            'params': self.params, 'position': self.position, 'results': self.results,
+            'state': self.state, 'message_id': self.message_id, 'created': self.created,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Job':
+        job = cls(data['kind'], data['chat_id'], data['items'], data.get('params'), data['id'])
+        job.position = data.get('position', 0)
+        job.results = data.get('results', {})
+        job.state = data.get('state', RUNNING)
+        job.message_id = data.get('message_id')
+        job.created = data.get('created', job.created)
+        return job
+
+
+class JobHandler(NamedTuple):
+    # step(job, item) -> (result bucket, entry); an exception is recorded in the "failed" bucket
+    # as {'name': describe(item), 'item': item, 'error': message}, the shape steps use for failures
+    step: Callable[[Job, Any], Tuple[str, Any]]
+    # finish(job) runs once after the last item, after a cancel, or after a resume that found nothing left
+    finish: Callable[[Job], None]
+    cancellable: bool = True
+    # Stop at the first failed step (state "failed") instead of recording it and going on
+    stop_on_error: bool = False
+    # Name of an item in reports
+    describe: Callable[[Any], str] = str
+
+
+class JobEngine:
+    """Runs long operations off the Telegram handler thread.
+
+    Jobs run one at a time in a worker thread, since they all edit the same
+    WireGuard files; each step and the finish hold `lock`, which callers
+    share with their other edits of those files so the two never interleave.
+    The job is written to JOBS_DIR at most once per `checkpoint_interval`
+    seconds (a checkpoint holds every item, so saving after each one would
+    make large jobs quadratic); a job interrupted by a restart is resumed from
+    the last checkpoint, so steps must tolerate running again for items done
+    since then. Progress is reported at most once per `progress_interval`
+    seconds.
+    """
+
+    def __init__(self, report: Callable[[Job, bool], None], directory: Path = JOBS_DIR,
+                 progress_interval: float = 3.0, checkpoint_interval: float = 1.0,
+                 lock: Optional[threading.RLock] = None):
+        self.report = report
+        self.lock = lock or threading.RLock()
+        self.directory = directory
+        self.progress_interval = progress_interval
+        self.checkpoint_interval = checkpoint_interval
+        self.handlers: Dict[str, JobHandler] = {}
+        self._jobs: Dict[str, Job] = {}
+        self._cancelled = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='jobs')
+
+    def register(self, kind: str, handler: JobHandler):
+        self.handlers[kind] = handler
+
+    def submit(self, kind: str, chat_id: int, items: List[Any], params: Optional[dict] = None,
+               message_id: Optional[int] = None) -> Job:
+        job = Job(kind, chat_id, items, params)
+        job.message_id = message_id
+        with self._lock:
+            # Finished jobs stay listed for /jobs until newer ones push them out
+            finished = [old for old in self._jobs.values() if old.state != RUNNING]
+            for old in sorted(finished, key=lambda old: old.created)[:max(0, len(finished) - KEEP_FINISHED)]:
+                del self._jobs[old.id]
+            self._jobs[job.id] = job
+        self._checkpoint(job)
+        self._executor.submit(self._run, job)
+        return job
+
+    def resume(self) -> List[Job]:
+        """Queue the jobs left unfinished by a previous run"""
+        resumed = []
+        if not self.directory.exists():
+            return resumed
+        for path in sorted(self.directory.glob('*.json')):
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    job = Job.from_dict(json.load(f))
+            except (OSError, ValueError, KeyError) as e:
+                logger.error(f"Error loading job {path}: {e}")
+                continue
+            if job.state != RUNNING or job.kind not in self.handlers:
+                continue
+            with self._lock:
+                self._jobs[job.id] = job
+            self._executor.submit(self._run, job)
+            resumed.append(job)
+            logger.info(f"Resuming job {job.id} ({job.kind}) at {job.position}/{job.total}")
+        return resumed
+
+    def cancel(self, job_id: str) -> bool:
+        job = self.get(job_id)
+        if job is None or job.state != RUNNING or not self.handlers[job.kind].cancellable:
+            return False
+        with self._lock:
+            self._cancelled.add(job_id)
+        return True
+
+    def get(self, job_id: str) -> Optional[Job]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def jobs(self) -> List[Job]:
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: job.created)
+
+    def _checkpoint(self, job: Job):
+        job.checkpointed_at = time.monotonic()
+        try:
+            self.directory.mkdir(mode=0o700, parents=True, exist_ok=True)
+            path = self.directory / f"{job.id}.json"
+            tmp_path = path.with_name(path.name + '.tmp')
+            # Items may hold client settings or backup paths, keep them private like the rest of /etc/wireguard
+            fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                json.dump(job.to_dict(), f, ensure_ascii=False, separators=(',', ':'))
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.error(f"Error saving job {job.id}: {e}")
+
+    def _progress(self, job: Job, final: bool = False):
+        now = time.monotonic()
+        if not final and now - job.reported_at < self.progress_interval:
+            return
+        job.reported_at = now
+        try:
+            self.report(job, final)
+        except Exception as e:
+            logger.error(f"Error reporting job {job.id}: {e}")
+
+    def _run(self, job: Job):
+        handler = self.handlers[job.kind]
+        try:
+            while job.position < job.total:
+                if job.id in self._cancelled:
+                    job.state = CANCELLED
+                    break
+                item = job.items[job.position]
+                try:
+                    with self.lock:
+                        bucket, entry = handler.step(job, item)
+                except Exception as e:
+                    logger.error(f"Job {job.id} ({job.kind}) failed on {item}: {e}")
+                    if handler.stop_on_error:
+                        job.state, job.error = FAILED, str(e)
+                        break
+                    bucket, entry = 'failed', {'name': handler.describe(item), 'item': item, 'error': str(e)}
+                job.results.setdefault(bucket, []).append(entry)
+                job.position += 1
+                if time.monotonic() - job.checkpointed_at >= self.checkpoint_interval:
+                    self._checkpoint(job)
+                self._progress(job)
+            if job.state == RUNNING:
+                job.state = DONE
+            with self.lock:
+                handler.finish(job)
+        except Exception as e:
+            logger.error(f"Job {job.id} ({job.kind}) failed: {e}")
+            job.state = FAILED
+            job.error = str(e)
+        finally:
+            with self._lock:
+                self._cancelled.discard(job.id)
+            try:
+                (self.directory / f"{job.id}.json").unlink()
+            except OSError:
+                pass
+            self._progress(job, final=True)
@@ -2,13 +2,61 @@ import telebot
 from telebot import types
 import subprocess
 import os
+import ipaddress
+import itertools
 import glob
 import qrcode
 import logging
+import io
+import time
+import re
+import heapq
+import csv
+import functools
+import threading
+import tempfile
+import json
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
+from types import SimpleNamespace
 from typing import Optional
 from datetime import datetime
-from config import api_tg, mainid, wg_local_ip_hint
+from config import (api_tg, mainid, wg_address_pool, wg_address_pool6,
+                    wg_agents, wg_agent_secret, wg_agent_ca, wg_fleet_local, wg_placement,
+                    wg_idle_days, wg_reaper_mode, wg_reaper_interval_hours,
+                    wg_rate_profiles, wg_link_rate, wg_ifb_device,
+                    wg_firewall, wg_lan_networks, wg_wan_interface, wg_route_profiles,
+                    wg_client_dns, wg_client_mtu, wg_client_keepalive, wg_endpoint, wg_config_profiles,
+                    wg_endpoint_ttl_hours, wg_key_pool_size, wg_preshared_keys,
+                    wg_presence_interval, wg_presence_stale_minutes)
+from address_pool import AddressPool, AddressPoolError
+from agent import LocalNode, NodeFleet, parse_agents
+from peer_stats import read_wg_dump
+from name_index import NameIndex
+from client_store import ClientStore
+from scheduler import BackgroundScheduler
+from wg_conf import (split_peers, join_peers, peer_address, peer_field, peer_public_key,
+                     set_interface_field, set_peer_field)
+from expiry import ExpiryQueue, parse_duration
+from shaping import (MAX_SHAPED_CLIENTS, RateLimit, number_classes, parse_limit, parse_profiles, parse_rate,
+                     build_tc_batch, apply_tc_batch)
+from firewall import (RULESET_PATH, build_ruleset, build_access_update, apply_nft,
+                      detect_wan_interface, parse_networks)
+from routing import parse_route_profiles
+from client_config import ConfigProfile, parse_config_profiles, render_client_config, write_if_changed, read_key
+from wg_keys import DerivedKeyCache, KeyPool, generate_keypair, generate_preshared_key, write_key
+from endpoint import EndpointCache, format_endpoint
+from accounting import TrafficLedger, parse_period
+from charts import render_activity_heatmap, render_throughput_chart
+from presence import ONLINE, OFFLINE, PresenceWatcher, RateLimiter, Subscriptions
+from jobs import CANCELLED, DONE, FAILED, RUNNING, JobEngine, JobHandler
+from reconcile import compute_plan, find_conflicts, parse_document, parse_expires
+from bulk_import import IMPORT_COLUMNS, iter_import_rows
+from tags import TagIndex, parse_tags
+from client_selector import Candidate, parse_selectors, required_facts, select
+from drift import (KEY_PAIR, LISTING, MISSING_PEER, ORPHAN_PEER, PEER_KEY, REPAIRABLE,
+                   Sources, detect_drift, parse_listing)
 
 
 logging.basicConfig(
@@ -21,16 +69,257 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Inline keyboard pagination
+IP_PAGE_SIZE = 15
+MONITOR_PAGE_SIZE = 10
+
+# A peer counts as online if its latest handshake is newer than this, seconds
+ONLINE_WINDOW = 180
+
+# How often latest handshakes are persisted as "last seen", seconds
+LAST_SEEN_INTERVAL = 300
+
+# How often due client expirations are processed, seconds
+EXPIRY_INTERVAL = 60
+
+# How often the shaping tree is checked (wg-quick down/up outside the bot drops it), seconds
+SHAPING_CHECK_INTERVAL = 60
+
+# /access levels: None removes the client from the access maps
+ACCESS_LEVELS = {'block': 'blocked', 'lan': 'lan', 'default': None}
+
+# Per-client key files in /etc/wireguard: <name>_<suffix>
+CLIENT_KEY_FILES = ('privatekey', 'publickey', 'presharedkey')
+
+# Entries of /etc/wireguard a restore keeps: job checkpoints (the restore's own included),
+# presence subscriptions and the endpoint cache are not part of a backup
+RESTORE_KEEP = ('jobs', 'presence.json', 'endpoint.json')
+
+# Traffic accounting sample period, seconds; counters are also sampled right before restarts
+TRAFFIC_SAMPLE_INTERVAL = 300
+TRAFFIC_TOP = 10
+# Entries per ranking in the statistics view
+RANKING_SIZE = 5
+
+# Statistics charts: period in seconds and title; the activity heatmap shows the busiest clients
+CHART_PERIODS = {'24h': (86400, "Throughput, 24h"), '7d': (7 * 86400, "Throughput, 7d")}
+HEATMAP_ROWS = 30
+
+# Presence: snapshots are diffed this often, events are sent as one digest every WG_PRESENCE_INTERVAL
+PRESENCE_POLL_INTERVAL = 30
+PRESENCE_DIGEST_LINES = 40
+# Bot-initiated messages (digests, notifications): sends per second and burst size
+NOTIFY_RATE, NOTIFY_BURST = 1.0, 5
+
+# Top-up period of the pre-generated keypair pool
+KEY_POOL_INTERVAL = 30
+
+# How often the public address cache is checked; it is re-resolved only after WG_ENDPOINT_TTL_HOURS
+ENDPOINT_CHECK_INTERVAL = 600
+
+# Server key rotation with a grace period: the new key runs on a second interface until clients move over
+ROTATION_STATE_PATH = Path("/etc/wireguard/rotation.json")
+GRACE_INTERFACE = 'wg1'
+RENDER_WORKERS = 8
+
+# Background jobs: titles, result bucket labels and the restore phases (one checkpoint each)
+JOB_TITLES = {
+    'bulk_create': "Массовое создание клиентов",
+    'bulk_delete': "Массовое удаление клиентов",
+    'restore': "Импорт конфигурации",
+    'install': "Установка WireGuard",
+    'reconcile': "Применение желаемого состояния",
+}
+JOB_BUCKETS = {'created': "✅ Создано", 'updated': "✏️ Изменено", 'deleted': "🗑 Удалено", 'failed': "❌ Ошибок"}
+JOB_STATES = {RUNNING: "⏳ Выполняется", DONE: "✅ Завершено", CANCELLED: "⛔ Отменено", FAILED: "❌ Ошибка"}
+RESTORE_PHASES = [
+    ('stop', "🛑 Остановка WireGuard сервиса"),
+    ('server', "🔧 Восстановление конфигурации сервера"),
+    ('clients', "👥 Восстановление клиентских конфигураций"),
+    ('variables', "📝 Восстановление переменных"),
+    ('metadata', "🗂 Восстановление метаданных клиентов"),
+    ('start', "🚀 Запуск WireGuard сервиса"),
+]
+
+# Consistency check of wg0.conf, client files, configs.txt and the live interface
+DRIFT_CHECK_INTERVAL = 3600
+DRIFT_REPORT_LINES = 15
+DRIFT_LABELS = {
+    'missing_peer': "нет [Peer] в wg0.conf",
+    'orphan_peer': "[Peer] без клиента",
+    'peer_key': "в wg0.conf другой ключ",
+    'key_pair': "publickey не от privatekey",
+    'missing_keys': "нет файла ключа",
+    'duplicate_address': "адрес занят дважды",
+    'not_applied': "wg0.conf не применён",
+    'listing': "расхождение с configs.txt",
+}
+
+# Bulk creation from an uploaded CSV/TXT file
+IMPORT_MAX_BYTES = 10 * 1024 * 1024
+IMPORT_PSK_VALUES = ('1', 'yes', 'true', 'psk', 'да')
+
+# Clients listed per section of a desired-state preview
+RECONCILE_PREVIEW_LINES = 10
+
+# Clients listed by /tag list
+TAG_LIST_LINES = 50
+
+MONITOR_SORTS = {'name': "Имя", 'ip': "IP", 'hs': "Handshake", 'traffic': "Трафик"}
+MONITOR_FILTERS = {'all': "Все", 'on': "Онлайн", 'off': "Офлайн", 'never': "Не подключались"}
+
+def with_state_lock(method):
+    """Run a WireGuardBot method under the server-state lock"""
+    @functools.wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.state_lock:
+            return method(self, *args, **kwargs)
+    return wrapper
+
+
 class WireGuardBot:
-    def __init__(self, token: str, authorized_users: list, wg_ip_hint: str):
-        self.bot = telebot.TeleBot(token)
+    def __init__(self, token: Optional[str], authorized_users: list, address_pool: str, address_pool6: str = ''):
+        # Without a token the instance runs headless (agent mode): peer operations only
+        self.bot = telebot.TeleBot(token) if token else None
         self.authorized_users = authorized_users
-        self.wg_ip_hint = wg_ip_hint
-        self.setup_handlers()
+        # Held around every read-modify-write of wg0.conf, client files, configs.txt, the store and
+        # the pool and around applying them: job steps, the scheduler and handlers all edit them
+        self.state_lock = threading.RLock()
+        self.pool = AddressPool(address_pool, network6=address_pool6 or None)
+        self.name_index = NameIndex()
+        self.store = ClientStore()
+        self.expiry = ExpiryQueue()
+        self.load_expiry()
+        self.tag_index = TagIndex()
+        self.load_tags()
+        self.scheduler = BackgroundScheduler()
+        self.fleet = None
+        self.shaping_active = False
+        self.rotation = self.load_rotation_state()
+        self.endpoint = EndpointCache(wg_endpoint, wg_endpoint_ttl_hours * 3600)
+        self.key_pool = KeyPool(wg_key_pool_size)
+        self.traffic = TrafficLedger()
+        self.chart_cache = {}
+        self.presence = PresenceWatcher(wg_presence_stale_minutes * 60)
+        self.presence_events = []
+        self.subscriptions = Subscriptions()
+        self.notify_limiter = RateLimiter(NOTIFY_RATE, NOTIFY_BURST)
+        self.jobs = JobEngine(self.report_job, lock=self.state_lock)
+        self.jobs.register('bulk_create', JobHandler(self.bulk_create_step, self.bulk_create_finish,
+                                                     describe=lambda client: client["name"]))
+        self.jobs.register('bulk_delete', JobHandler(self.bulk_delete_step, self.bulk_delete_finish,
+                                                     describe=lambda item: item[0]))
+        self.jobs.register('restore', JobHandler(self.restore_step, self.restore_finish,
+                                                 cancellable=False, stop_on_error=True))
+        self.jobs.register('install', JobHandler(self.install_step, self.install_finish,
+                                                 cancellable=False, stop_on_error=True))
+        self.jobs.register('reconcile', JobHandler(self.reconcile_step, self.reconcile_finish,
+                                                   describe=lambda op: op[1]))
+        self.pending_reconcile = {}
+        self.drift_seen = set()
+        self.derived_keys = DerivedKeyCache()
+        self.drift_notified = set()
+        try:
+            self.rate_profiles = parse_profiles(wg_rate_profiles)
+        except ValueError as e:
+            logger.error(f"Invalid WG_RATE_PROFILES: {e}")
+            self.rate_profiles = {}
+        try:
+            self.route_profiles = parse_route_profiles(wg_route_profiles)
+        except ValueError as e:
+            logger.error(f"Invalid WG_ROUTE_PROFILES: {e}")
+            self.route_profiles = parse_route_profiles('')
+        default_profile = ConfigProfile('default', wg_client_dns, wg_client_mtu, wg_client_keepalive, wg_endpoint or None)
+        try:
+            self.config_profiles = parse_config_profiles(wg_config_profiles, default_profile)
+        except ValueError as e:
+            logger.error(f"Invalid WG_CONFIG_PROFILES: {e}")
+            self.config_profiles = {'default': default_profile}
+        self.load_address_pool()
+        if self.bot is not None:
+            self.setup_handlers()
+    
+    def start_background_jobs(self):
+        """Periodic maintenance running next to the polling loop"""
+        self.scheduler.every(LAST_SEEN_INTERVAL, self.update_last_seen, delay=30)
+        self.scheduler.every(TRAFFIC_SAMPLE_INTERVAL, self.sample_traffic)
+        self.scheduler.every(EXPIRY_INTERVAL, self.expire_clients, delay=EXPIRY_INTERVAL)
+        self.scheduler.every(SHAPING_CHECK_INTERVAL, self.ensure_shaping)
+        self.scheduler.every(ENDPOINT_CHECK_INTERVAL, self.refresh_endpoint)
+        if wg_key_pool_size:
+            self.scheduler.every(KEY_POOL_INTERVAL, self.key_pool.fill, name='fill_key_pool')
+        self.scheduler.every(EXPIRY_INTERVAL, self.check_key_migration, delay=EXPIRY_INTERVAL)
+        self.scheduler.every(wg_reaper_interval_hours * 3600, self.reap_idle_peers, delay=600)
+        self.scheduler.every(PRESENCE_POLL_INTERVAL, self.watch_presence)
+        self.scheduler.every(DRIFT_CHECK_INTERVAL, self.check_drift, delay=300)
+        self.scheduler.every(wg_presence_interval, self.send_presence_digest, delay=wg_presence_interval)
+        self.scheduler.start()
+    
+    def load_expiry(self):
+        """Rebuild the expiry queue from the client store (no config scan)"""
+        self.expiry.load((name, record['expires']) for name, record in self.store.items() if record.get('expires'))
+    
+    def load_tags(self):
+        """Rebuild the tag index from the tags stored with each client"""
+        self.tag_index.load((name, record['tags']) for name, record in self.store.items() if record.get('tags'))
+    
+    @with_state_lock
+    def set_client_tags(self, client_name: str, tags: list, save: bool = True):
+        """Store a client's tags and mirror them in the tag index"""
+        self.store.update(client_name, save=save, tags=sorted(tags) or None)
+        self.tag_index.set(client_name, tags)
+    
+    def resolve_client_args(self, args: list) -> list:
+        """Client names from command arguments: names, `tag:<tag>` groups (index lookups) or all/*"""
+        if args and args[0].lower() in ('all', '*'):
+            return [name for name, _ in self.pool.items()]
+        names = []
+        for arg in args:
+            if arg.lower().startswith('tag:'):
+                names.extend(sorted(self.tag_index.names(arg[4:].lower())))
+            else:
+                names.append(self.sanitize_input(arg))
+        return list(dict.fromkeys(names))
+    
+    def notify_admins(self, text: str, markup=None):
+        for user_id in self.authorized_users:
+            self.send_limited(user_id, text, markup)
+    
+    def send_limited(self, chat_id, text: str, markup=None):
+        """Send a bot-initiated message through the rate limiter, so bursts stay under Telegram's limits"""
+        self.notify_limiter.acquire()
+        try:
+            self.bot.send_message(chat_id, text, reply_markup=markup, parse_mode='Markdown')
+        except Exception as e:
+            logger.error(f"Error notifying {chat_id}: {e}")
+    
+    def attach_fleet(self, agents: list, include_local: bool = True, placement: str = 'peers'):
+        """Drive remote agents (and optionally this host) as one fleet"""
+        nodes = ([LocalNode(self)] if include_local else []) + agents
+        self.fleet = NodeFleet(nodes, placement)
+        logger.info(f"Fleet mode: {', '.join(self.fleet.nodes)} (placement by {placement})")
     
     def setup_handlers(self):
         self.bot.message_handler(commands=['start'])(self.start_command)
         self.bot.message_handler(commands=['id'])(self.id_command)
+        self.bot.message_handler(commands=['find'])(self.find_command)
+        self.bot.message_handler(commands=['idle'])(self.idle_command)
+        self.bot.message_handler(commands=['disabled'])(self.disabled_command)
+        self.bot.message_handler(commands=['enable'])(self.enable_command)
+        self.bot.message_handler(commands=['rate'])(self.rate_command)
+        self.bot.message_handler(commands=['access'])(self.access_command)
+        self.bot.message_handler(commands=['route'])(self.route_command)
+        self.bot.message_handler(commands=['profile'])(self.profile_command)
+        self.bot.message_handler(commands=['render'])(self.render_command)
+        self.bot.message_handler(commands=['rotate'])(self.rotate_command)
+        self.bot.message_handler(commands=['psk'])(self.psk_command)
+        self.bot.message_handler(commands=['traffic'])(self.traffic_command)
+        self.bot.message_handler(commands=['presence'])(self.presence_command)
+        self.bot.message_handler(commands=['jobs'])(self.jobs_command)
+        self.bot.message_handler(commands=['reconcile'])(self.reconcile_command)
+        self.bot.message_handler(commands=['drift'])(self.drift_command)
+        self.bot.message_handler(commands=['tag'])(self.tag_command)
+        self.bot.inline_handler(func=lambda query: True)(self.handle_inline_query)
         self.bot.message_handler(content_types=['text'])(self.handle_text)
         self.bot.message_handler(content_types=['sticker'])(self.handle_sticker)
         self.bot.callback_query_handler(func=lambda call: True)(self.handle_callback)
@@ -92,12 +381,34 @@ class WireGuardBot:
         return sanitized.lower().strip()
 
     @staticmethod
-    def is_valid_ip_octet(number_str: str) -> bool:
+    def address_sort_key(config_item) -> int:
+        """Sort key for (name, config_info) pairs by client address"""
         try:
-            num = int(number_str)
-            return 2 <= num <= 253
+            return int(ipaddress.ip_address(config_item[1]['ip']))
         except ValueError:
-            return False
+            return 0
+
+    @staticmethod
+    def format_addresses(config_info: dict) -> str:
+        """Client addresses of both families for listings"""
+        if config_info.get('ip6'):
+            return f"{config_info['ip']}, {config_info['ip6']}"
+        return config_info['ip']
+
+    @with_state_lock
+    def load_address_pool(self, configs: Optional[dict] = None):
+        """Rebuild the address pool and name search indexes from existing client configs"""
+        if configs is None:
+            configs = self.scan_existing_configs()
+        self.pool.clear()
+        self.name_index.clear()
+        for client_name, config_info in configs.items():
+            self.name_index.add(client_name)
+            try:
+                self.pool.assign(client_name, config_info['ip'])
+            except AddressPoolError as e:
+                logger.warning(f"Skipping {client_name} in address pool: {e}")
+        logger.info(f"Address pool {self.pool.network}: {len(self.pool)} used, {self.pool.free_count} free")
 
     def show_main_buttons(self, message):
         markup = types.ReplyKeyboardMarkup(resize_keyboard=True)
@@ -142,13 +453,14 @@ class WireGuardBot:
         return True
     
     def delete_vpn_config(self, message):
-        """Delete VPN client configuration by name or IP octet"""
+        """Delete VPN client configuration by name or IP address"""
         if not self.validate_message_type(message):
             self.show_monitoring_menu(message)
             return
         
         try:
-            input_text = self.sanitize_input(message.text.strip())
+            raw_text = message.text.strip()
+            input_text = self.sanitize_input(raw_text)
             
             # Get current configurations
             configs = self.scan_existing_configs()
@@ -158,36 +470,36 @@ class WireGuardBot:
                 self.show_monitoring_menu(message)
                 return
             
-            # Determine if input is client name or IP octet
+            # Determine if input is client name or IP address (octet shorthand on /24 pools)
             client_name = None
-            ip_octet = None
+            address = None
             
-            if input_text.isdigit():
-                # Input is IP octet
-                ip_octet = int(input_text)
-                if not (2 <= ip_octet <= 254):
-                    self.bot.send_message(
-                        message.chat.id, 
-                        "❌ IP октет должен быть от 2 до 254"
-                    )
+            if raw_text.isdigit() or '.' in raw_text:
+                try:
+                    address = self.pool.parse_address(raw_text)
+                except AddressPoolError as e:
+                    self.bot.send_message(message.chat.id, f"❌ {e}")
                     self.show_monitoring_menu(message)
                     return
                 
-                # Find client by IP octet
-                for name, info in configs.items():
-                    if int(info['octet']) == ip_octet:
-                        client_name = name
-                        break
+                # Find client by address
+                client_name = self.pool.lookup(address)
                 
-                if not client_name:
+                if not client_name or client_name not in configs:
                     self.bot.send_message(
                         message.chat.id, 
-                        f"❌ Клиент с IP {self.wg_ip_hint}.{ip_octet} не найден"
+                        f"❌ Клиент с IP {address} не найден"
                     )
                     self.show_monitoring_menu(message)
                     return
             else:
                 # Input is client name
+                if input_text not in configs and self.fleet is not None:
+                    # The client may live on another node of the fleet
+                    self.delete_on_fleet(message, input_text)
+                    self.show_monitoring_menu(message)
+                    return
+                
                 if input_text not in configs:
                     self.bot.send_message(
                         message.chat.id, 
@@ -197,14 +509,14 @@ class WireGuardBot:
                     return
                 
                 client_name = input_text
-                ip_octet = int(configs[client_name]['octet'])
+                address = configs[client_name]['ip']
             
             # Perform deletion
-            success, message_text = self.perform_client_deletion(client_name, ip_octet, message.chat.id)
+            success, message_text = self.perform_client_deletion(client_name, address, message.chat.id)
             
             if success:
                 self.bot.send_message(message.chat.id, message_text, parse_mode='Markdown')
-                logger.info(f"Successfully deleted client: {client_name} (IP: {self.wg_ip_hint}.{ip_octet})")
+                logger.info(f"Successfully deleted client: {client_name} (IP: {address})")
             else:
                 self.bot.send_message(message.chat.id, f"❌ {message_text}")
                 logger.error(f"Failed to delete client: {client_name} - {message_text}")
@@ -215,24 +527,33 @@ class WireGuardBot:
         
         self.show_monitoring_menu(message)
 
-    def perform_client_deletion(self, client_name, ip_octet, chat_id):
-        """Actually perform the client deletion"""
+    @with_state_lock
+    def perform_client_deletion(self, client_name, address, chat_id, restart: bool = True):
+        """Actually perform the client deletion.
+        
+        With restart=False WireGuard is left as is, so a batch can apply its changes once.
+        """
         try:
-            self.bot.send_message(
-                chat_id,
-                f"🗑️ Удаление клиента **{self.escape_markdown(client_name)}**...",
-                parse_mode='Markdown'
-            )
+            if restart:
+                # The restart zeroes every counter, account them while the peer still has a name
+                self.sample_traffic()
+            if chat_id is not None:
+                self.bot.send_message(
+                    chat_id,
+                    f"🗑️ Удаление клиента **{self.escape_markdown(client_name)}**...",
+                    parse_mode='Markdown'
+                )
             
             deleted_files = []
             errors = []
             
-            # 1. Remove from main server config (wg0.conf)
-            try:
-                self.remove_client_from_server_config(client_name, ip_octet)
-                deleted_files.append("server config peer")
-            except Exception as e:
-                errors.append(f"server config: {str(e)}")
+            # 1. Remove from main server config (wg0.conf); disabled peers are already out of it
+            if not self.store.get(client_name).get('disabled'):
+                try:
+                    self.remove_client_from_server_config(client_name, address)
+                    deleted_files.append("server config peer")
+                except Exception as e:
+                    errors.append(f"server config: {str(e)}")
             
             # 2. Remove client config file
             client_config_path = Path(f"/etc/wireguard/{client_name}_cl.conf")
@@ -244,7 +565,7 @@ class WireGuardBot:
                     errors.append(f"client config: {str(e)}")
             
             # 3. Remove client keys
-            for key_type in ["privatekey", "publickey"]:
+            for key_type in CLIENT_KEY_FILES:
                 key_path = Path(f"/etc/wireguard/{client_name}_{key_type}")
                 if key_path.exists():
                     try:
@@ -255,21 +576,36 @@ class WireGuardBot:
             
             # 4. Update configs.txt
             try:
-                self.update_configs_file_after_deletion(client_name, ip_octet)
+                self.update_configs_file_after_deletion(client_name, address)
                 deleted_files.append("configs.txt entry")
             except Exception as e:
                 errors.append(f"configs.txt: {str(e)}")
             
-            # 5. Restart WireGuard
-            try:
-                result = subprocess.run(['wg-quick', 'down', 'wg0'], capture_output=True, text=True)
-                result = subprocess.run(['wg-quick', 'up', 'wg0'], capture_output=True, text=True)
-                if result.returncode == 0:
-                    deleted_files.append("WireGuard restarted")
-                else:
-                    errors.append(f"WireGuard restart: {result.stderr}")
-            except Exception as e:
-                errors.append(f"WireGuard restart: {str(e)}")
+            # A freed address must not keep the old client's firewall verdict
+            if self.store.get(client_name).get('access'):
+                self.set_client_access([client_name], None)
+            
+            self.pool.release(address)
+            self.name_index.remove(client_name)
+            self.store.remove(client_name)
+            self.tag_index.remove(client_name)
+            self.expiry.cancel(client_name)
+            
+            # 5. Restart WireGuard (handshakes reset on restart, keep them first)
+            if restart:
+                try:
+                    self.update_last_seen()
+                    result = subprocess.run(['wg-quick', 'down', 'wg0'], capture_output=True, text=True)
+                    result = subprocess.run(['wg-quick', 'up', 'wg0'], capture_output=True, text=True)
+                    if result.returncode == 0:
+                        deleted_files.append("WireGuard restarted")
+                    else:
+                        errors.append(f"WireGuard restart: {result.stderr}")
+                except Exception as e:
+                    errors.append(f"WireGuard restart: {str(e)}")
+                # The restart drops the qdiscs, and a freed address must not keep its class
+                self.apply_shaping()
+                self.sync_grace_peers()
             
             # Prepare result message
             if deleted_files and not errors:
@@ -283,46 +619,21 @@ class WireGuardBot:
             logger.error(f"Error in perform_client_deletion: {e}")
             return False, f"Критическая ошибка: {str(e)}"
 
-    def remove_client_from_server_config(self, client_name, ip_octet):
+    def remove_client_from_server_config(self, client_name, address):
         """Remove client peer from server wg0.conf"""
         config_path = Path("/etc/wireguard/wg0.conf")
         if not config_path.exists():
             raise Exception("Server config not found")
         
-        # Read current config
-        with open(config_path, 'r', encoding='utf-8') as f:
-            lines = f.readlines()
-        
-        # Find and remove client peer section
-        new_lines = []
-        skip_lines = 0
-        peer_found = False
-        
-        for i, line in enumerate(lines):
-            if skip_lines > 0:
-                skip_lines -= 1
-                continue
-                
-            # Look for the AllowedIPs line with our client's IP
-            if line.strip() == f"AllowedIPs = {self.wg_ip_hint}.{ip_octet}/32":
-                peer_found = True
-                # Remove this line and the two lines before it ([Peer] and PublicKey)
-                # Remove the last 2 lines from new_lines (they should be [Peer] and PublicKey)
-                if len(new_lines) >= 2:
-                    new_lines = new_lines[:-2]
-                # Skip current line
-                continue
-            
-            new_lines.append(line)
-        
-        if not peer_found:
-            raise Exception(f"Peer with IP {self.wg_ip_hint}.{ip_octet} not found in server config")
+        # Whole peer blocks are dropped, whatever fields (PresharedKey, keepalive, comments) they hold
+        head, peers = split_peers(config_path.read_text(encoding='utf-8'))
+        kept = [block for block in peers if peer_address(block) != address]
+        if len(kept) == len(peers):
+            raise Exception(f"Peer with IP {address} not found in server config")
         
-        # Write updated config
-        with open(config_path, 'w', encoding='utf-8') as f:
-            f.writelines(new_lines)
+        config_path.write_text(join_peers(head, kept), encoding='utf-8')
 
-    def update_configs_file_after_deletion(self, client_name, ip_octet):
+    def update_configs_file_after_deletion(self, client_name, address):
         """Update configs.txt after client deletion"""
         configs_file = Path("configs.txt")
         
@@ -337,7 +648,7 @@ class WireGuardBot:
             new_lines = []
             for line in lines:
                 # Skip lines that contain this client's info
-                if not (client_name in line or f".{ip_octet} =" in line):
+                if not (client_name in line or line.startswith(f"{address} =")):
                     new_lines.append(line)
             
             # Write updated file
@@ -350,6 +661,47 @@ class WireGuardBot:
 
 
 
+    @with_state_lock
+    def delete_clients(self, names: list):
+        """Delete several clients and apply wg0.conf once for the whole batch.
+        
+        Returns (deleted names, [(name, error)]).
+        """
+        deleted, failed = [], []
+        self.sample_traffic()
+        for client_name in names:
+            address = self.pool.address_of(client_name)
+            if address is None:
+                failed.append((client_name, "клиент не найден"))
+                continue
+            success, message_text = self.perform_client_deletion(client_name, address, None, restart=False)
+            if success:
+                deleted.append(client_name)
+            else:
+                failed.append((client_name, message_text))
+        
+        if deleted:
+            self.apply_wireguard_config()
+            self.apply_shaping()
+            self.sync_grace_peers()
+        return deleted, failed
+
+    def delete_on_fleet(self, message, client_name):
+        """Delete a client by name on whichever fleet node holds it"""
+        results = self.fleet.fan_out('delete_client', name=client_name)
+        deleted = [(node, result) for node, (ok, result) in results.items() if ok]
+        
+        if deleted:
+            for node, result in deleted:
+                self.bot.send_message(
+                    message.chat.id,
+                    f"✅ Клиент **{self.escape_markdown(client_name)}** ({result['address']}) удален на узле **{self.escape_markdown(node)}**",
+                    parse_mode='Markdown'
+                )
+                logger.info(f"Deleted client {client_name} on node {node}")
+        else:
+            self.bot.send_message(message.chat.id, f"❌ Клиент '{client_name}' не найден ни на одном узле")
+
     def get_config_name(self, message):
         """First step: get config name"""
         if not self.is_authorized(message.chat.id):
@@ -361,14 +713,34 @@ class WireGuardBot:
             return
         
         try:
-            config_name = self.sanitize_input(message.text)
+            name_text, *fields = re.split(r'[\s:]+', message.text.strip())
+            try:
+                options = self.parse_client_fields(fields, allow_ip=False)
+            except ValueError as e:
+                self.bot.send_message(message.chat.id, f"❌ {e}")
+                self.show_monitoring_menu(message)
+                return
+            
+            config_name = self.sanitize_input(name_text)
             if not config_name:
                 self.bot.send_message(message.chat.id, "Недопустимое имя конфигурации")
                 self.show_monitoring_menu(message)
                 return
+            expires = int(time.time()) + options["lifetime"] if options["lifetime"] else None
+            
+            # In fleet mode the node (and its address) is picked by placement
+            if self.fleet is not None:
+                self.create_on_fleet(message, config_name, expires, options["rate"], options["route"],
+                                     options["profile"], options["psk"])
+                return
             
             # Store config name and ask for IP
             self.temp_config_name = config_name
+            self.temp_config_expires = expires
+            self.temp_config_rate = options["rate"]
+            self.temp_config_route = options["route"]
+            self.temp_config_profile = options["profile"]
+            self.temp_config_psk = options["psk"]
             self.show_ip_selection(message)
             
         except Exception as e:
@@ -376,104 +748,312 @@ class WireGuardBot:
             self.bot.send_message(message.chat.id, "Произошла ошибка")
             self.show_monitoring_menu(message)
 
+    def parse_client_fields(self, fields: list, allow_ip: bool = True) -> dict:
+        """Parse the optional fields after a client name.
+        
+        Address, lifetime (`30d`), `rate=10m/2m` or `rate=profile`, `route=profile`, `profile=name`, `psk`.
+        """
+        options = {"ip": "auto", "lifetime": None, "rate": None, "route": None, "profile": None, "psk": None}
+        for field in fields:
+            if not field:
+                continue
+            lifetime = parse_duration(field)
+            if lifetime:
+                options["lifetime"] = lifetime
+            elif field.lower().startswith("rate="):
+                options["rate"] = parse_limit(field[5:], self.rate_profiles)
+            elif field.lower().startswith("route="):
+                route = field[6:].lower()
+                if route not in self.route_profiles:
+                    raise ValueError(f"Неизвестный профиль маршрутов: {route}")
+                options["route"] = route
+            elif field.lower().startswith("profile="):
+                profile = field[8:].lower()
+                if profile not in self.config_profiles:
+                    raise ValueError(f"Неизвестный профиль конфигурации: {profile}")
+                options["profile"] = profile
+            elif field.lower() == "psk":
+                options["psk"] = True
+            elif allow_ip and field != "auto":
+                try:
+                    options["ip"] = self.pool.parse_address(field)
+                except AddressPoolError as e:
+                    raise ValueError(str(e))
+            elif field != "auto":
+                raise ValueError(f"Неизвестный параметр: {field}")
+        return options
+
+    def create_on_fleet(self, message, config_name, expires=None, rate=None, route=None, profile=None, psk=None):
+        """Create a single client on the least loaded fleet node and send its config"""
+        self.bot.send_message(message.chat.id, f"Создание конфига **{config_name}**...", parse_mode='Markdown')
+        success, message_text, config_text, _ = self.create_client_placed(
+            config_name, expires=expires, rate=rate, route=route, profile=profile, psk=psk
+        )
+        
+        if success:
+            self.bot.send_message(message.chat.id, message_text, parse_mode='Markdown')
+            self.send_config_text(message.chat.id, config_name, config_text)
+        else:
+            self.bot.send_message(message.chat.id, f"❌ {message_text}")
+        
+        self.show_monitoring_menu(message)
+
+    def create_client_placed(self, config_name, selected_ip=None, node_name=None, expires=None, rate=None,
+                             route=None, profile=None, psk=None, apply_shaping: bool = True, apply_config: bool = True):
+        """Create a client locally or on a fleet node.
+        
+        Returns (success, message, config text, address); the config text is only set in fleet mode.
+        """
+        if self.fleet is None:
+            success, message_text = self.add_vpn_config(
+                config_name, selected_ip, expires, rate, route, profile, psk,
+                apply_shaping=apply_shaping, apply_config=apply_config
+            )
+            return success, message_text, None, self.pool.address_of(config_name)
+        
+        node_name = node_name or self.fleet.pick_node()
+        if node_name is None:
+            return False, "Нет доступных узлов со свободными IP", None, None
+        
+        address = None if selected_ip in (None, "auto") else selected_ip
+        # Expiry and limits are kept by the node holding the client; older agents do not take them
+        params = {'expires': expires} if expires else {}
+        if rate:
+            params['rate'] = list(rate)
+        if route:
+            params['route'] = route
+        if profile:
+            params['profile'] = profile
+        if psk:
+            params['psk'] = True
+        try:
+            result = self.fleet.get(node_name).call('create_client', name=config_name, address=address, **params)
+        except Exception as e:
+            logger.error(f"Error creating {config_name} on node {node_name}: {e}")
+            return False, f"Узел {node_name}: {e}", None, None
+        
+        logger.info(f"Created client {config_name} on node {node_name} ({result['address']})")
+        return (
+            True,
+            f"✅ Конфиг **{config_name}.conf** создан на узле **{self.escape_markdown(node_name)}** с IP {result['address']}",
+            result['config'],
+            result['address']
+        )
+
+    def send_config_text(self, chat_id, config_name, config_text):
+        """Send an in-memory client config as a document"""
+        if not config_text:
+            return
+        self.bot.send_document(
+            chat_id,
+            io.BytesIO(config_text.encode('utf-8')),
+            caption=f"📄 Конфигурация {config_name}",
+            visible_file_name=f"{config_name}.conf"
+        )
+
     def show_ip_selection(self, message):
         """Show available IP addresses for selection"""
         try:
-            # Get available IPs
-            available_ips = self.get_available_ips()
-            
-            if not available_ips:
+            if self.pool.free_count == 0:
                 self.bot.send_message(message.chat.id, "Нет доступных IP адресов")
                 self.show_monitoring_menu(message)
                 return
             
-            # Create inline keyboard with available IPs
-            markup = types.InlineKeyboardMarkup(row_width=3)
-            buttons = []
-            
-            for ip_octet in available_ips[:15]:  # Show first 15 available IPs
-                ip_addr = f"10.20.20.{ip_octet}"
-                button = types.InlineKeyboardButton(
-                    text=ip_addr, 
-                    callback_data=f"select_ip:{ip_octet}"
-                )
-                buttons.append(button)
-            
-            # Add buttons in rows of 3
-            for i in range(0, len(buttons), 3):
-                markup.row(*buttons[i:i+3])
-            
-            # Add auto-select button
-            auto_button = types.InlineKeyboardButton(
-                text="🔄 Автовыбор", 
-                callback_data="select_ip:auto"
-            )
-            markup.row(auto_button)
-            
-            self.bot.send_message(
-                message.chat.id, 
-                f"Выберите IP адрес для конфига **{self.temp_config_name}**:\n\n"
-                f"Доступно IP адресов: {len(available_ips)}",
-                reply_markup=markup,
-                parse_mode='Markdown'
-            )
+            text, markup = self.render_ip_selection_page(0)
+            self.bot.send_message(message.chat.id, text, reply_markup=markup, parse_mode='Markdown')
             
         except Exception as e:
             logger.error(f"Error showing IP selection: {e}")
             self.bot.send_message(message.chat.id, "Ошибка при получении доступных IP")
             self.show_monitoring_menu(message)
 
-    def get_available_ips(self):
-        """Get list of available IP octets (2-254)"""
+    def render_ip_selection_page(self, page: int):
+        """Render one page of free addresses as an inline keyboard"""
+        total_pages = max(1, -(-self.pool.free_count // IP_PAGE_SIZE))
+        page = min(max(page, 0), total_pages - 1)
+        available_ips = list(itertools.islice(self.pool.free_addresses(page * IP_PAGE_SIZE), IP_PAGE_SIZE))
+        
+        # Create inline keyboard with available IPs
+        markup = types.InlineKeyboardMarkup(row_width=3)
+        buttons = []
+        
+        for ip_addr in available_ips:
+            button = types.InlineKeyboardButton(
+                text=ip_addr, 
+                callback_data=f"select_ip:{ip_addr}"
+            )
+            buttons.append(button)
+        
+        # Add buttons in rows of 3
+        for i in range(0, len(buttons), 3):
+            markup.row(*buttons[i:i+3])
+        
+        nav_row = self.pagination_row("ipsel:{page}", page, total_pages)
+        if nav_row:
+            markup.row(*nav_row)
+        
+        # Add auto-select button
+        auto_button = types.InlineKeyboardButton(
+            text="🔄 Автовыбор", 
+            callback_data="select_ip:auto"
+        )
+        markup.row(auto_button)
+        
+        text = (
+            f"Выберите IP адрес для конфига **{self.temp_config_name}**:\n\n"
+            f"Доступно IP адресов: {self.pool.free_count} ({self.pool.network})"
+        )
+        return text, markup
+
+    @staticmethod
+    def pagination_row(callback_template: str, page: int, total_pages: int) -> list:
+        """◀ page/total ▶ buttons; the template receives the target page"""
+        if total_pages <= 1:
+            return []
+        row = []
+        if page > 0:
+            row.append(types.InlineKeyboardButton("◀️", callback_data=callback_template.format(page=page - 1)))
+        row.append(types.InlineKeyboardButton(f"{page + 1}/{total_pages}", callback_data="noop"))
+        if page < total_pages - 1:
+            row.append(types.InlineKeyboardButton("▶️", callback_data=callback_template.format(page=page + 1)))
+        return row
+
+    def get_available_ips(self, limit: Optional[int] = None):
+        """Get list of available client addresses from the pool (ascending)"""
         try:
-            # Get existing configurations
-            configs = self.scan_existing_configs()
-            used_octets = set()
-            
-            for config_info in configs.values():
-                octet = int(config_info['octet'])
-                used_octets.add(octet)
-            
-            # Return available octets (2-254, excluding 1 for server)
-            all_octets = set(range(2, 255))
-            available_octets = sorted(list(all_octets - used_octets))
-            
-            return available_octets
+            return list(itertools.islice(self.pool.free_addresses(), limit))
             
         except Exception as e:
             logger.error(f"Error getting available IPs: {e}")
             return []
 
-    def add_vpn_config(self, config_name, selected_ip=None):
-        """Create VPN config with specified name and IP"""
+    @with_state_lock
+    def add_vpn_config(self, config_name, selected_ip=None, expires=None, rate=None, route=None, profile=None,
+                       psk=None, apply_shaping: bool = True, apply_config: bool = True):
+        """Create VPN config with specified name and IP.
+        
+        Keys come from the pre-generated pool and wg0.conf is applied with one
+        `wg syncconf` (skipped with apply_config=False, for batches that apply once).
+        psk=None falls back to WG_PRESHARED_KEYS.
+        """
+        address = None
+        public_key = None
+        applied = False
         try:
             # Determine IP to use
-            if selected_ip == "auto" or selected_ip is None:
-                # Auto-select first available IP
-                available_ips = self.get_available_ips()
-                if not available_ips:
-                    return False, "Нет доступных IP адресов"
-                ip_octet = available_ips[0]
-            else:
-                ip_octet = int(selected_ip)
-            
-            # Execute add client script with IP parameter
-            result = subprocess.run(
-                ['scripts/add_cl.sh', config_name, str(ip_octet)], 
-                capture_output=True, 
-                text=True
-            )
+            try:
+                if selected_ip == "auto" or selected_ip is None:
+                    # Auto-select next available IP
+                    address = self.pool.allocate(config_name)
+                else:
+                    address = self.pool.assign(config_name, self.pool.parse_address(selected_ip))
+            except AddressPoolError as e:
+                return False, str(e)
+            
+            private_key, public_key = self.key_pool.take()
+            write_key(Path(f"/etc/wireguard/{config_name}_privatekey"), private_key)
+            write_key(Path(f"/etc/wireguard/{config_name}_publickey"), public_key, private=False)
+            
+            # Execute add client script with IP parameter (and the paired IPv6 address if enabled)
+            command = ['scripts/add_cl.sh', config_name, address, str(self.pool.prefixlen)]
+            address6 = self.pool.address6_of(address)
+            if address6:
+                command += [address6, str(self.pool.prefixlen6)]
+            env = dict(os.environ, WG_PREGENERATED_KEYS='1', WG_SKIP_RESTART='1')
+            result = subprocess.run(command, capture_output=True, text=True, env=env)
             
             if result.returncode != 0:
                 logger.error(f"Failed to create VPN config: {result.stderr}")
+                self.rollback_client_creation(config_name, address, public_key)
                 return False, f"Ошибка при создании конфигурации: {result.stderr}"
             
-            return True, f"✅ Конфиг **{config_name}.conf** создан с IP 10.20.20.{ip_octet}"
+            if (wg_preshared_keys if psk is None else psk):
+                self.set_preshared_keys({public_key: self.new_preshared_key(config_name)})
+            
+            self.name_index.add(config_name)
+            self.store.update(config_name, created=int(time.time()), expires=expires,
+                              rate=list(rate) if rate else None, route=route, profile=profile)
+            
+            # The script only sets up keys and the server peer; the client config comes from its profile
+            config_text = self.render_client(config_name)
+            if config_text is None:
+                self.rollback_client_creation(config_name, address, public_key)
+                return False, "Ошибка при создании конфигурации: не найдены ключи клиента или сервера"
+            write_if_changed(Path(f"/etc/wireguard/{config_name}_cl.conf"), config_text)
+            if apply_config:
+                applied = True
+                self.apply_wireguard_config()
+                self.sync_grace_peers()
+            
+            expiry_text = ""
+            if expires:
+                self.expiry.schedule(config_name, expires)
+                expiry_text = f"\n⌛ Действует до {datetime.fromtimestamp(expires).strftime('%d.%m.%Y %H:%M')}"
+            if profile:
+                expiry_text += f"\n🧩 Профиль: {profile}"
+            if route:
+                expiry_text += f"\n🧭 Маршруты: {route}"
+            if Path(f"/etc/wireguard/{config_name}_presharedkey").exists():
+                expiry_text += "\n🔐 PresharedKey"
+            if rate:
+                expiry_text += f"\n🚦 Скорость: {RateLimit(*rate)}"
+                if apply_shaping:
+                    self.apply_shaping()
+            
+            if address6:
+                return True, f"✅ Конфиг **{config_name}.conf** создан с IP {address}, {address6}{expiry_text}"
+            return True, f"✅ Конфиг **{config_name}.conf** создан с IP {address}{expiry_text}"
             
         except Exception as e:
             logger.error(f"Error creating VPN config: {e}")
+            if address:
+                self.rollback_client_creation(config_name, address, public_key, reapply=applied)
             return False, f"Произошла ошибка: {str(e)}"
 
+    def rollback_client_creation(self, config_name, address, public_key=None, reapply: bool = False):
+        """Undo a half-created client: its wg0.conf peer, files, listing, index and store entries, address.
+
+        The peer is matched by its fresh public key, never by address: a failed
+        add_cl.sh may have hit another client's peer on the same address.
+        Every step is best effort, so one failure does not leave the rest behind.
+        """
+        config_path = Path("/etc/wireguard/wg0.conf")
+        if public_key and config_path.exists():
+            try:
+                head, peers = split_peers(config_path.read_text(encoding='utf-8'))
+                kept = [block for block in peers if peer_public_key(block) != public_key]
+                if len(kept) != len(peers):
+                    config_path.write_text(join_peers(head, kept), encoding='utf-8')
+            except Exception as e:
+                logger.error(f"Rollback of {config_name}: cannot remove the peer: {e}")
+        
+        for suffix in CLIENT_KEY_FILES + ('cl.conf',):
+            try:
+                Path(f"/etc/wireguard/{config_name}_{suffix}").unlink(missing_ok=True)
+            except OSError as e:
+                logger.error(f"Rollback of {config_name}: cannot remove {suffix}: {e}")
+        
+        # add_cl.sh appends "<address> = <name>" to the listing
+        configs_file = Path("configs.txt")
+        try:
+            if configs_file.exists():
+                lines = configs_file.read_text(encoding='utf-8').splitlines(keepends=True)
+                kept_lines = [line for line in lines if line.strip() != f"{address} = {config_name}"]
+                if len(kept_lines) != len(lines):
+                    configs_file.write_text(''.join(kept_lines), encoding='utf-8')
+        except OSError as e:
+            logger.error(f"Rollback of {config_name}: cannot update configs.txt: {e}")
+        
+        self.name_index.remove(config_name)
+        self.store.remove(config_name)
+        self.pool.release(address)
+        if reapply:
+            try:
+                self.apply_wireguard_config()
+            except Exception as e:
+                logger.error(f"Rollback of {config_name}: cannot apply wg0.conf: {e}")
+        logger.info(f"Rolled back the creation of {config_name} ({address})")
+
     def start_bulk_creation(self, message):
         """Start bulk client creation process"""
         try:
@@ -492,16 +1072,37 @@ class WireGuardBot:
                 "client2:10\n"
                 "client3:15\n"
                 "```\n"
-                "(где число после ':' - последний октет IP)\n\n"
+                "(после ':' - IP адрес из пула или последний октет для подсети /24)\n\n"
                 "**Формат 3 - Смешанный:**\n"
                 "```\n"
                 "client1\n"
                 "client2:20\n"
                 "client3\n"
                 "```\n\n"
+                "**Временный доступ** - срок последним полем (`m`, `h`, `d`, `w`):\n"
+                "```\n"
+                "guest1:30d\n"
+                "guest2:5:12h\n"
+                "```\n\n"
+                "**Ограничение скорости** (загрузка/отдача или профиль):\n"
+                "```\n"
+                "client1:rate=10m/2m\n"
+                "client2:5:30d:rate=basic\n"
+                "```\n\n"
+                "**Маршруты** (split tunnel) - `route=профиль`. Строка `@поля` задаёт поля для всех следующих клиентов:\n"
+                "```\n"
+                "@route=nolan:30d\n"
+                "guest1\n"
+                "guest2:route=full\n"
+                "```\n\n"
+                "**Профиль конфигурации** (DNS, MTU, keepalive, endpoint) - `profile=имя`\n\n"
+                "**Файл** - для тысяч клиентов отправьте вместо сообщения CSV или TXT файл. "
+                "TXT - строки в том же формате, CSV - колонки "
+                "`name,address,profile,expires,tags,rate,route,psk` (заголовок необязателен, "
+                "срок - `30d` или дата `2026-12-31`, теги через пробел). Результат придёт файлом-отчётом.\n\n"
                 "⚠️ **Ограничения:**\n"
                 "• Имена только латинские буквы, цифры, дефисы, подчеркивания\n"
-                "• IP октеты от 2 до 254\n\n"
+                f"• IP адреса из пула {self.pool.network}\n\n"
                 "Отправьте список клиентов:"
             )
             
@@ -525,6 +1126,10 @@ class WireGuardBot:
             self.send_unauthorized_message(message)
             return
         
+        if message.document is not None:
+            self.handle_bulk_import_file(message)
+            return
+        
         if not self.validate_message_type(message):
             self.show_monitoring_menu(message)
             return
@@ -555,10 +1160,150 @@ class WireGuardBot:
             self.bot.send_message(message.chat.id, "❌ Ошибка при обработке списка")
             self.show_monitoring_menu(message)
 
+    def handle_bulk_import_file(self, message):
+        """Parse an uploaded CSV/TXT client list row by row and show the bulk confirmation"""
+        try:
+            document = message.document
+            if not document.file_name.lower().endswith(('.csv', '.txt')):
+                self.bot.send_message(message.chat.id, "❌ Поддерживаются файлы .csv и .txt")
+                self.show_monitoring_menu(message)
+                return
+            if document.file_size > IMPORT_MAX_BYTES:
+                self.bot.send_message(message.chat.id, "❌ Файл слишком большой. Максимальный размер: 10MB")
+                self.show_monitoring_menu(message)
+                return
+            
+            file_info = self.bot.get_file(document.file_id)
+            stream = io.TextIOWrapper(io.BytesIO(self.bot.download_file(file_info.file_path)),
+                                      encoding='utf-8-sig', errors='replace', newline='')
+            client_list, rejected = self.validate_import_rows(iter_import_rows(stream))
+            
+            if not client_list:
+                self.bot.send_message(message.chat.id, "❌ В файле нет строк, которые можно создать")
+                if rejected:
+                    self.send_import_report(message.chat.id, document.file_name, [], rejected, {}, {})
+                self.show_monitoring_menu(message)
+                return
+            
+            self.show_bulk_confirmation(message, client_list, {"file": document.file_name, "rejected": rejected})
+            
+        except Exception as e:
+            logger.error(f"Error handling bulk import file: {e}")
+            self.bot.send_message(message.chat.id, "❌ Ошибка при обработке файла")
+            self.show_monitoring_menu(message)
+    
+    def import_row_client(self, row) -> dict:
+        """Client options of one import row; raises ValueError with the reason"""
+        if row.fields is not None:
+            client = self.parse_client_fields(row.fields)
+            client["tags"] = None
+            return client
+        
+        unknown = set(row.values) - set(IMPORT_COLUMNS)
+        if unknown:
+            raise ValueError(f"неизвестные колонки: {', '.join(sorted(unknown))}")
+        # CSV cells become the fields of the text format, so both are checked the same way
+        values = row.values
+        fields = [values.get("address", "auto")]
+        fields += [f"{key}={values[key]}" for key in ("profile", "rate", "route") if key in values]
+        if values.get("psk", "").lower() in IMPORT_PSK_VALUES:
+            fields.append("psk")
+        client = self.parse_client_fields(fields)
+        
+        expires = values.get("expires")
+        if expires:
+            lifetime = parse_duration(expires)
+            if not lifetime:
+                lifetime = parse_expires(expires) - int(time.time())
+                if lifetime <= 0:
+                    raise ValueError(f"срок {expires} уже прошёл")
+            client["lifetime"] = lifetime
+        client["tags"] = parse_tags(values["tags"]) if values.get("tags") else None
+        return client
+    
+    def validate_import_rows(self, rows):
+        """Check each row against the address pool and name index as it is read.
+        
+        Returns (clients to create, rejected rows as [line, name, reason]).
+        """
+        name_pattern = re.compile(r'^[a-zA-Z0-9_-]{1,50}$')
+        clients, rejected = [], []
+        names, addresses = set(), set()
+        defaults = {}
+        for row in rows:
+            try:
+                # Batch directive: @field:field applies to every following row
+                if row.fields is not None and row.name.startswith('@'):
+                    batch = self.parse_client_fields([row.name[1:]] + row.fields, allow_ip=False)
+                    defaults.update((key, value) for key, value in batch.items() if value is not None and key != "ip")
+                    continue
+                if not name_pattern.match(row.name):
+                    raise ValueError("недопустимое имя")
+                if row.name in names:
+                    raise ValueError("имя повторяется в файле")
+                if row.name in self.pool:
+                    raise ValueError("клиент уже существует")
+                client = self.import_row_client(row)
+                if client["ip"] != "auto":
+                    if client["ip"] in addresses:
+                        raise ValueError(f"IP {client['ip']} повторяется в файле")
+                    if self.pool.lookup(client["ip"]) is not None:
+                        raise ValueError(f"IP {client['ip']} уже используется")
+            except (ValueError, AddressPoolError) as e:
+                rejected.append([row.line, row.name, str(e)])
+                continue
+            for key, value in defaults.items():
+                if client.get(key) is None:
+                    client[key] = value
+            client["name"], client["line"] = row.name, row.line
+            names.add(row.name)
+            if client["ip"] != "auto":
+                addresses.add(client["ip"])
+            clients.append(client)
+        
+        # Automatic addresses come from what the fixed ones leave free
+        auto_budget = self.pool.free_count - len(addresses)
+        accepted = []
+        for client in clients:
+            if client["ip"] == "auto":
+                if auto_budget <= 0:
+                    rejected.append([client["line"], client["name"], "нет свободных IP"])
+                    continue
+                auto_budget -= 1
+            accepted.append(client)
+        return accepted, rejected
+    
+    def send_import_report(self, chat_id, file_name: str, clients: list, rejected: list, created: dict, failed: dict):
+        """CSV report of a file import: one row per input line with its outcome"""
+        rows = [[line, name, "", "rejected", reason] for line, name, reason in rejected]
+        for client in clients:
+            if client["name"] in created:
+                rows.append([client["line"], client["name"], created[client["name"]]["ip"], "created", ""])
+            elif client["name"] in failed:
+                rows.append([client["line"], client["name"], "", "failed", failed[client["name"]].replace("*", "")])
+            else:
+                rows.append([client["line"], client["name"], "", "skipped", ""])
+        rows.sort(key=lambda row: row[0])
+        
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(["line", "name", "address", "status", "error"])
+        writer.writerows(rows)
+        self.bot.send_document(
+            chat_id,
+            io.BytesIO(buffer.getvalue().encode('utf-8-sig')),
+            caption=(
+                f"📄 Отчёт об импорте {file_name}\n"
+                f"✅ Создано: {len(created)}, ❌ ошибок: {len(failed)}, ⏭ пропущено строк: {len(rejected)}"
+            ),
+            visible_file_name=f"import_report_{Path(file_name).stem}.csv"
+        )
+    
     def parse_client_list(self, text):
         """Parse client list from text"""
         try:
             clients = []
+            defaults = {}
             lines = text.strip().split('\n')
             
             for line in lines:
@@ -566,20 +1311,26 @@ class WireGuardBot:
                 if not line or line.startswith('#'):  # Skip empty lines and comments
                     continue
                 
-                if ':' in line:
-                    # Format: client_name:ip_octet
-                    name, ip_str = line.split(':', 1)
-                    name = name.strip()
+                # Batch directive: @field:field applies to every following client
+                if line.startswith('@'):
                     try:
-                        ip_octet = int(ip_str.strip())
-                        if ip_octet < 2 or ip_octet > 254:
-                            continue
+                        batch = self.parse_client_fields(line[1:].split(':'), allow_ip=False)
                     except ValueError:
                         continue
-                    clients.append({"name": name, "ip": ip_octet})
-                else:
-                    # Format: client_name (auto IP)
-                    clients.append({"name": line, "ip": "auto"})
+                    defaults.update((key, value) for key, value in batch.items() if value is not None and key != "ip")
+                    continue
+                
+                # Format: client_name[:ip][:lifetime][:rate=...][:route=...] (full address or octet shorthand, e.g. 30d)
+                name, *fields = [field.strip() for field in line.split(':')]
+                try:
+                    client = self.parse_client_fields(fields)
+                except ValueError:
+                    continue
+                for key, value in defaults.items():
+                    if client.get(key) is None:
+                        client[key] = value
+                client["name"] = name
+                clients.append(client)
             
             return clients
             
@@ -597,14 +1348,13 @@ class WireGuardBot:
             # Get existing configurations
             existing_configs = self.scan_existing_configs()
             existing_names = set(existing_configs.keys())
-            existing_ips = set(int(config['octet']) for config in existing_configs.values())
             
             import re
             name_pattern = re.compile(r'^[a-zA-Z0-9_-]+$')
             
             for i, client in enumerate(client_list, 1):
                 name = client["name"]
-                ip_octet = client["ip"]
+                address = client["ip"]
                 
                 # Validate name format
                 if not name_pattern.match(name):
@@ -624,12 +1374,16 @@ class WireGuardBot:
                     errors.append(f"Строка {i}: клиент '{name}' уже существует")
                 
                 # Validate IP if specified
-                if ip_octet != "auto":
-                    if ip_octet in used_ips:
-                        errors.append(f"Строка {i}: дублирующийся IP .{ip_octet}")
-                    if ip_octet in existing_ips:
-                        errors.append(f"Строка {i}: IP .{ip_octet} уже используется")
-                    used_ips.add(ip_octet)
+                if address != "auto":
+                    if address in used_ips:
+                        errors.append(f"Строка {i}: дублирующийся IP {address}")
+                    if self.pool.lookup(address) is not None:
+                        errors.append(f"Строка {i}: IP {address} уже используется")
+                    used_ips.add(address)
+            
+            auto_count = sum(1 for client in client_list if client["ip"] == "auto")
+            if auto_count + len(used_ips) > self.pool.free_count:
+                errors.append(f"Недостаточно свободных IP: нужно {auto_count + len(used_ips)}, доступно {self.pool.free_count}")
             
             return {
                 "valid": len(errors) == 0,
@@ -640,8 +1394,8 @@ class WireGuardBot:
             logger.error(f"Error validating bulk clients: {e}")
             return {"valid": False, "errors": "Ошибка при валидации списка"}
 
-    def show_bulk_confirmation(self, message, client_list):
-        """Show bulk creation confirmation"""
+    def show_bulk_confirmation(self, message, client_list, import_info: Optional[dict] = None):
+        """Show bulk creation confirmation; import_info carries the file name and rejected rows of a file import"""
         try:
             # Count auto and manual IPs
             auto_count = sum(1 for c in client_list if c["ip"] == "auto")
@@ -650,7 +1404,19 @@ class WireGuardBot:
             # Create preview
             preview_lines = []
             for i, client in enumerate(client_list[:10]):  # Show first 10
-                ip_info = f"IP: .{client['ip']}" if client["ip"] != "auto" else "IP: авто"
+                ip_info = f"IP: {client['ip']}" if client["ip"] != "auto" else "IP: авто"
+                if client.get("lifetime"):
+                    ip_info += f", ⌛ {self.format_time_left(time.time() + client['lifetime'])}"
+                if client.get("rate"):
+                    ip_info += f", 🚦 {client['rate']}"
+                if client.get("route"):
+                    ip_info += f", 🧭 {client['route']}"
+                if client.get("profile"):
+                    ip_info += f", 🧩 {client['profile']}"
+                if client.get("psk"):
+                    ip_info += ", 🔐 PSK"
+                if client.get("tags"):
+                    ip_info += f", 🏷 {' '.join(client['tags'])}"
                 preview_lines.append(f"• **{self.escape_markdown(client['name'])}** ({ip_info})")
             
             if len(client_list) > 10:
@@ -660,7 +1426,11 @@ class WireGuardBot:
                 f"📋 **Подтверждение массового создания**\n\n"
                 f"👥 **Клиентов к созданию:** {len(client_list)}\n"
                 f"🔄 **Автоматический IP:** {auto_count}\n"
-                f"📍 **Указанный IP:** {manual_count}\n\n"
+                f"📍 **Указанный IP:** {manual_count}\n"
+                + (f"📄 **Файл:** {self.escape_markdown(import_info['file'])}, "
+                   f"пропущено строк с ошибками: {len(import_info['rejected'])} (будут в отчёте)\n"
+                   if import_info else "")
+                + "\n"
                 f"**Предварительный просмотр:**\n" + "\n".join(preview_lines) + "\n\n"
                 f"⏱️ **Примерное время:** {len(client_list) * 3} сек.\n\n"
                 f"Создать всех клиентов?"
@@ -681,6 +1451,7 @@ class WireGuardBot:
             
             # Store client list temporarily
             self.temp_bulk_clients = client_list
+            self.temp_bulk_import = import_info
             
             self.bot.send_message(
                 message.chat.id,
@@ -695,88 +1466,23 @@ class WireGuardBot:
             self.show_monitoring_menu(message)
 
     def perform_bulk_creation(self, message, client_list):
-        """Actually perform bulk client creation"""
+        """Queue bulk client creation as a background job"""
         try:
-            # Edit message to show progress
-            self.bot.edit_message_text(
-                chat_id=message.chat.id,
-                message_id=message.message_id,
-                text="⏳ **Массовое создание клиентов...**\n\nПожалуйста, подождите.",
-                parse_mode='Markdown'
-            )
-            
-            results = {
-                "created": [],
-                "failed": [],
-                "total": len(client_list)
-            }
-            
-            # Progress tracking
-            progress_msg_id = None
-            
-            for i, client in enumerate(client_list, 1):
-                try:
-                    # Update progress every 5 clients or on last client
-                    if i % 5 == 0 or i == len(client_list):
-                        progress_text = (
-                            f"⏳ **Создание клиентов...**\n\n"
-                            f"📊 Прогресс: {i}/{len(client_list)}\n"
-                            f"✅ Создано: {len(results['created'])}\n"
-                            f"❌ Ошибок: {len(results['failed'])}\n\n"
-                            f"Текущий клиент: **{self.escape_markdown(client['name'])}**"
-                        )
-                        
-                        if progress_msg_id:
-                            try:
-                                self.bot.edit_message_text(
-                                    chat_id=message.chat.id,
-                                    message_id=progress_msg_id,
-                                    text=progress_text,
-                                    parse_mode='Markdown'
-                                )
-                            except:
-                                pass
-                        else:
-                            progress_msg = self.bot.send_message(
-                                message.chat.id,
-                                progress_text,
-                                parse_mode='Markdown'
-                            )
-                            progress_msg_id = progress_msg.message_id
-                    
-                    # Create client
-                    success, result_msg = self.add_vpn_config(client["name"], client["ip"])
-                    
-                    if success:
-                        results["created"].append({
-                            "name": client["name"],
-                            "ip": client["ip"]
-                        })
-                        logger.info(f"Bulk creation: {client['name']} created successfully")
-                    else:
-                        results["failed"].append({
-                            "name": client["name"],
-                            "error": result_msg
-                        })
-                        logger.error(f"Bulk creation: {client['name']} failed - {result_msg}")
-                    
-                    # Small delay to prevent overwhelming
-                    import time
-                    time.sleep(0.5)
-                    
-                except Exception as e:
-                    results["failed"].append({
-                        "name": client["name"],
-                        "error": str(e)
-                    })
-                    logger.error(f"Error creating client {client['name']}: {e}")
-            
-            # Send final results
-            self.send_bulk_results(message, results)
+            # Spread clients over the fleet with a single load query
+            placement = self.fleet.place(len(client_list)) if self.fleet is not None else [None] * len(client_list)
+            items = []
+            for client, node_name in zip(client_list, placement):
+                item = dict(client, node=node_name)
+                item["rate"] = list(client["rate"]) if client.get("rate") else None
+                items.append(item)
+            import_info = getattr(self, 'temp_bulk_import', None)
+            params = {"report": import_info["file"], "rejected": import_info["rejected"]} if import_info else None
+            self.jobs.submit('bulk_create', message.chat.id, items, params, message_id=message.message_id)
             
             # Clean up temp data
             if hasattr(self, 'temp_bulk_clients'):
                 delattr(self, 'temp_bulk_clients')
+            self.temp_bulk_import = None
             
         except Exception as e:
             logger.error(f"Error performing bulk creation: {e}")
@@ -787,6 +1493,54 @@ class WireGuardBot:
             )
             self.show_monitoring_menu(message)
 
+    def bulk_create_step(self, job, client):
+        """Create one client of a bulk_create job"""
+        address = self.pool.address_of(client["name"]) if self.fleet is None else None
+        if address is not None:
+            # Names are checked against existing clients when the list is parsed,
+            # so this one was created right before an interrupted checkpoint
+            return "created", {"name": client["name"], "ip": address, "config": None}
+        try:
+            expires = int(time.time()) + client["lifetime"] if client.get("lifetime") else None
+            rate = RateLimit(*client["rate"]) if client.get("rate") else None
+            success, result_msg, config_text, address = self.create_client_placed(
+                client["name"], client["ip"], client.get("node"), expires, rate,
+                client.get("route"), client.get("profile"), client.get("psk"),
+                apply_shaping=False, apply_config=False
+            )
+            if success and client.get("tags") and self.fleet is None:
+                self.set_client_tags(client["name"], client["tags"])
+        except Exception as e:
+            success, result_msg = False, str(e)
+        
+        if success:
+            logger.info(f"Bulk creation: {client['name']} created successfully")
+            return "created", {"name": client["name"], "ip": address or client["ip"], "config": config_text}
+        logger.error(f"Bulk creation: {client['name']} failed - {result_msg}")
+        return "failed", {"name": client["name"], "error": result_msg}
+    
+    def bulk_create_finish(self, job):
+        # The whole batch goes into wg0 with one syncconf and its limits into one tc invocation
+        if self.fleet is None and job.count("created"):
+            self.apply_wireguard_config()
+            self.sync_grace_peers()
+        if self.fleet is None and any(client.get("rate") for client in job.items[:job.position]):
+            self.apply_shaping()
+        if job.params.get("report"):
+            # File imports get a report file instead of chat lines
+            created = {entry["name"]: entry for entry in job.results.get("created", [])}
+            failed = {entry["name"]: entry["error"] for entry in job.results.get("failed", [])}
+            self.send_import_report(job.chat_id, job.params["report"], job.items, job.params["rejected"], created, failed)
+            if created:
+                self.send_bulk_configs_archive(self.chat_stub(job.chat_id), list(created.values()))
+            self.show_monitoring_menu(self.chat_stub(job.chat_id))
+            return
+        self.send_bulk_results(self.chat_stub(job.chat_id), {
+            "created": job.results.get("created", []),
+            "failed": job.results.get("failed", []),
+            "total": job.total
+        })
+
     def send_bulk_results(self, message, results):
         """Send bulk creation results"""
         try:
@@ -816,7 +1570,7 @@ class WireGuardBot:
             if results["created"]:
                 summary_msg += f"\n🟢 **Созданные клиенты:**\n"
                 for client in results["created"][:10]:  # Show first 10
-                    ip_info = f"(.{client['ip']})" if client["ip"] != "auto" else "(авто IP)"
+                    ip_info = f"({client['ip']})" if client["ip"] != "auto" else "(авто IP)"
                     summary_msg += f"• **{self.escape_markdown(client['name'])}** {ip_info}\n"
                 
                 if len(results["created"]) > 10:
@@ -854,7 +1608,9 @@ class WireGuardBot:
                 for client in created_clients:
                     try:
                         config_file_path = Path(f"/etc/wireguard/{client['name']}_cl.conf")
-                        if config_file_path.exists():
+                        if client.get("config"):
+                            self.send_config_text(message.chat.id, client['name'], client['config'])
+                        elif config_file_path.exists():
                             with open(config_file_path, 'rb') as f:
                                 self.bot.send_document(
                                     message.chat.id,
@@ -874,7 +1630,10 @@ class WireGuardBot:
                         configs_added = 0
                         for client in created_clients:
                             config_file_path = Path(f"/etc/wireguard/{client['name']}_cl.conf")
-                            if config_file_path.exists():
+                            if client.get("config"):
+                                zipf.writestr(f"{client['name']}.conf", client["config"])
+                                configs_added += 1
+                            elif config_file_path.exists():
                                 zipf.write(
                                     config_file_path, 
                                     f"{client['name']}.conf"
@@ -921,9 +1680,9 @@ class WireGuardBot:
                 "client2\n"
                 "client3\n"
                 "```\n\n"
-                "**Формат 2 - По IP октетам:**\n"
+                "**Формат 2 - По IP адресам (октет для подсети /24):**\n"
                 "```\n"
-                "5\n"
+                f"{self.pool.address_at(5)}\n"
                 "10\n"
                 "15\n"
                 "```\n\n"
@@ -933,6 +1692,13 @@ class WireGuardBot:
                 "10\n"
                 "client3\n"
                 "```\n\n"
+                "**Селекторы:**\n"
+                "• `test-*` - шаблон имени, `re:^tmp\\d+$` - регулярное выражение\n"
+                "• `10-40` - диапазон адресов\n"
+                "• `tag:guests` - клиенты с тегом\n"
+                "• `idle > 30d` - без подключений дольше срока (m, h, d, w)\n"
+                "• `never` - ни разу не подключались\n"
+                "• `tag:guests & idle > 30d` - все условия строки сразу\n\n"
                 "**Специальные команды:**\n"
                 "• `*` или `all` - удалить ВСЕХ клиентов\n"
                 "• `#комментарий` - строки игнорируются\n\n"
@@ -940,10 +1706,10 @@ class WireGuardBot:
             )
             
             # Add current clients list (first 15)
-            sorted_configs = sorted(configs.items(), key=lambda x: int(x[1]['octet']))
+            sorted_configs = sorted(configs.items(), key=self.address_sort_key)
             for i, (client_name, config_info) in enumerate(sorted_configs[:15]):
                 escaped_name = self.escape_markdown(client_name)
-                help_text += f"• **{escaped_name}** - {config_info['ip']} (октет: {config_info['octet']})\n"
+                help_text += f"• **{escaped_name}** - {self.format_addresses(config_info)}\n"
             
             if len(configs) > 15:
                 help_text += f"... и ещё {len(configs) - 15} клиентов\n"
@@ -976,7 +1742,13 @@ class WireGuardBot:
         
         try:
             # Parse deletion list
-            deletion_list = self.parse_deletion_list(message.text)
+            deletion_list, parse_errors = self.parse_deletion_list(message.text)
+            
+            if parse_errors:
+                error_msg = "❌ Ошибки в списке для удаления:\n" + "\n".join(parse_errors)
+                self.bot.send_message(message.chat.id, error_msg)
+                self.show_monitoring_menu(message)
+                return
             
             if not deletion_list:
                 self.bot.send_message(message.chat.id, "❌ Не удалось распознать список для удаления")
@@ -1000,71 +1772,49 @@ class WireGuardBot:
             self.show_monitoring_menu(message)
 
     def parse_deletion_list(self, text):
-        """Parse deletion list from text"""
+        """Parse deletion list into selectors and per-line errors"""
         try:
-            items = []
-            lines = text.strip().split('\n')
-            
-            for line in lines:
-                line = line.strip()
-                if not line or line.startswith('#'):  # Skip empty lines and comments
-                    continue
-                
-                # Check for special commands
-                if line.lower() in ['*', 'all', 'все']:
-                    items.append({"type": "all"})
-                elif line.isdigit():
-                    # IP octet
-                    octet = int(line)
-                    if 2 <= octet <= 254:
-                        items.append({"type": "ip", "value": octet})
-                else:
-                    # Client name
-                    items.append({"type": "name", "value": line})
-            
-            return items
-            
+            return parse_selectors(text, self.pool.parse_address)
         except Exception as e:
             logger.error(f"Error parsing deletion list: {e}")
-            return []
+            return [], []
+
+    def deletion_candidates(self, existing_configs: dict, facts: set):
+        """Yield existing clients with only the facts the selectors need"""
+        stats = self.get_peer_stats() if 'activity' in facts else {}
+        for client_name, config_info in existing_configs.items():
+            address = config_info['ip']
+            if not facts:
+                yield Candidate(client_name, address)
+                continue
+            last_seen, created = 0, 0
+            if 'activity' in facts:
+                record = self.store.get(client_name)
+                stat = stats.get(address)
+                last_seen = max(record.get('last_seen', 0), stat.latest_handshake if stat else 0)
+                # Clients created before the store existed: the config file age, as in find_idle_peers
+                created = record.get('created') or int(config_info['file'].stat().st_mtime)
+            yield Candidate(client_name, address, self.tag_index.tags_of(client_name), last_seen, created)
 
     def validate_bulk_deletion(self, deletion_list):
-        """Validate bulk deletion list"""
+        """Resolve deletion selectors against the clients in one pass"""
         try:
-            errors = []
-            clients_to_delete = {}
-            
-            # Get existing configurations
             existing_configs = self.scan_existing_configs()
             
             if not existing_configs:
                 return {"valid": False, "errors": "Нет клиентов для удаления"}
             
-            for i, item in enumerate(deletion_list, 1):
-                if item["type"] == "all":
-                    # Delete all clients
-                    clients_to_delete.update(existing_configs)
-                    continue
-                elif item["type"] == "ip":
-                    # Find client by IP octet
-                    octet = item["value"]
-                    found = False
-                    for name, config in existing_configs.items():
-                        if int(config['octet']) == octet:
-                            clients_to_delete[name] = config
-                            found = True
-                            break
-                    
-                    if not found:
-                        errors.append(f"Строка {i}: IP октет {octet} не найден")
-                        
-                elif item["type"] == "name":
-                    # Find client by name
-                    name = item["value"]
-                    if name in existing_configs:
-                        clients_to_delete[name] = existing_configs[name]
-                    else:
-                        errors.append(f"Строка {i}: клиент '{name}' не найден")
+            selected, counts = select(
+                deletion_list, self.deletion_candidates(existing_configs, required_facts(deletion_list)),
+                tagged=self.tag_index.names
+            )
+            
+            # A selector that matches nothing is most likely a typo: stop rather than delete the rest
+            errors = [
+                f"Строка {selector.line}: '{selector.text}' - клиенты не найдены"
+                for selector in deletion_list if not counts[selector.line]
+            ]
+            clients_to_delete = {name: existing_configs[name] for name in selected if name in existing_configs}
             
             if not clients_to_delete and not errors:
                 errors.append("Не найдено клиентов для удаления")
@@ -1086,8 +1836,8 @@ class WireGuardBot:
             
             # Create preview
             preview_lines = []
-            for i, (client_name, config_info) in enumerate(sorted(clients_to_delete.items(), key=lambda x: int(x[1]['octet']))[:10]):
-                preview_lines.append(f"• **{self.escape_markdown(client_name)}** - {config_info['ip']}")
+            for i, (client_name, config_info) in enumerate(sorted(clients_to_delete.items(), key=self.address_sort_key)[:10]):
+                preview_lines.append(f"• **{self.escape_markdown(client_name)}** - {self.format_addresses(config_info)}")
             
             if len(clients_to_delete) > 10:
                 preview_lines.append(f"... и ещё {len(clients_to_delete) - 10} клиентов")
@@ -1147,85 +1897,10 @@ class WireGuardBot:
             self.show_monitoring_menu(message)
 
     def perform_bulk_deletion(self, message, clients_to_delete):
-        """Actually perform bulk client deletion"""
+        """Queue bulk client deletion as a background job"""
         try:
-            # Edit message to show progress
-            self.bot.edit_message_text(
-                chat_id=message.chat.id,
-                message_id=message.message_id,
-                text="⏳ **Массовое удаление клиентов...**\n\nПожалуйста, подождите.",
-                parse_mode='Markdown'
-            )
-            
-            results = {
-                "deleted": [],
-                "failed": [],
-                "total": len(clients_to_delete)
-            }
-            
-            # Progress tracking
-            progress_msg_id = None
-            
-            for i, (client_name, config_info) in enumerate(clients_to_delete.items(), 1):
-                try:
-                    # Update progress every 3 clients or on last client
-                    if i % 3 == 0 or i == len(clients_to_delete):
-                        progress_text = (
-                            f"⏳ **Удаление клиентов...**\n\n"
-                            f"📊 Прогресс: {i}/{len(clients_to_delete)}\n"
-                            f"✅ Удалено: {len(results['deleted'])}\n"
-                            f"❌ Ошибок: {len(results['failed'])}\n\n"
-                            f"Текущий клиент: **{self.escape_markdown(client_name)}**"
-                        )
-                        
-                        if progress_msg_id:
-                            try:
-                                self.bot.edit_message_text(
-                                    chat_id=message.chat.id,
-                                    message_id=progress_msg_id,
-                                    text=progress_text,
-                                    parse_mode='Markdown'
-                                )
-                            except:
-                                pass
-                        else:
-                            progress_msg = self.bot.send_message(
-                                message.chat.id,
-                                progress_text,
-                                parse_mode='Markdown'
-                            )
-                            progress_msg_id = progress_msg.message_id
-                    
-                    # Delete client
-                    ip_octet = int(config_info['octet'])
-                    success, result_msg = self.perform_client_deletion(client_name, ip_octet, message.chat.id)
-                    
-                    if success:
-                        results["deleted"].append({
-                            "name": client_name,
-                            "ip": config_info['ip']
-                        })
-                        logger.info(f"Bulk deletion: {client_name} deleted successfully")
-                    else:
-                        results["failed"].append({
-                            "name": client_name,
-                            "error": result_msg
-                        })
-                        logger.error(f"Bulk deletion: {client_name} failed - {result_msg}")
-                    
-                    # Small delay to prevent overwhelming
-                    import time
-                    time.sleep(0.3)
-                    
-                except Exception as e:
-                    results["failed"].append({
-                        "name": client_name,
-                        "error": str(e)
-                    })
-                    logger.error(f"Error deleting client {client_name}: {e}")
-            
-            # Send final results
-            self.send_bulk_deletion_results(message, results)
+            items = [[client_name, config_info['ip']] for client_name, config_info in clients_to_delete.items()]
+            self.jobs.submit('bulk_delete', message.chat.id, items, message_id=message.message_id)
             
             # Clean up temp data
             if hasattr(self, 'temp_bulk_deletion'):
@@ -1240,6 +1915,35 @@ class WireGuardBot:
             )
             self.show_monitoring_menu(message)
 
+    def bulk_delete_step(self, job, item):
+        """Delete one client of a bulk_delete job; WireGuard is applied once in bulk_delete_finish"""
+        client_name, address = item
+        if job.position == 0:
+            self.sample_traffic()
+        if self.pool.address_of(client_name) is None:
+            # Deleted right before an interrupted checkpoint
+            return "deleted", {"name": client_name, "ip": address}
+        try:
+            success, result_msg = self.perform_client_deletion(client_name, address, None, restart=False)
+        except Exception as e:
+            success, result_msg = False, str(e)
+        if success:
+            logger.info(f"Bulk deletion: {client_name} deleted successfully")
+            return "deleted", {"name": client_name, "ip": address}
+        logger.error(f"Bulk deletion: {client_name} failed - {result_msg}")
+        return "failed", {"name": client_name, "error": result_msg}
+    
+    def bulk_delete_finish(self, job):
+        if job.count("deleted"):
+            self.apply_wireguard_config()
+            self.apply_shaping()
+            self.sync_grace_peers()
+        self.send_bulk_deletion_results(self.chat_stub(job.chat_id), {
+            "deleted": job.results.get("deleted", []),
+            "failed": job.results.get("failed", []),
+            "total": job.total
+        })
+
     def send_bulk_deletion_results(self, message, results):
         """Send bulk deletion results"""
         try:
@@ -1294,6 +1998,7 @@ class WireGuardBot:
             logger.error(f"Error sending bulk deletion results: {e}")
             self.bot.send_message(message.chat.id, "❌ Ошибка при отправке результатов")
 
+    @with_state_lock
     def uninstall_wireguard(self, message):
         try:
             chat_id = message.chat.id
@@ -1345,7 +2050,102 @@ class WireGuardBot:
             return
         
         try:
-            if call.data.startswith("select_ip:"):
+            if call.data == "noop":
+                self.bot.answer_callback_query(call.id)
+                
+            elif call.data.startswith("mon:"):
+                _, page, sort, flt = call.data.split(":")
+                text, markup = self.render_monitor_page(int(page), sort, flt)
+                self.edit_page(call, text, markup)
+                
+            elif call.data.startswith("ipsel:"):
+                text, markup = self.render_ip_selection_page(int(call.data.split(":")[1]))
+                self.edit_page(call, text, markup)
+                
+            elif call.data == "reap:disable":
+                names = getattr(self, 'temp_idle_peers', [])
+                disabled = self.disable_clients(names)
+                self.bot.edit_message_text(
+                    chat_id=call.message.chat.id,
+                    message_id=call.message.message_id,
+                    text=f"⏸ Отключено клиентов: {len(disabled)}\nВключить обратно: /enable имя или /disabled"
+                )
+                self.bot.answer_callback_query(call.id)
+                
+            elif call.data.startswith("enable:"):
+                target = call.data.split(":", 1)[1]
+                names = [name for name, record in self.store.items() if record.get('disabled')] if target == "*" else [target]
+                enabled = self.enable_clients(names)
+                self.bot.answer_callback_query(call.id, f"Включено: {len(enabled)}")
+                
+            elif call.data in ("rotate:now", "rotate:grace"):
+                self.bot.edit_message_text(
+                    chat_id=call.message.chat.id,
+                    message_id=call.message.message_id,
+                    text="🔑 Смена ключа сервера..."
+                )
+                self.bot.answer_callback_query(call.id)
+                self.rotate_server_key(call.message.chat.id, grace=call.data == "rotate:grace")
+                
+            elif call.data.startswith("chart:"):
+                self.bot.answer_callback_query(call.id)
+                self.send_chart(call.message.chat.id, call.data.split(":", 1)[1])
+                
+            elif call.data == "drift:repair":
+                self.bot.answer_callback_query(call.id)
+                self.repair_drift(call.message.chat.id)
+                
+            elif call.data == "reconcile:apply":
+                if call.message.chat.id not in self.pending_reconcile:
+                    self.bot.answer_callback_query(call.id, "Предпросмотр устарел, отправьте документ заново")
+                else:
+                    self.apply_reconcile(call.message.chat.id, call.message.message_id)
+                    self.bot.answer_callback_query(call.id)
+                
+            elif call.data == "reconcile:cancel":
+                self.pending_reconcile.pop(call.message.chat.id, None)
+                self.bot.edit_message_text(
+                    chat_id=call.message.chat.id,
+                    message_id=call.message.message_id,
+                    text="❌ Применение отменено"
+                )
+                self.bot.answer_callback_query(call.id)
+                
+            elif call.data.startswith("job:"):
+                _, action, job_id = call.data.split(":", 2)
+                job = self.jobs.get(job_id)
+                if job is None:
+                    self.bot.answer_callback_query(call.id, "Задача не найдена")
+                elif action == "cancel":
+                    cancelled = self.jobs.cancel(job_id)
+                    self.bot.answer_callback_query(
+                        call.id, "Задача остановится после текущего шага" if cancelled else "Задачу нельзя отменить"
+                    )
+                elif job.state == RUNNING:
+                    self.bot.answer_callback_query(call.id)
+                    self.report_job(job, False)
+                else:
+                    self.bot.answer_callback_query(call.id)
+                    self.bot.send_message(call.message.chat.id, self.format_job(job), parse_mode='Markdown')
+                
+            elif call.data == "psk:all":
+                self.bot.edit_message_text(
+                    chat_id=call.message.chat.id,
+                    message_id=call.message.message_id,
+                    text="🔐 Добавление PresharedKey..."
+                )
+                self.bot.answer_callback_query(call.id)
+                self.add_preshared_keys([name for name, _ in self.pool.items()], call.message.chat.id)
+                
+            elif call.data == "rotate:finish":
+                self.bot.answer_callback_query(call.id)
+                self.finish_key_rotation(call.message.chat.id)
+                
+            elif call.data.startswith(("cfg:", "qr:", "del:", "delok:")):
+                action, client_name = call.data.split(":", 1)
+                self.handle_client_action(call, action, client_name)
+                
+            elif call.data.startswith("select_ip:"):
                 selected_ip = call.data.split(":")[1]
                 
                 # Create config with selected IP
@@ -1354,7 +2154,12 @@ class WireGuardBot:
                     self.bot.answer_callback_query(call.id, "Ошибка: имя конфига не найдено")
                     return
                 
-                success, message_text = self.add_vpn_config(config_name, selected_ip)
+                success, message_text = self.add_vpn_config(
+                    config_name, selected_ip,
+                    getattr(self, 'temp_config_expires', None), getattr(self, 'temp_config_rate', None),
+                    getattr(self, 'temp_config_route', None), getattr(self, 'temp_config_profile', None),
+                    getattr(self, 'temp_config_psk', None)
+                )
                 
                 # Edit the message to remove inline keyboard
                 self.bot.edit_message_text(
@@ -1432,6 +2237,7 @@ class WireGuardBot:
                 self.bot.answer_callback_query(call.id)
                 
             elif call.data == "bulk_create_cancel":
+                self.temp_bulk_import = None
                 self.bot.edit_message_text(
                     chat_id=call.message.chat.id,
                     message_id=call.message.message_id,
@@ -1465,6 +2271,143 @@ class WireGuardBot:
             logger.error(f"Error handling callback: {e}")
             self.bot.answer_callback_query(call.id, "Произошла ошибка")
 
+    def find_command(self, message):
+        """/find <part of name>: search clients by name"""
+        if not self.is_authorized(message.chat.id):
+            self.send_unauthorized_message(message)
+            return
+        
+        query = message.text.partition(' ')[2].strip()
+        if not query:
+            self.bot.send_message(message.chat.id, "Использование: `/find часть_имени`", parse_mode='Markdown')
+            return
+        
+        try:
+            if query.lower().startswith('tag:'):
+                tag = query[4:].strip().lower()
+                names = self.tag_index.names(tag)
+                if names:
+                    self.send_tag_list(message.chat.id, tag, names)
+                else:
+                    self.bot.send_message(message.chat.id, f"❌ Нет клиентов с тегом {tag}")
+                return
+            
+            matches = self.find_clients(query, limit=10)
+            if not matches:
+                self.bot.send_message(message.chat.id, f"🔍 По запросу '{query}' ничего не найдено")
+                return
+            
+            for client_name, address, status in matches:
+                self.bot.send_message(
+                    message.chat.id,
+                    f"{status} **{self.escape_markdown(client_name)}** `{address}`",
+                    reply_markup=self.client_actions_markup(client_name),
+                    parse_mode='Markdown'
+                )
+        except Exception as e:
+            logger.error(f"Error searching clients: {e}")
+            self.bot.send_message(message.chat.id, "❌ Ошибка при поиске клиентов")
+    
+    def handle_inline_query(self, query):
+        """Inline mode: @bot <part of name> lists matching clients with action buttons"""
+        if not self.is_authorized(query.from_user.id):
+            self.bot.answer_inline_query(query.id, [], cache_time=0, is_personal=True)
+            return
+        
+        try:
+            results = []
+            for client_name, address, status in self.find_clients(query.query, limit=20):
+                results.append(types.InlineQueryResultArticle(
+                    id=client_name,
+                    title=f"{status} {client_name}",
+                    description=address,
+                    input_message_content=types.InputTextMessageContent(f"{status} {client_name} - {address}"),
+                    reply_markup=self.client_actions_markup(client_name)
+                ))
+            self.bot.answer_inline_query(query.id, results, cache_time=0, is_personal=True)
+        except Exception as e:
+            logger.error(f"Error answering inline query: {e}")
+    
+    def find_clients(self, query: str, limit: int = 10) -> list:
+        """Matching clients as (name, address, status emoji), from the name index and one `wg show dump`"""
+        names = self.name_index.search(query, limit)
+        if not names:
+            return []
+        
+        stats = self.get_peer_stats()
+        now = time.time()
+        matches = []
+        for client_name in names:
+            address = self.pool.address_of(client_name) or "?"
+            stat = stats.get(address)
+            if stat is None or not stat.latest_handshake:
+                status = "⚪"
+            elif now - stat.latest_handshake < ONLINE_WINDOW:
+                status = "🟢"
+            else:
+                status = "🔴"
+            matches.append((client_name, address, status))
+        return matches
+    
+    @staticmethod
+    def client_actions_markup(client_name: str):
+        markup = types.InlineKeyboardMarkup()
+        markup.row(
+            types.InlineKeyboardButton("📄 Конфиг", callback_data=f"cfg:{client_name}"),
+            types.InlineKeyboardButton("📱 QR", callback_data=f"qr:{client_name}"),
+            types.InlineKeyboardButton("🗑 Удалить", callback_data=f"del:{client_name}")
+        )
+        return markup
+    
+    def handle_client_action(self, call, action, client_name):
+        """One-tap actions from search results; replies go to the user's private chat"""
+        chat_id = call.from_user.id
+        config_path = Path(f"/etc/wireguard/{client_name}_cl.conf")
+        
+        if action in ("cfg", "qr") and not config_path.exists():
+            self.bot.answer_callback_query(call.id, "Конфиг не найден")
+            return
+        
+        if action == "cfg":
+            with open(config_path, 'rb') as file:
+                self.bot.send_document(chat_id, file, caption=f"📄 Конфигурация {client_name}")
+        elif action == "qr":
+            if not self.generate_qr_code(str(config_path), chat_id):
+                self.bot.send_message(chat_id, "❌ Не удалось создать QR-код")
+        elif action == "del":
+            markup = types.InlineKeyboardMarkup()
+            markup.row(
+                types.InlineKeyboardButton(f"🗑 Удалить {client_name}", callback_data=f"delok:{client_name}"),
+                types.InlineKeyboardButton("❌ Отменить", callback_data="noop")
+            )
+            self.bot.send_message(chat_id, f"Удалить клиента **{self.escape_markdown(client_name)}**?",
+                                  reply_markup=markup, parse_mode='Markdown')
+        elif action == "delok":
+            address = self.pool.address_of(client_name)
+            if address is None:
+                self.bot.answer_callback_query(call.id, "Клиент не найден")
+                return
+            success, message_text = self.perform_client_deletion(client_name, address, chat_id)
+            self.bot.send_message(chat_id, message_text if success else f"❌ {message_text}", parse_mode='Markdown')
+        
+        self.bot.answer_callback_query(call.id)
+
+    def edit_page(self, call, text, markup):
+        """Replace a paginated message in place"""
+        try:
+            self.bot.edit_message_text(
+                chat_id=call.message.chat.id,
+                message_id=call.message.message_id,
+                text=text,
+                reply_markup=markup,
+                parse_mode='Markdown'
+            )
+        except telebot.apihelper.ApiTelegramException as e:
+            # Refreshing an unchanged page is not an error
+            if 'message is not modified' not in str(e):
+                raise
+        self.bot.answer_callback_query(call.id)
+
     def id_command(self, message):
         user_info = f"Id: {message.chat.id}\nusername: {message.from_user.username}"
         self.bot.send_message(message.chat.id, text=user_info)
@@ -1488,7 +2431,12 @@ class WireGuardBot:
         elif text == "Удалить_конфиг":
             self.prompt_delete_config(message)
         elif text == "Добавить_конфиг":
-            self.bot.send_message(message.chat.id, "Введите название нового конфига", reply_markup=types.ReplyKeyboardRemove())
+            self.bot.send_message(
+                message.chat.id,
+                "Введите название нового конфига\n(для временного доступа добавьте срок: `guest 30d`, также `12h`, `2w`)",
+                reply_markup=types.ReplyKeyboardRemove(),
+                parse_mode='Markdown'
+            )
             self.bot.register_next_step_handler(message, self.get_config_name)
         elif text == "Массовое_создание":
             self.start_bulk_creation(message)
@@ -1505,6 +2453,8 @@ class WireGuardBot:
             self.backup_config(message)
         elif text == "Импортировать_конигурацию":
             self.restore_config(message)
+        elif text == "Сменить_ключ_сервера":
+            self.rotate_command(message)
         elif text == "Пересоздать_конфиги":
             self.recreate_configs(message)
         elif text == "Статистика":
@@ -1536,8 +2486,9 @@ class WireGuardBot:
         uninstall_btn = types.KeyboardButton("Полное_удаление")
         backup_btn = types.KeyboardButton("Сохранить_конигурацию")
         restore_btn = types.KeyboardButton("Импортировать_конигурацию")
+        rotate_btn = types.KeyboardButton("Сменить_ключ_сервера")
         back_btn = types.KeyboardButton("Назад")
-        markup.add(install_btn, uninstall_btn, backup_btn, restore_btn, back_btn)
+        markup.add(install_btn, uninstall_btn, backup_btn, restore_btn, rotate_btn, back_btn)
         self.bot.send_message(message.chat.id, text="Выполни запрос", reply_markup=markup)
     
     def confirm_uninstall(self, message):
@@ -1569,15 +2520,15 @@ class WireGuardBot:
             # Create client list message
             clients_msg = "👥 **Список клиентов для удаления:**\n\n"
             
-            sorted_configs = sorted(configs.items(), key=lambda x: int(x[1]['octet']))
+            sorted_configs = sorted(configs.items(), key=self.address_sort_key)
             for client_name, config_info in sorted_configs:
                 escaped_name = self.escape_markdown(client_name)
-                clients_msg += f"• **{escaped_name}** - {config_info['ip']} (октет: {config_info['octet']})\n"
+                clients_msg += f"• **{escaped_name}** - {self.format_addresses(config_info)}\n"
             
             clients_msg += f"\n📝 **Способы удаления:**\n"
             clients_msg += f"**По имени:** Введите точное имя клиента\n"
-            clients_msg += f"**По IP:** Введите последний октет IP\n\n"
-            clients_msg += f"Например: `server1` или `47`"
+            clients_msg += f"**По IP:** Введите IP адрес (для подсети /24 достаточно последнего октета)\n\n"
+            clients_msg += f"Например: `server1` или `{self.pool.address_at(47)}`"
             
             self.bot.send_message(
                 message.chat.id, 
@@ -1604,10 +2555,10 @@ class WireGuardBot:
             if configs:
                 summary_msg = f"📋 **Список конфигураций ({len(configs)} клиентов):**\n\n"
                 
-                sorted_configs = sorted(configs.items(), key=lambda x: int(x[1]['octet']))
+                sorted_configs = sorted(configs.items(), key=self.address_sort_key)
                 for client_name, config_info in sorted_configs:
                     escaped_name = self.escape_markdown(client_name)
-                    summary_msg += f"👤 **{escaped_name}** - {config_info['ip']}\n"
+                    summary_msg += f"👤 **{escaped_name}** - {self.format_addresses(config_info)}\n"
                 
                 self.bot.send_message(message.chat.id, summary_msg, parse_mode='Markdown')
             
@@ -1622,11 +2573,11 @@ class WireGuardBot:
             if configs:
                 self.bot.send_message(message.chat.id, f"📦 Отправляю клиентские конфигурации ({len(configs)} файлов)...")
                 
-                sorted_configs = sorted(configs.items(), key=lambda x: int(x[1]['octet']))
+                sorted_configs = sorted(configs.items(), key=self.address_sort_key)
                 for client_name, config_info in sorted_configs:
                     try:
                         with open(config_info['file'], 'rb') as file:
-                            caption = f"👤 {client_name} - {config_info['ip']}"
+                            caption = f"👤 {client_name} - {self.format_addresses(config_info)}"
                             self.bot.send_document(message.chat.id, document=file, caption=caption)
                     except Exception as e:
                         logger.error(f"Error sending config file {config_info['file']}: {e}")
@@ -1654,6 +2605,7 @@ class WireGuardBot:
             logger.error(f"Error sending configs: {e}")
             self.bot.send_message(message.chat.id, "❌ Ошибка при отправке конфигураций")
     
+    @with_state_lock
     def backup_config(self, message):
         """Create and send backup configuration as file"""
         try:
@@ -1711,7 +2663,9 @@ class WireGuardBot:
                 "created": datetime.now().isoformat(),
                 "server_config": {},
                 "clients": {},
-                "variables": {}
+                "variables": {},
+                "client_store": self.store.dump(),
+                "traffic": self.traffic.dump()
             }
             
             # Backup server configuration
@@ -1732,7 +2686,7 @@ class WireGuardBot:
             for client_name, config_info in configs.items():
                 client_data = {
                     "ip": config_info["ip"],
-                    "octet": config_info["octet"],
+                    "ip6": config_info.get("ip6"),
                     "config_content": ""
                 }
                 
@@ -1742,7 +2696,7 @@ class WireGuardBot:
                         client_data["config_content"] = f.read()
                 
                 # Read client keys if they exist
-                for key_type in ["privatekey", "publickey"]:
+                for key_type in CLIENT_KEY_FILES:
                     key_path = Path(f"/etc/wireguard/{client_name}_{key_type}")
                     if key_path.exists():
                         with open(key_path, 'r', encoding='utf-8') as f:
@@ -1927,137 +2881,134 @@ class WireGuardBot:
             self.show_admin_menu(message)
 
     def perform_restore(self, message, temp_filename):
-        """Actually perform the restore operation"""
+        """Queue the restore as a background job, one item per phase"""
         try:
-            # Edit message to show progress
-            self.bot.edit_message_text(
-                chat_id=message.chat.id,
-                message_id=message.message_id,
-                text="⏳ **Выполняется импорт конфигурации...**\n\nПожалуйста, подождите.",
-                parse_mode='Markdown'
-            )
-            
-            # Load backup data
-            import json
-            with open(temp_filename, 'r', encoding='utf-8') as f:
-                backup_data = json.load(f)
-            
-            # Stop WireGuard
-            self.bot.send_message(message.chat.id, "🛑 Остановка WireGuard сервиса...")
+            params = {
+                "temp_filename": temp_filename,
+                "backup_dir": f"/tmp/wg_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
+                "restored": 0
+            }
+            self.jobs.submit('restore', message.chat.id, [phase for phase, _ in RESTORE_PHASES], params,
+                             message_id=message.message_id)
+        except Exception as e:
+            logger.error(f"Error performing restore: {e}")
+            self.bot.send_message(message.chat.id, f"❌ **Ошибка при импорте:**\n{str(e)[:200]}", parse_mode='Markdown')
+            self.show_admin_menu(message)
+    
+    def restore_step(self, job, phase):
+        """Run one phase of a restore job; any error stops the job"""
+        import shutil
+        params = job.params
+        with open(params["temp_filename"], 'r', encoding='utf-8') as f:
+            backup_data = json.load(f)
+        
+        if phase == 'stop':
+            self.update_last_seen()
+            self.sample_traffic()
             subprocess.run(['wg-quick', 'down', 'wg0'], capture_output=True, text=True)
-            
             # Backup current configuration (just in case)
-            import shutil
-            from datetime import datetime
-            backup_dir = f"/tmp/wg_backup_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
-            import os
-            os.makedirs(backup_dir, exist_ok=True)
-            
-            if Path("/etc/wireguard").exists():
-                shutil.copytree("/etc/wireguard", f"{backup_dir}/wireguard", dirs_exist_ok=True)
-            
-            # Clear current configuration
-            self.bot.send_message(message.chat.id, "🧹 Очистка текущей конфигурации...")
-            subprocess.run(['rm', '-rf', '/etc/wireguard/*'], shell=True, capture_output=True)
-            
-            # Restore server configuration
-            self.bot.send_message(message.chat.id, "🔧 Восстановление конфигурации сервера...")
-            
+            os.makedirs(params["backup_dir"], exist_ok=True)
+            # A resumed job may repeat this phase after the server files were replaced
+            if Path("/etc/wireguard").exists() and not Path(f"{params['backup_dir']}/wireguard").exists():
+                shutil.copytree("/etc/wireguard", f"{params['backup_dir']}/wireguard", dirs_exist_ok=True)
+        
+        elif phase == 'server':
+            # Clients missing from the backup must not survive it
+            wireguard_dir = Path("/etc/wireguard")
+            wireguard_dir.mkdir(exist_ok=True)
+            for path in wireguard_dir.iterdir():
+                if path.name in RESTORE_KEEP:
+                    continue
+                if path.is_dir() and not path.is_symlink():
+                    shutil.rmtree(path)
+                else:
+                    path.unlink()
             server_config = backup_data.get('server_config', {})
-            
-            # Restore main server config
             if 'wg0.conf' in server_config:
                 with open('/etc/wireguard/wg0.conf', 'w', encoding='utf-8') as f:
                     f.write(server_config['wg0.conf'])
-            
-            # Restore server keys
             for key_file in ['privatekey', 'publickey']:
                 if key_file in server_config:
                     with open(f'/etc/wireguard/{key_file}', 'w', encoding='utf-8') as f:
                         f.write(server_config[key_file])
                     subprocess.run(['chmod', '600' if key_file == 'privatekey' else '644', f'/etc/wireguard/{key_file}'])
-            
-            # Restore client configurations
-            self.bot.send_message(message.chat.id, "👥 Восстановление клиентских конфигураций...")
-            
-            clients = backup_data.get('clients', {})
+        
+        elif phase == 'clients':
             restored_clients = 0
-            
-            for client_name, client_data in clients.items():
+            for client_name, client_data in backup_data.get('clients', {}).items():
                 try:
-                    # Restore client config file
                     if 'config_content' in client_data and client_data['config_content']:
                         with open(f'/etc/wireguard/{client_name}_cl.conf', 'w', encoding='utf-8') as f:
                             f.write(client_data['config_content'])
-                    
-                    # Restore client keys
-                    for key_type in ['privatekey', 'publickey']:
+                    for key_type in CLIENT_KEY_FILES:
                         if key_type in client_data:
                             with open(f'/etc/wireguard/{client_name}_{key_type}', 'w', encoding='utf-8') as f:
                                 f.write(client_data[key_type])
-                            subprocess.run(['chmod', '600' if key_type == 'privatekey' else '644', 
+                            subprocess.run(['chmod', '644' if key_type == 'publickey' else '600', 
                                           f'/etc/wireguard/{client_name}_{key_type}'])
-                    
                     restored_clients += 1
-                    
                 except Exception as e:
                     logger.error(f"Error restoring client {client_name}: {e}")
-            
-            # Restore variables
+            params["restored"] = restored_clients
+        
+        elif phase == 'variables':
             variables = backup_data.get('variables', {})
             if 'variables.sh' in variables:
                 with open('scripts/variables.sh', 'w', encoding='utf-8') as f:
                     f.write(variables['variables.sh'])
-            
             if 'env.sh' in variables:
                 with open('scripts/env.sh', 'w', encoding='utf-8') as f:
                     f.write(variables['env.sh'])
-            
-            # Start WireGuard
-            self.bot.send_message(message.chat.id, "🚀 Запуск WireGuard сервиса...")
+        
+        elif phase == 'metadata':
+            # Client metadata (last seen, disabled peers); older backups have none
+            self.store.replace(backup_data.get('client_store', {}))
+            self.load_expiry()
+            self.load_tags()
+            if 'traffic' in backup_data:
+                self.traffic.replace(backup_data['traffic'])
+        
+        elif phase == 'start':
             result = subprocess.run(['wg-quick', 'up', 'wg0'], capture_output=True, text=True)
-            
-            # Clean up temp file
-            os.unlink(temp_filename)
-            
-            # Send final result
-            if result.returncode == 0:
-                success_msg = (
-                    f"✅ **Импорт завершен успешно!**\n\n"
-                    f"📊 **Статистика восстановления:**\n"
-                    f"👥 Клиентов восстановлено: {restored_clients}\n"
-                    f"🟢 WireGuard сервис: Активен\n\n"
-                    f"🗄️ Предыдущая конфигурация сохранена в: `{backup_dir}`"
-                )
-            else:
-                success_msg = (
-                    f"⚠️ **Импорт выполнен с ошибками**\n\n"
-                    f"👥 Клиентов восстановлено: {restored_clients}\n"
-                    f"❌ Ошибка запуска WireGuard: {result.stderr[:200]}...\n\n"
-                    f"🗄️ Предыдущая конфигурация сохранена в: `{backup_dir}`"
-                )
-            
-            self.bot.send_message(message.chat.id, success_msg, parse_mode='Markdown')
-            self.show_admin_menu(message)
-            logger.info(f"Configuration restored from backup, {restored_clients} clients restored")
-            
-        except Exception as e:
-            logger.error(f"Error performing restore: {e}")
-            self.bot.send_message(
-                message.chat.id, 
-                f"❌ **Ошибка при импорте:**\n{str(e)[:200]}...\n\n"
-                f"Попробуйте восстановить конфигурацию вручную из резервной копии в `{backup_dir if 'backup_dir' in locals() else '/tmp'}`",
-                parse_mode='Markdown'
+            self.load_address_pool()
+            self.apply_firewall()
+            self.apply_shaping()
+            params["up_error"] = result.stderr[:200] if result.returncode != 0 else None
+        return "phases", phase
+    
+    def restore_finish(self, job):
+        params = job.params
+        message = self.chat_stub(job.chat_id)
+        try:
+            if os.path.exists(params["temp_filename"]):
+                os.unlink(params["temp_filename"])
+        except OSError:
+            pass
+        
+        if job.state == FAILED:
+            text = (
+                f"❌ **Ошибка при импорте:**\n{(job.error or '')[:200]}...\n\n"
+                f"Попробуйте восстановить конфигурацию вручную из резервной копии в `{params['backup_dir']}`"
             )
-            self.show_admin_menu(message)
-            
-            # Clean up temp file
-            try:
-                import os
-                if os.path.exists(temp_filename):
-                    os.unlink(temp_filename)
-            except:
-                pass
+        elif params.get("up_error"):
+            text = (
+                f"⚠️ **Импорт выполнен с ошибками**\n\n"
+                f"👥 Клиентов восстановлено: {params['restored']}\n"
+                f"❌ Ошибка запуска WireGuard: {params['up_error']}...\n\n"
+                f"🗄️ Предыдущая конфигурация сохранена в: `{params['backup_dir']}`"
+            )
+        else:
+            text = (
+                f"✅ **Импорт завершен успешно!**\n\n"
+                f"📊 **Статистика восстановления:**\n"
+                f"👥 Клиентов восстановлено: {params['restored']}\n"
+                f"🟢 WireGuard сервис: Активен\n\n"
+                f"🗄️ Предыдущая конфигурация сохранена в: `{params['backup_dir']}`"
+            )
+            logger.info(f"Configuration restored from backup, {params['restored']} clients restored")
+        
+        self.bot.send_message(job.chat_id, text, parse_mode='Markdown')
+        self.show_admin_menu(message)
     
     def install_wireguard(self, message):
         config_file = Path('/etc/wireguard/wg0.conf')
@@ -2097,6 +3048,11 @@ class WireGuardBot:
                 if result.returncode != 0:
                     logger.warning(f"Cleanup command failed: {cmd}, error: {result.stderr}")
             
+            self.pool.clear()
+            self.name_index.clear()
+            self.store.load()
+            self.load_expiry()
+            self.load_tags()
             self.bot.send_message(message.chat.id, "Запускаю установку Wireguard")
             self._run_wireguard_install(message)
             
@@ -2108,17 +3064,33 @@ class WireGuardBot:
     
     def _run_wireguard_install(self, message):
         try:
-            result = subprocess.run(['scripts/start_wg.sh'], capture_output=True, text=True)
-            if result.returncode == 0:
-                self.bot.send_message(message.chat.id, "Установка Wireguard завершена")
-                logger.info("WireGuard installation completed successfully")
-            else:
-                logger.error(f"WireGuard installation failed: {result.stderr}")
-                self.bot.send_message(message.chat.id, "Ошибка при установке WireGuard")
+            self.jobs.submit('install', message.chat.id, ['install'])
         except Exception as e:
             logger.error(f"Error running WireGuard installation: {e}")
             self.bot.send_message(message.chat.id, "Ошибка при установке WireGuard")
     
+    def install_step(self, job, item):
+        env = dict(os.environ,
+                   WG_SERVER_ADDRESS=self.pool.server_address,
+                   WG_POOL_PREFIX=str(self.pool.prefixlen),
+                   WG_FIREWALL=wg_firewall)
+        if self.pool.network6 is not None:
+            env.update(WG_SERVER_ADDRESS6=self.pool.server_address6,
+                       WG_POOL6_PREFIX=str(self.pool.prefixlen6))
+        result = subprocess.run(['scripts/start_wg.sh'], capture_output=True, text=True, env=env)
+        self.apply_firewall()
+        if result.returncode != 0:
+            raise RuntimeError(result.stderr.strip()[-300:] or f"exit code {result.returncode}")
+        return "steps", item
+    
+    def install_finish(self, job):
+        if job.state == FAILED:
+            logger.error(f"WireGuard installation failed: {job.error}")
+            self.bot.send_message(job.chat_id, "Ошибка при установке WireGuard")
+        else:
+            logger.info("WireGuard installation completed successfully")
+            self.bot.send_message(job.chat_id, "Установка Wireguard завершена")
+    
     def scan_existing_configs(self) -> dict:
         """Scan /etc/wireguard/ for existing client configurations"""
         configs = {}
@@ -2141,22 +3113,26 @@ class WireGuardBot:
                     with open(config_file, 'r', encoding='utf-8') as f:
                         content = f.read()
                     
-                    # Extract IP from Address line
+                    # Extract IPv4 (and optional IPv6) from Address line
                     ip_address = None
+                    ip6_address = None
                     for line in content.split('\n'):
                         if line.strip().startswith('Address = '):
                             address_line = line.strip().replace('Address = ', '')
-                            # Extract IP without subnet mask
-                            ip_address = address_line.split('/')[0]
+                            # Extract IPs without subnet mask
+                            for item in address_line.split(','):
+                                ip = item.strip().split('/')[0]
+                                if ':' in ip:
+                                    ip6_address = ip6_address or ip
+                                elif ip:
+                                    ip_address = ip_address or ip
                             break
                     
                     if ip_address:
-                        # Extract last octet
-                        last_octet = ip_address.split('.')[-1]
                         configs[client_name] = {
                             'file': config_file,
                             'ip': ip_address,
-                            'octet': last_octet
+                            'ip6': ip6_address
                         }
                         logger.info(f"Found config: {client_name} -> {ip_address}")
                     
@@ -2169,6 +3145,7 @@ class WireGuardBot:
         
         return configs
     
+    @with_state_lock
     def recreate_configs_file(self, configs: dict) -> bool:
         """Recreate the configs.txt file based on existing configurations"""
         try:
@@ -2184,11 +3161,11 @@ class WireGuardBot:
                 configs_content.append("")
                 configs_content.append("Client configurations:")
                 
-                # Sort by octet number
-                sorted_configs = sorted(configs.items(), key=lambda x: int(x[1]['octet']))
+                # Sort by address
+                sorted_configs = sorted(configs.items(), key=self.address_sort_key)
                 
                 for client_name, config_info in sorted_configs:
-                    configs_content.append(f"  {client_name}: {config_info['ip']} (octet: {config_info['octet']})")
+                    configs_content.append(f"  {client_name}: {self.format_addresses(config_info)}")
             
             # Write to configs.txt
             configs_file = Path('configs.txt')
@@ -2218,16 +3195,18 @@ class WireGuardBot:
                 logger.info("No client configurations found for recreation")
                 return
             
+            self.load_address_pool(configs)
+            
             # Recreate configs.txt file
             if self.recreate_configs_file(configs):
                 success_msg = f"✅ Пересоздано конфигураций: {len(configs)}\n\n"
                 success_msg += "Найденные клиенты:\n"
                 
-                # Sort by octet for display
-                sorted_configs = sorted(configs.items(), key=lambda x: int(x[1]['octet']))
+                # Sort by address for display
+                sorted_configs = sorted(configs.items(), key=self.address_sort_key)
                 for client_name, config_info in sorted_configs[:10]:  # Show max 10 entries
                     escaped_name = self.escape_markdown(client_name)
-                    success_msg += f"• {escaped_name}: {config_info['ip']}\n"
+                    success_msg += f"• {escaped_name}: {self.format_addresses(config_info)}\n"
                 
                 if len(configs) > 10:
                     success_msg += f"... и ещё {len(configs) - 10} клиентов\n"
@@ -2260,88 +3239,18 @@ class WireGuardBot:
             )
     
     def show_clients_monitor(self, message):
-        """Show detailed client monitoring with IPs and config names"""
+        """Show one page of the client monitor; navigation edits the same message"""
         try:
-            self.bot.send_message(message.chat.id, "🔍 Получение списка клиентов...")
-            
-            # Scan existing configurations
-            configs = self.scan_existing_configs()
-            
-            if not configs:
+            if len(self.pool) == 0:
                 self.bot.send_message(
                     message.chat.id, 
                     "⚠️ Клиентские конфигурации не найдены"
                 )
                 return
             
-            # Build detailed client list
-            monitor_msg = f"👥 **Монитор клиентов WireGuard**\n\n"
-            monitor_msg += f"📊 **Общая статистика:**\n"
-            monitor_msg += f"• Активных клиентов: {len(configs)}\n"
-            
-            # Sort by IP octet for organized display
-            sorted_configs = sorted(configs.items(), key=lambda x: int(x[1]['octet']))
-            
-            monitor_msg += f"\n🗺 **Список клиентов:**\n"
-            
-            # Group clients for better display (max 20 per message)
-            chunks = [sorted_configs[i:i+20] for i in range(0, len(sorted_configs), 20)]
-            
-            for chunk_idx, chunk in enumerate(chunks):
-                if chunk_idx > 0:
-                    monitor_msg = f"\n🗺 **Продолжение списка клиентов:**\n"
-                
-                for client_name, config_info in chunk:
-                    # Get file modification time
-                    try:
-                        mod_time = datetime.fromtimestamp(config_info['file'].stat().st_mtime)
-                        time_str = mod_time.strftime('%d.%m %H:%M')
-                    except:
-                        time_str = "N/A"
-                    
-                    # Get file size
-                    try:
-                        file_size = config_info['file'].stat().st_size
-                        size_str = f"{file_size}B" if file_size < 1024 else f"{file_size//1024}KB"
-                    except:
-                        size_str = "N/A"
-                    
-                    # Format entry with emoji indicators and escape markdown
-                    status_emoji = "🟢"  # Green circle for active
-                    escaped_name = self.escape_markdown(client_name)
-                    monitor_msg += f"{status_emoji} **{escaped_name}**\n"
-                    monitor_msg += f"   🌍 IP: `{config_info['ip']}`\n"
-                    monitor_msg += f"   📅 Создан: {time_str}\n"
-                    monitor_msg += f"   📄 Размер: {size_str}\n\n"
-                
-                # Send message (split if too long)
-                if len(monitor_msg) > 4000:
-                    self.bot.send_message(message.chat.id, monitor_msg, parse_mode='Markdown')
-                    monitor_msg = ""
-            
-            # Send remaining content
-            if monitor_msg:
-                self.bot.send_message(message.chat.id, monitor_msg, parse_mode='Markdown')
-            
-            # Add summary at the end
-            if len(configs) > 20:
-                summary_msg = f"\n📊 **Сводка:**\n"
-                octets = [int(config['octet']) for config in configs.values()]
-                used_octets = set(octets)
-                available_octets = set(range(2, 254)) - used_octets
-                
-                summary_msg += f"• Используемые IP: {min(octets)}-{max(octets)}\n"
-                summary_msg += f"• Свободно IP: {len(available_octets)}\n"
-                
-                # Show next available IPs
-                next_available = sorted(available_octets)[:5]
-                if next_available:
-                    ips_str = ", ".join([f"{self.wg_ip_hint}.{octet}" for octet in next_available])
-                    summary_msg += f"• Ближайшие свободные: {ips_str}\n"
-                
-                self.bot.send_message(message.chat.id, summary_msg, parse_mode='Markdown')
-            
-            logger.info(f"Client monitoring displayed for {len(configs)} clients")
+            text, markup = self.render_monitor_page(0, 'ip', 'all')
+            self.bot.send_message(message.chat.id, text, reply_markup=markup, parse_mode='Markdown')
+            logger.info(f"Client monitoring displayed for {len(self.pool)} clients")
             
         except Exception as e:
             logger.error(f"Error showing client monitor: {e}")
@@ -2350,6 +3259,117 @@ class WireGuardBot:
                 "❌ Ошибка при получении списка клиентов"
             )
     
+    def get_peer_stats(self) -> dict:
+        """Live peer stats keyed by client IPv4 address"""
+        try:
+            return {stat.address: stat for stat in read_wg_dump('wg0').values() if stat.address}
+        except Exception as e:
+            logger.error(f"Error reading peer stats: {e}")
+            return {}
+    
+    @staticmethod
+    def format_handshake_age(timestamp: int, now: Optional[float] = None) -> str:
+        if not timestamp:
+            return "никогда"
+        age = int((now or time.time()) - timestamp)
+        if age < 60:
+            return "только что"
+        if age < 3600:
+            return f"{age // 60} мин назад"
+        if age < 86400:
+            return f"{age // 3600} ч назад"
+        return f"{age // 86400} дн назад"
+    
+    @staticmethod
+    def format_time_left(timestamp: float, now: Optional[float] = None) -> str:
+        left = int(timestamp - (now or time.time()))
+        if left <= 0:
+            return "истёк"
+        if left < 3600:
+            return f"{max(left // 60, 1)} мин"
+        if left < 86400:
+            return f"{left // 3600} ч"
+        return f"{left // 86400} дн"
+    
+    def render_monitor_page(self, page: int, sort: str, flt: str):
+        """Render one monitor page from the address pool index and a single `wg show dump`.
+        
+        Only the rows of the requested page are selected (bounded heap) and formatted.
+        """
+        stats = self.get_peer_stats()
+        now = time.time()
+        
+        rows = []
+        online_count = 0
+        for client_name, address in self.pool.items():
+            stat = stats.get(address)
+            handshake = stat.latest_handshake if stat else 0
+            online = bool(handshake) and now - handshake < ONLINE_WINDOW
+            online_count += online
+            if (flt == 'on' and not online) or (flt == 'off' and online) or (flt == 'never' and handshake):
+                continue
+            rows.append((client_name, address, handshake, stat.transfer if stat else 0, online))
+        
+        total_pages = max(1, -(-len(rows) // MONITOR_PAGE_SIZE))
+        page = min(max(page, 0), total_pages - 1)
+        end = (page + 1) * MONITOR_PAGE_SIZE
+        
+        if sort == 'name':
+            window = heapq.nsmallest(end, rows, key=lambda row: row[0])
+        elif sort == 'hs':
+            window = heapq.nlargest(end, rows, key=lambda row: row[2])
+        elif sort == 'traffic':
+            window = heapq.nlargest(end, rows, key=lambda row: row[3])
+        else:
+            window = heapq.nsmallest(end, rows, key=lambda row: int(ipaddress.ip_address(row[1])))
+        
+        text = (
+            f"👥 **Монитор клиентов WireGuard**\n\n"
+            f"📊 Клиентов: {len(self.pool)} • онлайн: {online_count} • свободно IP: {self.pool.free_count}\n"
+            f"🔎 {MONITOR_FILTERS.get(flt, flt)}: {len(rows)} • сортировка: {MONITOR_SORTS.get(sort, sort)}\n"
+        )
+        upcoming = self.expiry.upcoming(3)
+        if upcoming:
+            text += "⌛ Истекают: " + ", ".join(
+                f"{self.escape_markdown(name)} ({self.format_time_left(expires, now)})" for name, expires in upcoming
+            ) + "\n"
+        text += "\n"
+        for client_name, address, handshake, traffic, online in window[page * MONITOR_PAGE_SIZE:end]:
+            status_emoji = "🟢" if online else ("⚪" if not handshake else "🔴")
+            address6 = self.pool.address6_of(address)
+            ip_text = f"`{address}`" + (f" `{address6}`" if address6 else "")
+            record = self.store.get(client_name)
+            expires = record.get('expires')
+            expiry_text = f" • ⌛ {self.format_time_left(expires, now)}" if expires else ""
+            if record.get('disabled'):
+                status_emoji = "⏸"
+            elif record.get('access') == 'blocked':
+                status_emoji = "🚫"
+            if record.get('rate'):
+                expiry_text += f" • 🚦 {RateLimit(*record['rate'])}"
+            text += (
+                f"{status_emoji} **{self.escape_markdown(client_name)}** {ip_text}\n"
+                f"   🤝 {self.format_handshake_age(handshake, now)} • 📊 {self.format_bytes(traffic)}{expiry_text}\n"
+            )
+        if not rows:
+            text += "Нет клиентов по выбранному фильтру\n"
+        
+        # Sort and filter switches keep the other option, navigation keeps both
+        markup = types.InlineKeyboardMarkup()
+        markup.row(*[
+            types.InlineKeyboardButton(("✓ " if key == sort else "") + label, callback_data=f"mon:0:{key}:{flt}")
+            for key, label in MONITOR_SORTS.items()
+        ])
+        markup.row(*[
+            types.InlineKeyboardButton(("✓ " if key == flt else "") + label, callback_data=f"mon:0:{sort}:{key}")
+            for key, label in MONITOR_FILTERS.items()
+        ])
+        nav_row = self.pagination_row(f"mon:{{page}}:{sort}:{flt}", page, total_pages)
+        nav_row.append(types.InlineKeyboardButton("🔄", callback_data=f"mon:{page}:{sort}:{flt}"))
+        markup.row(*nav_row)
+        
+        return text, markup
+    
     def show_statistics(self, message):
         """Show WireGuard server statistics"""
         try:
@@ -2368,68 +3388,74 @@ class WireGuardBot:
             stats_msg += f"🟢 **Статус сервера:** {server_status['status']}\n"
             if server_status.get('interface'):
                 stats_msg += f"🔌 **Интерфейс:** {server_status['interface']}\n"
+            address, resolved_at = self.endpoint.status()
+            source = "WG_ENDPOINT" if self.endpoint.override else (
+                f"обновлён {datetime.fromtimestamp(resolved_at).strftime('%d.%m %H:%M')}" if resolved_at else "не определён")
+            stats_msg += f"🌐 **Внешний адрес:** {address} ({source})\n"
             
             # Client statistics
             stats_msg += f"\n👥 **Клиентские конфигурации:**\n"
             stats_msg += f"• Всего клиентов: {len(configs)}\n"
+            today = sum(rx + tx for rx, tx in self.traffic.totals(*parse_period('today')).values())
+            month = sum(rx + tx for rx, tx in self.traffic.totals('month', datetime.now().strftime('%Y-%m')).values())
+            stats_msg += f"• Трафик: сегодня {self.format_bytes(today)}, за месяц {self.format_bytes(month)} (/traffic)\n"
+            tag_counts = self.tag_index.counts()
+            if tag_counts:
+                stats_msg += f"• Тегов: {len(tag_counts)} (/tag)\n"
             
             if configs:
                 # IP range analysis
-                octets = [int(config['octet']) for config in configs.values()]
-                stats_msg += f"• Диапазон IP: {self.wg_ip_hint}.{min(octets)} - {self.wg_ip_hint}.{max(octets)}\n"
+                addresses = sorted(configs.values(), key=lambda config: int(ipaddress.ip_address(config['ip'])))
+                stats_msg += f"• Диапазон IP: {addresses[0]['ip']} - {addresses[-1]['ip']}\n"
                 
                 # Available IPs
-                used_octets = set(octets)
-                available_octets = set(range(2, 254)) - used_octets
-                stats_msg += f"• Свободных IP: {len(available_octets)}\n"
-                
-                # Active clients from wg show
-                active_peers = self.get_active_peers()
-                if active_peers:
-                    stats_msg += f"\n🟢 **Активные клиенты:**\n"
-                    
-                    # Match IPs to client names
-                    ip_to_name = {}
-                    for name, config in configs.items():
-                        ip_to_name[config['ip']] = name
-                    
-                    # Sort by handshake time (most recent first)
-                    sorted_peers = []
-                    for peer_key, peer_info in active_peers.items():
-                        if 'ip' in peer_info and 'handshake' in peer_info:
-                            client_name = ip_to_name.get(peer_info['ip'], f"Unknown_{peer_info['ip'].split('.')[-1]}")
-                            sorted_peers.append((client_name, peer_info))
-                    
-                    # Show up to 5 most recent active clients
-                    for client_name, peer_info in sorted_peers[:5]:
-                        escaped_name = self.escape_markdown(client_name)
-                        handshake = peer_info.get('handshake', 'never')
-                        transfer = peer_info.get('transfer', 'no data')
-                        stats_msg += f"• **{escaped_name}** ({peer_info['ip']}) - {handshake}\n"
-                        if transfer != 'no data':
-                            stats_msg += f"  📊 {transfer}\n"
+                stats_msg += f"• Свободных IP: {self.pool.free_count} из {self.pool.capacity} ({self.pool.network})\n"
+                if self.pool.network6 is not None:
+                    stats_msg += f"• IPv6 пул: {self.pool.network6}\n"
+                
+                # Rankings over the latest counter deltas and handshakes
+                rankings = self.format_rankings()
+                if rankings:
+                    stats_msg += rankings
                 else:
                     # Fallback to recent configs if no active peers
                     stats_msg += f"\n🗓 **Последние клиенты:**\n"
-                    sorted_configs = sorted(
-                        configs.items(), 
-                        key=lambda x: x[1]['file'].stat().st_mtime, 
-                        reverse=True
-                    )[:5]
+                    sorted_configs = heapq.nlargest(
+                        RANKING_SIZE, configs.items(), key=lambda x: x[1]['file'].stat().st_mtime
+                    )
                     
                     for client_name, config_info in sorted_configs:
                         mod_time = datetime.fromtimestamp(config_info['file'].stat().st_mtime)
                         escaped_name = self.escape_markdown(client_name)
-                        stats_msg += f"• **{escaped_name}** ({config_info['ip']}) - {mod_time.strftime('%d.%m.%Y %H:%M')}\n"
+                        stats_msg += f"• **{escaped_name}** ({self.format_addresses(config_info)}) - {mod_time.strftime('%d.%m.%Y %H:%M')}\n"
             else:
                 stats_msg += "• Клиентские конфигурации не найдены\n"
             
+            # Fleet nodes, queried in parallel
+            if self.fleet is not None:
+                stats_msg += f"\n🛰 **Узлы ({len(self.fleet)}):**\n"
+                for node_name, (ok, info) in self.fleet.fan_out('info').items():
+                    escaped_node = self.escape_markdown(node_name)
+                    if ok:
+                        stats_msg += (
+                            f"• **{escaped_node}** {info['status']} - клиентов: {info['peers']}, "
+                            f"свободно IP: {info['free']}, трафик: {self.format_bytes(info['traffic'])}\n"
+                        )
+                    else:
+                        stats_msg += f"• **{escaped_node}** ❌ недоступен\n"
+            
             # System info
             system_info = self.get_system_info()
             if system_info:
                 stats_msg += f"\n💻 **Системная информация:**\n{system_info}"
             
-            self.bot.send_message(message.chat.id, stats_msg, parse_mode='Markdown')
+            markup = types.InlineKeyboardMarkup()
+            markup.row(
+                types.InlineKeyboardButton("📈 24 ч", callback_data="chart:24h"),
+                types.InlineKeyboardButton("📈 7 дней", callback_data="chart:7d"),
+                types.InlineKeyboardButton("🔥 Активность", callback_data="chart:activity")
+            )
+            self.bot.send_message(message.chat.id, stats_msg, reply_markup=markup, parse_mode='Markdown')
             logger.info(f"Statistics shown for {len(configs)} clients")
             
         except Exception as e:
@@ -2483,8 +3509,10 @@ class WireGuardBot:
                     active_peers[current_peer] = {}
                 elif current_peer and ':' in line:
                     if line.startswith('allowed ips:'):
-                        ip = line.split('allowed ips: ')[1].split('/')[0]
-                        active_peers[current_peer]['ip'] = ip
+                        for item in line.split('allowed ips: ')[1].split(','):
+                            ip = item.strip().split('/')[0]
+                            key = 'ip6' if ':' in ip else 'ip'
+                            active_peers[current_peer].setdefault(key, ip)
                     elif line.startswith('latest handshake:'):
                         handshake = line.split('latest handshake: ')[1]
                         active_peers[current_peer]['handshake'] = handshake
@@ -2497,6 +3525,1865 @@ class WireGuardBot:
             logger.error(f"Error getting active peers: {e}")
             return {}
     
+    def firewall_access_map(self) -> dict:
+        """Client addresses (v4 and paired v6) with a non-default access level"""
+        access = {}
+        for client_name, record in self.store.items():
+            address = self.pool.address_of(client_name)
+            if not record.get('access') or address is None:
+                continue
+            access[address] = record['access']
+            address6 = self.pool.address6_of(address)
+            if address6:
+                access[address6] = record['access']
+        return access
+    
+    def render_firewall(self) -> str:
+        """Render the nftables ruleset and keep a copy for the wg0 PostUp hook"""
+        config_path = Path("/etc/wireguard/wg0.conf")
+        head = split_peers(config_path.read_text(encoding='utf-8'))[0] if config_path.exists() else ""
+        interfaces, listen_ports = ['wg0'], [int(peer_field(head, 'ListenPort') or 51830)]
+        if self.rotation:
+            interfaces.append(self.rotation['interface'])
+            listen_ports.append(self.rotation['listen_port'])
+        wan_interface = wg_wan_interface or detect_wan_interface() or 'eth0'
+        
+        ruleset = build_ruleset(interfaces, wan_interface, listen_ports,
+                                self.firewall_access_map(), parse_networks(wg_lan_networks))
+        if config_path.parent.exists():
+            Path(RULESET_PATH).write_text(ruleset, encoding='utf-8')
+        return ruleset
+    
+    def apply_firewall(self) -> bool:
+        """Load the whole bot table atomically with a single `nft -f`"""
+        if wg_firewall != 'nftables':
+            return False
+        success, errors = apply_nft(self.render_firewall())
+        if not success:
+            logger.error(f"nft ruleset failed: {errors}")
+        return success
+    
+    @with_state_lock
+    def set_client_access(self, names: list, level: Optional[str]) -> list:
+        """Change the access level of clients with one map update transaction"""
+        removed, added, updated = [], {}, []
+        for client_name in names:
+            address = self.pool.address_of(client_name)
+            if address is None:
+                continue
+            addresses = [address] + ([self.pool.address6_of(address)] if self.pool.address6_of(address) else [])
+            if self.store.get(client_name).get('access'):
+                removed += addresses
+            if level:
+                added.update((item, level) for item in addresses)
+            self.store.update(client_name, save=False, access=level)
+            updated.append(client_name)
+        
+        if not updated:
+            return []
+        self.store.save()
+        
+        if wg_firewall == 'nftables':
+            success, errors = apply_nft(build_access_update(removed, added))
+            if success:
+                self.render_firewall()
+            else:
+                # The table may be missing (e.g. flushed by hand): rebuild it from the store
+                logger.warning(f"nft access update failed, reloading the table: {errors}")
+                self.apply_firewall()
+        logger.info(f"Access {level or 'default'} set for {len(updated)} clients")
+        return updated
+    
+    @with_state_lock
+    def set_client_routes(self, names: list, route: str) -> list:
+        """Point existing clients at a route profile and re-render their configs"""
+        updated = [name for name in names if name in self.pool]
+        for client_name in updated:
+            self.store.update(client_name, save=False, route=route)
+        if updated:
+            self.store.save()
+            self.render_clients(updated)
+        return updated
+    
+    def client_render_context(self) -> dict:
+        """Server-wide values every client config needs, read once per rendering pass"""
+        config_path = Path("/etc/wireguard/wg0.conf")
+        head = split_peers(config_path.read_text(encoding='utf-8'))[0] if config_path.exists() else ""
+        return {
+            'server_public_key': read_key(Path("/etc/wireguard/publickey")),
+            # During a key rotation grace period new configs point at the interface with the new key
+            'listen_port': self.rotation['listen_port'] if self.rotation else int(peer_field(head, 'ListenPort') or 51830),
+            'public_address': self.endpoint.get(),
+        }
+    
+    def refresh_endpoint(self):
+        """Re-resolve the public address once its TTL has passed; configs follow an address change"""
+        previous = self.endpoint.get()
+        address = self.endpoint.refresh()
+        if address != previous:
+            logger.info(f"Public address changed from {previous} to {address}, re-rendering configs")
+            counts = self.render_clients()
+            self.notify_admins(
+                f"🌐 Внешний адрес сервера изменился: {previous} → {address}\n"
+                f"Перегенерировано конфигов: {counts['written']}"
+            )
+    
+    def render_client(self, client_name: str, context: Optional[dict] = None) -> Optional[str]:
+        """Render a client config in memory from the pool, the client store and the key files"""
+        context = context or self.client_render_context()
+        address = self.pool.address_of(client_name)
+        private_key = read_key(Path(f"/etc/wireguard/{client_name}_privatekey"))
+        if address is None or private_key is None or context['server_public_key'] is None:
+            return None
+        
+        record = self.store.get(client_name)
+        profile = self.config_profiles.get(record.get('profile') or 'default', self.config_profiles['default'])
+        route = self.route_profiles.get(record.get('route') or profile.route or 'full', self.route_profiles['full'])
+        address6 = self.pool.address6_of(address)
+        
+        addresses = [f"{address}/{self.pool.prefixlen}"]
+        if address6:
+            addresses.append(f"{address6}/{self.pool.prefixlen6}")
+        endpoint = format_endpoint(profile.endpoint or context['public_address'], context['listen_port'])
+        
+        return render_client_config(
+            private_key, addresses, context['server_public_key'], endpoint,
+            route.allowed_ips_for(bool(address6)), profile,
+            read_key(Path(f"/etc/wireguard/{client_name}_presharedkey"))
+        )
+    
+    @with_state_lock
+    def render_clients(self, names=None, collect: bool = False) -> dict:
+        """Re-render client configs in one parallel pass, writing only files whose content changed.
+        
+        With collect=True the rendered texts are returned under 'configs' as well.
+        """
+        context = self.client_render_context()
+        names = [name for name, _ in self.pool.items()] if names is None else names
+        
+        def render_one(client_name):
+            config_text = self.render_client(client_name, context)
+            if config_text is None:
+                return client_name, None, False
+            return client_name, config_text, write_if_changed(Path(f"/etc/wireguard/{client_name}_cl.conf"), config_text)
+        
+        counts = {'written': 0, 'unchanged': 0, 'failed': 0}
+        configs = {}
+        with ThreadPoolExecutor(max_workers=RENDER_WORKERS) as executor:
+            for client_name, config_text, written in executor.map(render_one, names):
+                if config_text is None:
+                    counts['failed'] += 1
+                    continue
+                counts['written' if written else 'unchanged'] += 1
+                if collect:
+                    configs[client_name] = config_text
+        logger.info(f"Client configs rendered: {counts}")
+        if collect:
+            counts['configs'] = configs
+        return counts
+    
+    def load_rotation_state(self) -> Optional[dict]:
+        try:
+            with open(ROTATION_STATE_PATH, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading rotation state: {e}")
+            return None
+    
+    def save_rotation_state(self):
+        if self.rotation is None:
+            if ROTATION_STATE_PATH.exists():
+                ROTATION_STATE_PATH.unlink()
+            return
+        with open(ROTATION_STATE_PATH, 'w', encoding='utf-8') as f:
+            json.dump(self.rotation, f)
+    
+    def rotate_command(self, message):
+        """/rotate: replace the server keypair and re-issue every client config"""
+        if not self.is_authorized(message.chat.id):
+            self.send_unauthorized_message(message)
+            return
+        
+        markup = types.InlineKeyboardMarkup()
+        if self.rotation:
+            migrated = len(self.rotation.get('migrated', []))
+            markup.row(types.InlineKeyboardButton("✅ Завершить переход", callback_data="rotate:finish"))
+            self.bot.send_message(
+                message.chat.id,
+                f"⏳ **Идёт переходный период смены ключа**\n\n"
+                f"Новый ключ на {self.rotation['interface']}, порт {self.rotation['listen_port']}\n"
+                f"Перешли на новый конфиг: {migrated}/{len(self.pool)}\n\n"
+                f"После завершения старые конфиги перестанут работать.",
+                reply_markup=markup,
+                parse_mode='Markdown'
+            )
+            return
+        
+        markup.row(types.InlineKeyboardButton("🔑 Сменить сразу", callback_data="rotate:now"))
+        markup.row(types.InlineKeyboardButton(f"⏳ С переходным периодом ({GRACE_INTERFACE})", callback_data="rotate:grace"))
+        self.bot.send_message(
+            message.chat.id,
+            f"🔑 **Смена ключа сервера**\n\n"
+            f"Будет создан новый ключ, все {len(self.pool)} клиентских конфигов перегенерированы "
+            f"и отправлены одним архивом.\n\n"
+            f"• **Сразу** - старые конфиги перестают работать немедленно\n"
+            f"• **С переходным периодом** - новый ключ работает на {GRACE_INTERFACE} (следующий порт), "
+            f"старые конфиги работают, пока клиенты не перейдут",
+            reply_markup=markup,
+            parse_mode='Markdown'
+        )
+    
+    @with_state_lock
+    def rotate_server_key(self, chat_id, grace: bool = False):
+        """Generate a new server keypair, re-render all client configs and apply once"""
+        try:
+            config_path = Path("/etc/wireguard/wg0.conf")
+            config_text = config_path.read_text(encoding='utf-8')
+            private_key, public_key = generate_keypair()
+            
+            if grace:
+                # wg0 keeps the old key; the new one serves the same peers on the next port
+                head, peers = split_peers(config_text)
+                listen_port = int(peer_field(head, 'ListenPort') or 51830) + 1
+                self.write_grace_config(private_key, listen_port, peers)
+                result = subprocess.run(['wg-quick', 'up', GRACE_INTERFACE], capture_output=True, text=True)
+                if result.returncode != 0:
+                    Path(f"/etc/wireguard/{GRACE_INTERFACE}.conf").unlink()
+                    raise Exception(f"wg-quick up {GRACE_INTERFACE}: {result.stderr[:200]}")
+                self.rotation = {
+                    'interface': GRACE_INTERFACE,
+                    'listen_port': listen_port,
+                    'started': int(time.time()),
+                    'migrated': []
+                }
+                self.save_rotation_state()
+                self.apply_firewall()
+            else:
+                config_path.write_text(set_interface_field(config_text, 'PrivateKey', private_key), encoding='utf-8')
+            
+            write_key(Path("/etc/wireguard/privatekey"), private_key)
+            write_key(Path("/etc/wireguard/publickey"), public_key, private=False)
+            
+            counts = self.render_clients(collect=True)
+            if not grace:
+                self.apply_wireguard_config()
+            logger.info(f"Server key rotated (grace={grace}), {counts['written']} client configs re-rendered")
+            
+            self.send_configs_archive(chat_id, counts['configs'], "wireguard_configs_rotated.zip")
+            text = (
+                f"✅ **Ключ сервера заменён**\n\n"
+                f"✏️ Перегенерировано конфигов: {counts['written'] + counts['unchanged']}\n"
+                f"❌ Ошибок: {counts['failed']}\n\n"
+            )
+            if grace:
+                text += (
+                    f"⏳ Старые конфиги работают до завершения перехода. Клиенты, подключившиеся с новым "
+                    f"конфигом, переводятся автоматически; когда перейдут все, переход завершится сам "
+                    f"(или `/rotate` → «Завершить переход»)."
+                )
+            else:
+                text += "Разошлите клиентам новые конфиги из архива."
+            self.bot.send_message(chat_id, text, parse_mode='Markdown')
+            
+        except Exception as e:
+            logger.error(f"Error rotating server key: {e}")
+            self.bot.send_message(chat_id, f"❌ Ошибка при смене ключа: {str(e)[:200]}")
+    
+    def write_grace_config(self, private_key: str, listen_port: int, peers: list):
+        """Second interface for the grace period: same peers, no routes of its own (Table = off)"""
+        lines = [
+            "[Interface]",
+            f"PrivateKey = {private_key}",
+            f"ListenPort = {listen_port}",
+            "Table = off",
+        ]
+        if wg_firewall != 'nftables':
+            head = split_peers(Path("/etc/wireguard/wg0.conf").read_text(encoding='utf-8'))[0]
+            for line in head.splitlines():
+                if line.strip().startswith(('PostUp', 'PostDown')):
+                    lines.append(line.replace('wg0', GRACE_INTERFACE).replace(
+                        f"--dport {listen_port - 1}", f"--dport {listen_port}"))
+        fd = os.open(f"/etc/wireguard/{GRACE_INTERFACE}.conf", os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            f.write(join_peers("\n".join(lines) + "\n\n", peers))
+    
+    @with_state_lock
+    def sync_grace_peers(self):
+        """Mirror wg0 peers to the grace interface after clients are added or removed"""
+        if not self.rotation:
+            return
+        try:
+            grace_path = Path(f"/etc/wireguard/{GRACE_INTERFACE}.conf")
+            head = split_peers(grace_path.read_text(encoding='utf-8'))[0]
+            peers = split_peers(Path("/etc/wireguard/wg0.conf").read_text(encoding='utf-8'))[1]
+            grace_path.write_text(join_peers(head, peers), encoding='utf-8')
+            self.apply_wireguard_config(GRACE_INTERFACE)
+        except Exception as e:
+            logger.error(f"Error syncing grace interface peers: {e}")
+    
+    @with_state_lock
+    def check_key_migration(self):
+        """Route clients that handshook with the new key through the grace interface"""
+        if not self.rotation:
+            return
+        migrated = set(self.rotation.get('migrated', []))
+        changed = False
+        for stat in read_wg_dump(GRACE_INTERFACE).values():
+            if not stat.latest_handshake or not stat.address or stat.address in migrated:
+                continue
+            # A /32 beats the pool route via wg0, so replies go back through the new key
+            for network in stat.allowed_ips:
+                subprocess.run(['ip', 'route', 'replace', network, 'dev', GRACE_INTERFACE], capture_output=True, text=True)
+            migrated.add(stat.address)
+            changed = True
+        
+        if changed:
+            self.rotation['migrated'] = sorted(migrated)
+            self.save_rotation_state()
+        
+        if len(self.pool) and all(address in migrated for _, address in self.pool.items()):
+            self.finish_key_rotation(None)
+            self.notify_admins("✅ Все клиенты перешли на новый ключ сервера, переходный период завершён")
+    
+    @with_state_lock
+    def finish_key_rotation(self, chat_id):
+        """Move the new key and port to wg0 and drop the grace interface"""
+        if not self.rotation:
+            return
+        try:
+            grace_path = Path(f"/etc/wireguard/{GRACE_INTERFACE}.conf")
+            config_path = Path("/etc/wireguard/wg0.conf")
+            config_text = config_path.read_text(encoding='utf-8')
+            old_port = peer_field(split_peers(config_text)[0], 'ListenPort')
+            new_port = str(self.rotation['listen_port'])
+            
+            config_text = set_interface_field(config_text, 'PrivateKey', read_key(Path("/etc/wireguard/privatekey")))
+            config_text = set_interface_field(config_text, 'ListenPort', new_port)
+            if old_port:
+                config_text = config_text.replace(f"--dport {old_port} ", f"--dport {new_port} ")
+            config_path.write_text(config_text, encoding='utf-8')
+            
+            subprocess.run(['wg-quick', 'down', GRACE_INTERFACE], capture_output=True, text=True)
+            if grace_path.exists():
+                grace_path.unlink()
+            self.rotation = None
+            self.save_rotation_state()
+            
+            self.apply_wireguard_config()
+            self.apply_firewall()
+            logger.info(f"Key rotation finished, wg0 now listens on {new_port}")
+            if chat_id is not None:
+                self.bot.send_message(chat_id, f"✅ Переход завершён: новый ключ на wg0, порт {new_port}")
+        except Exception as e:
+            logger.error(f"Error finishing key rotation: {e}")
+            if chat_id is not None:
+                self.bot.send_message(chat_id, f"❌ Ошибка при завершении перехода: {str(e)[:200]}")
+    
+    def send_configs_archive(self, chat_id, configs: dict, filename: str):
+        """Send rendered configs as one in-memory zip archive"""
+        if not configs:
+            return
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w', zipfile.ZIP_DEFLATED) as zipf:
+            for client_name, config_text in sorted(configs.items()):
+                zipf.writestr(f"{client_name}.conf", config_text)
+        buffer.seek(0)
+        self.bot.send_document(
+            chat_id,
+            buffer,
+            caption=f"📦 Архив конфигураций ({len(configs)} файлов)",
+            visible_file_name=filename
+        )
+    
+    def render_command(self, message):
+        """/render: re-render all client configs from their profiles"""
+        if not self.is_authorized(message.chat.id):
+            self.send_unauthorized_message(message)
+            return
+        try:
+            counts = self.render_clients()
+            self.bot.send_message(
+                message.chat.id,
+                f"🧩 **Конфигурации перегенерированы**\n\n"
+                f"✏️ Изменено: {counts['written']}\n"
+                f"✅ Без изменений: {counts['unchanged']}\n"
+                f"❌ Ошибок (нет ключей): {counts['failed']}",
+                parse_mode='Markdown'
+            )
+        except Exception as e:
+            logger.error(f"Error rendering configs: {e}")
+            self.bot.send_message(message.chat.id, "❌ Ошибка при перегенерации конфигураций")
+    
+    def profile_command(self, message):
+        """/profile <name> <client ...|all>: attach a config profile and re-render"""
+        if not self.is_authorized(message.chat.id):
+            self.send_unauthorized_message(message)
+            return
+        
+        args = message.text.split()[1:]
+        if len(args) < 2 or args[0].lower() not in self.config_profiles:
+            profiles = "\n".join(
+                f"• `{name}` - DNS {profile.dns}, MTU {profile.mtu}, keepalive {profile.keepalive}"
+                + (f", endpoint {profile.endpoint}" if profile.endpoint else "")
+                + (f", маршруты {profile.route}" if profile.route else "")
+                for name, profile in self.config_profiles.items()
+            )
+            self.bot.send_message(
+                message.chat.id,
+                "🧩 **Профили конфигурации**\n\n"
+                "`/profile mobile client1 client2` - назначить профиль\n"
+                "`/profile default all` - вернуть профиль по умолчанию\n"
+                "`/render` - перегенерировать все конфиги\n\n"
+                f"Профили (WG_CONFIG_PROFILES):\n{profiles}",
+                parse_mode='Markdown'
+            )
+            return
+        
+        names = [name for name in self.resolve_client_args(args[1:]) if name in self.pool]
+        
+        try:
+            profile = args[0].lower()
+            with self.state_lock:
+                for client_name in names:
+                    self.store.update(client_name, save=False, profile=None if profile == 'default' else profile)
+                self.store.save()
+                counts = self.render_clients(names)
+            self.bot.send_message(
+                message.chat.id,
+                f"🧩 Профиль {profile} назначен {len(names)} клиентам, изменено файлов: {counts['written']}"
+            )
+        except Exception as e:
+            logger.error(f"Error applying config profile: {e}")
+            self.bot.send_message(message.chat.id, "❌ Ошибка при назначении профиля")
+    
+    def new_preshared_key(self, client_name: str) -> str:
+        preshared_key = generate_preshared_key()
+        write_key(Path(f"/etc/wireguard/{client_name}_presharedkey"), preshared_key)
+        return preshared_key
+    
+    @with_state_lock
+    def set_preshared_keys(self, keys: dict) -> int:
+        """Write PresharedKey into the server peers of {public key: psk} in one rewrite of wg0.conf.
+        
+        Peers of disabled clients are updated in their saved blocks. Nothing is applied here.
+        """
+        config_path = Path("/etc/wireguard/wg0.conf")
+        head, peers = split_peers(config_path.read_text(encoding='utf-8'))
+        updated = 0
+        for i, block in enumerate(peers):
+            preshared_key = keys.get(peer_public_key(block))
+            if preshared_key:
+                peers[i] = set_peer_field(block, 'PresharedKey', preshared_key)
+                updated += 1
+        config_path.write_text(join_peers(head, peers), encoding='utf-8')
+        
+        for client_name, record in self.store.items():
+            block = record.get('peer_block')
+            if block and keys.get(peer_public_key(block)):
+                self.store.update(client_name, save=False,
+                                  peer_block=set_peer_field(block, 'PresharedKey', keys[peer_public_key(block)]))
+                updated += 1
+        self.store.save()
+        return updated
+    
+    @with_state_lock
+    def add_preshared_keys(self, names, chat_id):
+        """Give every listed client without a PSK a new one: one wg0.conf rewrite, one apply, one archive"""
+        try:
+            keys, added = {}, []
+            for client_name in names:
+                if Path(f"/etc/wireguard/{client_name}_presharedkey").exists():
+                    continue
+                public_key = read_key(Path(f"/etc/wireguard/{client_name}_publickey"))
+                if public_key is None:
+                    continue
+                keys[public_key] = self.new_preshared_key(client_name)
+                added.append(client_name)
+            
+            if not added:
+                self.bot.send_message(chat_id, "🔐 У всех выбранных клиентов уже есть PresharedKey")
+                return
+            
+            updated = self.set_preshared_keys(keys)
+            self.apply_wireguard_config()
+            self.sync_grace_peers()
+            counts = self.render_clients(added, collect=True)
+            logger.info(f"Preshared keys added to {len(added)} clients, {updated} peers updated")
+            
+            self.send_configs_archive(chat_id, counts['configs'], "wireguard_configs_psk.zip")
+            self.bot.send_message(
+                chat_id,
+                f"✅ PresharedKey добавлен {len(added)} клиентам\n\n"
+                f"⚠️ Старые конфиги этих клиентов больше не подключатся - разошлите новые из архива."
+            )
+        except Exception as e:
+            logger.error(f"Error adding preshared keys: {e}")
+            self.bot.send_message(chat_id, f"❌ Ошибка при добавлении PresharedKey: {str(e)[:200]}")
+    
+    def psk_command(self, message):
+        """/psk <name ...|all>: add preshared keys to existing clients"""
+        if not self.is_authorized(message.chat.id):
+            self.send_unauthorized_message(message)
+            return
+        
+        args = message.text.split()[1:]
+        if args and args[0].lower() not in ('all', '*'):
+            names = [name for name in self.resolve_client_args(args) if name in self.pool]
+            self.add_preshared_keys(names, message.chat.id)
+            return
+        
+        with_psk = sum(1 for name, _ in self.pool.items() if Path(f"/etc/wireguard/{name}_presharedkey").exists())
+        markup = types.InlineKeyboardMarkup()
+        markup.row(types.InlineKeyboardButton("🔐 Добавить PSK всем", callback_data="psk:all"))
+        self.bot.send_message(
+            message.chat.id,
+            f"🔐 **PresharedKey**\n\n"
+            f"С PSK: {with_psk} из {len(self.pool)} клиентов\n\n"
+            f"`/psk client1 client2` - добавить выбранным клиентам\n"
+            f"Новым клиентам: `name psk` при создании, `@psk` в массовом создании "
+            f"или `WG_PRESHARED_KEYS=1` для всех\n\n"
+            f"После добавления старые конфиги этих клиентов перестают работать.",
+            reply_markup=markup,
+            parse_mode='Markdown'
+        )
+    
+    def route_command(self, message):
+        """/route <profile> <name ...|all>: switch clients to a split-tunnel profile"""
+        if not self.is_authorized(message.chat.id):
+            self.send_unauthorized_message(message)
+            return
+        
+        args = message.text.split()[1:]
+        if len(args) < 2 or args[0].lower() not in self.route_profiles:
+            profiles = "\n".join(
+                f"• `{name}` - {len(profile.allowed_ips)} сетей: {', '.join(profile.allowed_ips[:4])}"
+                + (" ..." if len(profile.allowed_ips) > 4 else "")
+                for name, profile in self.route_profiles.items()
+            )
+            self.bot.send_message(
+                message.chat.id,
+                "🧭 **Маршруты клиентов (split tunnel)**\n\n"
+                "`/route nolan client1 client2` - всё, кроме локальных сетей\n"
+                "`/route full all` - весь трафик через VPN\n\n"
+                f"Профили (WG_ROUTE_PROFILES):\n{profiles}\n\n"
+                "После смены профиля клиенту нужно заново отправить конфиг",
+                parse_mode='Markdown'
+            )
+            return
+        
+        names = self.resolve_client_args(args[1:])
+        
+        try:
+            updated = self.set_client_routes(names, args[0].lower())
+            self.bot.send_message(message.chat.id, f"🧭 Профиль {args[0].lower()} применён к {len(updated)} клиентам")
+        except Exception as e:
+            logger.error(f"Error changing routes: {e}")
+            self.bot.send_message(message.chat.id, "❌ Ошибка при изменении маршрутов")
+    
+    def access_command(self, message):
+        """/access <block|lan|default> <name ...|all>: per-client firewall access"""
+        if not self.is_authorized(message.chat.id):
+            self.send_unauthorized_message(message)
+            return
+        
+        args = message.text.split()[1:]
+        if len(args) < 2 or args[0].lower() not in ACCESS_LEVELS:
+            blocked = sum(1 for _, record in self.store.items() if record.get('access') == 'blocked')
+            lan = sum(1 for _, record in self.store.items() if record.get('access') == 'lan')
+            self.bot.send_message(
+                message.chat.id,
+                "🛡 **Доступ клиентов**\n\n"
+                "`/access block client1 client2` - заблокировать\n"
+                "`/access lan client1` - разрешить доступ в локальную сеть (WG_LAN_NETWORKS)\n"
+                "`/access default all` - вернуть обычный доступ\n\n"
+                f"Заблокировано: {blocked} • с доступом в LAN: {lan}\n"
+                f"Бэкенд: {wg_firewall}",
+                parse_mode='Markdown'
+            )
+            return
+        
+        if wg_firewall != 'nftables':
+            self.bot.send_message(message.chat.id, "❌ Управление доступом работает только с WG_FIREWALL=nftables")
+            return
+        
+        names = self.resolve_client_args(args[1:])
+        
+        try:
+            updated = self.set_client_access(names, ACCESS_LEVELS[args[0].lower()])
+            self.bot.send_message(message.chat.id, f"🛡 Доступ изменён для {len(updated)} клиентов")
+        except Exception as e:
+            logger.error(f"Error changing access: {e}")
+            self.bot.send_message(message.chat.id, "❌ Ошибка при изменении доступа")
+    
+    def apply_shaping(self):
+        """Rebuild the tc HTB tree for all clients with limits in one `tc -batch` run"""
+        limits = []
+        for client_name, record in self.store.items():
+            rate = record.get('rate')
+            address = self.pool.address_of(client_name)
+            if not rate or address is None or record.get('disabled'):
+                continue
+            limits.append((self.pool.index_of(address), address, self.pool.address6_of(address), RateLimit(*rate)))
+        limits.sort()
+        if len(limits) > MAX_SHAPED_CLIENTS:
+            # /rate refuses to get here; clients created with a limit beyond it are left unshaped
+            logger.warning(f"{len(limits) - MAX_SHAPED_CLIENTS} clients with limits are over the HTB class limit, not shaped")
+            del limits[MAX_SHAPED_CLIENTS:]
+        clients = number_classes(entry[1:] for entry in limits)
+        
+        # Nothing to set up and nothing to tear down: do not fork tc at all
+        if not clients and not self.shaping_active:
+            return
+        
+        script = build_tc_batch(clients, 'wg0', wg_ifb_device, parse_rate(wg_link_rate))
+        success, errors = apply_tc_batch(script, wg_ifb_device)
+        if not success:
+            logger.error(f"tc batch failed: {errors}")
+        self.shaping_active = bool(clients)
+        logger.info(f"Shaping applied for {len(clients)} clients")
+    
+    @with_state_lock
+    def ensure_shaping(self):
+        """Reapply shaping when the HTB root is gone, e.g. after an external wg-quick restart"""
+        has_limits = any(record.get('rate') for _, record in self.store.items())
+        if not has_limits:
+            return
+        result = subprocess.run(['tc', 'qdisc', 'show', 'dev', 'wg0', 'root'], capture_output=True, text=True)
+        if result.returncode == 0 and 'htb' not in result.stdout:
+            self.shaping_active = True
+            self.apply_shaping()
+    
+    @with_state_lock
+    def set_client_rates(self, names: list, rate: Optional[RateLimit]) -> list:
+        """Set (or with None remove) the limit of several clients, applied in one batch"""
+        updated = [name for name in names if name in self.pool]
+        if rate:
+            shaped = {name for name, record in self.store.items() if record.get('rate')} | set(updated)
+            if len(shaped) > MAX_SHAPED_CLIENTS:
+                raise ValueError(f"ограничение скорости возможно не более чем для {MAX_SHAPED_CLIENTS} клиентов "
+                                 f"(получилось бы {len(shaped)})")
+        for client_name in updated:
+            self.store.update(client_name, save=False, rate=list(rate) if rate else None)
+        if updated:
+            self.store.save()
+            self.apply_shaping()
+        return updated
+    
+    def rate_command(self, message):
+        """/rate <profile|down/up|off> <name ...|all>: apply a limit to many clients at once"""
+        if not self.is_authorized(message.chat.id):
+            self.send_unauthorized_message(message)
+            return
+        
+        args = message.text.split()[1:]
+        if len(args) < 2:
+            profiles = ", ".join(f"`{name}` {limit}" for name, limit in self.rate_profiles.items()) or "не заданы"
+            shaped = sum(1 for _, record in self.store.items() if record.get('rate'))
+            self.bot.send_message(
+                message.chat.id,
+                "🚦 **Ограничение скорости**\n\n"
+                "`/rate 10m/2m client1 client2` - загрузка/отдача\n"
+                "`/rate basic all` - профиль для всех клиентов\n"
+                "`/rate basic tag:guests` - профиль для клиентов с тегом\n"
+                "`/rate off client1` - снять ограничение\n\n"
+                f"Профили (WG_RATE_PROFILES): {profiles}\n"
+                f"Клиентов с ограничением: {shaped}",
+                parse_mode='Markdown'
+            )
+            return
+        
+        try:
+            rate = None if args[0].lower() == 'off' else parse_limit(args[0], self.rate_profiles)
+        except ValueError:
+            self.bot.send_message(message.chat.id, f"❌ Неизвестный профиль или скорость: {args[0]}")
+            return
+        
+        names = self.resolve_client_args(args[1:])
+        
+        try:
+            updated = self.set_client_rates(names, rate)
+            rate_text = str(rate) if rate else "без ограничений"
+            self.bot.send_message(message.chat.id, f"🚦 {rate_text}: применено к {len(updated)} клиентам")
+        except ValueError as e:
+            self.bot.send_message(message.chat.id, f"❌ Ограничение не применено: {e}")
+        except Exception as e:
+            logger.error(f"Error applying rate: {e}")
+            self.bot.send_message(message.chat.id, "❌ Ошибка при применении ограничения скорости")
+    
+    @with_state_lock
+    def expire_clients(self):
+        """Delete clients whose lifetime has ended, as one batch"""
+        due = [name for name in self.expiry.pop_due(time.time()) if name in self.pool]
+        if not due:
+            return
+        
+        deleted, failed = self.delete_clients(due)
+        logger.info(f"Expired clients deleted: {len(deleted)}, failed: {len(failed)}")
+        
+        lines = [f"• **{self.escape_markdown(name)}**" for name in deleted[:20]]
+        if len(deleted) > 20:
+            lines.append(f"... и ещё {len(deleted) - 20} клиентов")
+        lines += [f"❌ {self.escape_markdown(name)}: {error[:50]}" for name, error in failed[:5]]
+        self.notify_admins(f"⌛ **Срок действия истёк, удалено клиентов: {len(deleted)}**\n\n" + "\n".join(lines))
+    
+    @with_state_lock
+    def apply_wireguard_config(self, interface: str = 'wg0') -> bool:
+        """Apply the interface config to the running interface in one step, without a restart.
+        
+        Unlike `wg-quick down/up` this keeps sessions, handshakes and counters.
+        """
+        strip = subprocess.run(['wg-quick', 'strip', interface], capture_output=True, text=True)
+        if strip.returncode != 0:
+            logger.error(f"wg-quick strip failed: {strip.stderr}")
+            return False
+        
+        # The stripped config holds the private key: keep it inside /etc/wireguard, mode 0600
+        fd, temp_path = tempfile.mkstemp(suffix='.conf', dir='/etc/wireguard')
+        try:
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(strip.stdout)
+            result = subprocess.run(['wg', 'syncconf', interface, temp_path], capture_output=True, text=True)
+        finally:
+            os.unlink(temp_path)
+        
+        if result.returncode != 0:
+            logger.error(f"wg syncconf failed: {result.stderr}")
+            return False
+        return True
+    
+    @with_state_lock
+    def update_last_seen(self):
+        """Persist latest handshakes as "last seen": wg resets them on every restart"""
+        stats = self.get_peer_stats()
+        changed = False
+        for client_name, address in self.pool.items():
+            stat = stats.get(address)
+            if stat and stat.latest_handshake > self.store.get(client_name).get('last_seen', 0):
+                self.store.update(client_name, save=False, last_seen=stat.latest_handshake)
+                changed = True
+        if changed:
+            self.store.save()
+    
+    def get_chart(self, kind: str) -> Optional[bytes]:
+        """PNG chart, cached until the traffic ledger takes its next sample"""
+        sampled_at = self.traffic.sampled_at
+        cached = self.chart_cache.get(kind)
+        if cached and cached[0] == sampled_at:
+            return cached[1]
+        
+        now = time.time()
+        if kind in CHART_PERIODS:
+            period, title = CHART_PERIODS[kind]
+            points = self.traffic.series(now - period)
+            if not points:
+                return None
+            png = render_throughput_chart(points, period, now, title)
+        elif kind == 'activity':
+            activity = self.fold_activity(self.traffic.activity(now - 7 * 86400))
+            if not activity:
+                return None
+            busiest = dict(heapq.nlargest(HEATMAP_ROWS, activity.items(), key=lambda item: len(item[1])))
+            png = render_activity_heatmap(busiest, 7 * 24, now, "Activity by hour, 7d")
+        else:
+            return None
+        
+        self.chart_cache[kind] = (sampled_at, png)
+        return png
+    
+    def send_chart(self, chat_id, kind: str):
+        try:
+            png = self.get_chart(kind)
+            if png is None:
+                self.bot.send_message(chat_id, "📈 Пока нет данных для графика: учёт трафика пишет точку раз в 5 минут")
+                return
+            self.bot.send_photo(chat_id, io.BytesIO(png))
+        except Exception as e:
+            logger.error(f"Error rendering chart {kind}: {e}")
+            self.bot.send_message(chat_id, "❌ Ошибка при построении графика")
+    
+    @staticmethod
+    def fold_activity(activity: dict) -> dict:
+        """Merge the hours of "<name>@grace" entries into their client"""
+        folded = {}
+        for name, hours in activity.items():
+            client_name = name[:-len("@grace")] if name.endswith("@grace") else name
+            folded[client_name] = sorted(set(folded.get(client_name, [])) | set(hours))
+        return folded
+    
+    @staticmethod
+    def fold_grace(values: dict) -> dict:
+        """Merge the "<name>@grace" ledger entries of a key rotation into their client"""
+        folded = {}
+        for name, (rx, tx) in values.items():
+            total = folded.setdefault(name[:-len("@grace")] if name.endswith("@grace") else name, [0, 0])
+            total[0] += rx
+            total[1] += tx
+        return folded
+    
+    def format_rankings(self, limit: int = RANKING_SIZE) -> str:
+        """Top clients by current throughput, today's volume and latest handshake.
+        
+        heapq.nlargest keeps a heap of `limit` items, so each ranking is
+        O(n log k) over the peers instead of a full sort.
+        """
+        text = ""
+        rates, sampled_at = self.traffic.rates()
+        busiest = heapq.nlargest(limit, self.fold_grace(rates).items(), key=lambda item: item[1][0] + item[1][1])
+        busiest = [(name, rate) for name, rate in busiest if rate[0] + rate[1] > 0]
+        if busiest:
+            text += f"\n🚀 **Сейчас (на {datetime.fromtimestamp(sampled_at).strftime('%H:%M')}):**\n"
+            for client_name, (rx, tx) in busiest:
+                text += (f"• **{self.escape_markdown(client_name)}** - "
+                         f"⬆️ {self.format_bytes(rx)}/s, ⬇️ {self.format_bytes(tx)}/s\n")
+        
+        today = self.fold_grace(self.traffic.totals(*parse_period('today')))
+        heaviest = heapq.nlargest(limit, today.items(), key=lambda item: item[1][0] + item[1][1])
+        if heaviest:
+            text += "\n📅 **Трафик за сегодня:**\n"
+            for client_name, (rx, tx) in heaviest:
+                text += f"• **{self.escape_markdown(client_name)}** - {self.format_bytes(rx + tx)}\n"
+        
+        names = {address: client_name for client_name, address in self.pool.items()}
+        recent = heapq.nlargest(
+            limit,
+            (stat for stat in self.get_peer_stats().values() if stat.latest_handshake and stat.address in names),
+            key=lambda stat: stat.latest_handshake
+        )
+        if recent:
+            text += "\n🤝 **Последние handshake:**\n"
+            for stat in recent:
+                text += (f"• **{self.escape_markdown(names[stat.address])}** ({stat.address}) - "
+                         f"{self.format_handshake_age(stat.latest_handshake)}\n")
+        return text
+    
+    def watch_presence(self):
+        """Diff the current peer snapshot against the previous one and queue the events"""
+        try:
+            events = self.presence.diff(read_wg_dump('wg0'))
+            if events and self.subscriptions:
+                self.presence_events.extend(events)
+        except Exception as e:
+            logger.error(f"Error watching presence: {e}")
+    
+    def send_presence_digest(self):
+        """All events since the previous digest in one message per subscriber"""
+        events, self.presence_events = self.presence_events, []
+        if not events:
+            return
+        names = {address: client_name for client_name, address in self.pool.items()}
+        for chat_id, subscribed in self.subscriptions.items():
+            if not self.is_authorized(chat_id):
+                continue
+            lines = []
+            for event in events:
+                client_name = names.get(event.address, event.address or event.public_key[:8])
+                if subscribed and client_name not in subscribed:
+                    continue
+                moment = datetime.fromtimestamp(event.at).strftime('%H:%M')
+                escaped = self.escape_markdown(client_name)
+                if event.kind == ONLINE:
+                    lines.append(f"🟢 {moment} **{escaped}** подключился ({event.endpoint or '-'})")
+                elif event.kind == OFFLINE:
+                    lines.append(f"🔴 {moment} **{escaped}** отключился")
+                else:
+                    lines.append(f"🔀 {moment} **{escaped}**: {event.previous_endpoint} → {event.endpoint}")
+            if not lines:
+                continue
+            text = "👁 **Подключения клиентов**\n\n" + "\n".join(lines[:PRESENCE_DIGEST_LINES])
+            if len(lines) > PRESENCE_DIGEST_LINES:
+                text += f"\n... и ещё {len(lines) - PRESENCE_DIGEST_LINES}"
+            self.send_limited(chat_id, text)
+    
+    def presence_command(self, message):
+        """/presence [on|off|name ...]: subscribe to connect / disconnect digests"""
+        if not self.is_authorized(message.chat.id):
+            self.send_unauthorized_message(message)
+            return
+        
+        args = message.text.split()[1:]
+        if args and args[0].lower() == 'off':
+            self.subscriptions.unsubscribe(message.chat.id)
+            self.bot.send_message(message.chat.id, "🔕 Уведомления о подключениях отключены")
+            return
+        if args and args[0].lower() in ('on', 'all'):
+            self.subscriptions.subscribe(message.chat.id)
+            self.bot.send_message(message.chat.id, "🔔 Уведомления о подключениях всех клиентов включены")
+            return
+        if args:
+            names = [name for name in self.resolve_client_args(args) if name in self.pool]
+            if not names:
+                self.bot.send_message(message.chat.id, "❌ Клиенты не найдены")
+                return
+            self.subscriptions.subscribe(message.chat.id, names)
+            self.bot.send_message(message.chat.id, f"🔔 Уведомления о подключениях: {', '.join(names)}")
+            return
+        
+        subscribed, names = self.subscriptions.get(message.chat.id)
+        status = "выключены" if not subscribed else ("все клиенты" if not names else ", ".join(names))
+        self.bot.send_message(
+            message.chat.id,
+            f"👁 **Уведомления о подключениях:** {self.escape_markdown(status)}\n\n"
+            f"`/presence on` - все клиенты\n"
+            f"`/presence client1 client2` - только выбранные\n"
+            f"`/presence off` - отключить\n\n"
+            f"События (подключение, отсутствие handshake дольше {wg_presence_stale_minutes:g} мин, смена адреса) "
+            f"приходят одной сводкой раз в {wg_presence_interval // 60 or 1} мин.",
+            parse_mode='Markdown'
+        )
+    
+    def tag_command(self, message):
+        """/tag [set|add|rm <names> <tags>] [list|stats|configs <tag>]: client tags and group operations"""
+        if not self.is_authorized(message.chat.id):
+            self.send_unauthorized_message(message)
+            return
+        
+        args = message.text.split()[1:]
+        action = args[0].lower() if args else ''
+        try:
+            if action in ('set', 'add', 'rm') and len(args) >= 2:
+                self.edit_client_tags(message.chat.id, action, args[1].split(','), args[2:])
+            elif action in ('list', 'stats', 'configs') and len(args) == 2:
+                tag = args[1].lower()
+                if tag.startswith('tag:'):
+                    tag = tag[4:]
+                names = self.tag_index.names(tag)
+                if not names:
+                    self.bot.send_message(message.chat.id, f"❌ Нет клиентов с тегом {tag}")
+                elif action == 'list':
+                    self.send_tag_list(message.chat.id, tag, names)
+                elif action == 'stats':
+                    self.send_tag_stats(message.chat.id, tag, names)
+                else:
+                    configs = {}
+                    for client_name in names:
+                        config_path = Path(f"/etc/wireguard/{client_name}_cl.conf")
+                        if config_path.exists():
+                            configs[client_name] = config_path.read_text(encoding='utf-8')
+                    self.send_configs_archive(message.chat.id, configs, f"wireguard_configs_{tag}.zip")
+            else:
+                counts = self.tag_index.counts()
+                tags = ", ".join(f"`{tag}` ({count})" for tag, count in counts.items()) or "нет"
+                self.bot.send_message(
+                    message.chat.id,
+                    "🏷 **Теги клиентов**\n\n"
+                    "`/tag set client1,client2 team-a phone` - заменить теги\n"
+                    "`/tag add client1 team-a` - добавить, `/tag rm client1 team-a` - убрать\n"
+                    "`/tag list team-a` - клиенты с тегом\n"
+                    "`/tag stats team-a` - статистика группы\n"
+                    "`/tag configs team-a` - архив конфигураций группы\n\n"
+                    "`tag:team-a` вместо списка имён понимают /rate, /route, /access, /profile, /psk, /presence "
+                    "и массовое удаление\n\n"
+                    f"Теги: {tags}",
+                    parse_mode='Markdown'
+                )
+        except Exception as e:
+            logger.error(f"Error handling tags: {e}")
+            self.bot.send_message(message.chat.id, "❌ Ошибка при работе с тегами")
+    
+    @with_state_lock
+    def edit_client_tags(self, chat_id, action: str, targets: list, values: list):
+        """Set, add or remove tags of clients given by name or `tag:<tag>`"""
+        try:
+            tags = parse_tags(' '.join(values)) if values else []
+        except ValueError as e:
+            self.bot.send_message(chat_id, f"❌ {e}")
+            return
+        if action != 'set' and not tags:
+            self.bot.send_message(chat_id, "❌ Укажите теги")
+            return
+        
+        names = self.resolve_client_args(targets)
+        missing = [name for name in names if name not in self.pool]
+        updated = 0
+        for client_name in names:
+            if client_name in missing:
+                continue
+            current = set(self.tag_index.tags_of(client_name))
+            if action == 'set':
+                new = set(tags)
+            elif action == 'add':
+                new = current | set(tags)
+            else:
+                new = current - set(tags)
+            if new != current:
+                self.set_client_tags(client_name, sorted(new), save=False)
+                updated += 1
+        if updated:
+            self.store.save()
+        
+        text = f"🏷 Теги изменены у {updated} клиентов"
+        if missing:
+            text += f"\n❌ Не найдены: {', '.join(missing)}"
+        self.bot.send_message(chat_id, text)
+    
+    def send_tag_list(self, chat_id, tag: str, names: set):
+        """Clients of a tag with address, status and their other tags"""
+        stats = self.get_peer_stats()
+        now = time.time()
+        rows = sorted(
+            ((name, self.pool.address_of(name)) for name in names if name in self.pool),
+            key=lambda item: self.pool.index_of(item[1])
+        )
+        lines = []
+        for client_name, address in rows[:TAG_LIST_LINES]:
+            stat = stats.get(address)
+            if stat is None or not stat.latest_handshake:
+                status = "⚪"
+            elif now - stat.latest_handshake < ONLINE_WINDOW:
+                status = "🟢"
+            else:
+                status = "🔴"
+            others = [other for other in self.tag_index.tags_of(client_name) if other != tag]
+            line = f"{status} **{self.escape_markdown(client_name)}** `{address}`"
+            if others:
+                line += f" 🏷 {self.escape_markdown(' '.join(others))}"
+            lines.append(line)
+        if len(rows) > TAG_LIST_LINES:
+            lines.append(f"... и ещё {len(rows) - TAG_LIST_LINES} клиентов")
+        self.bot.send_message(
+            chat_id,
+            f"🏷 **{self.escape_markdown(tag)}** - клиентов: {len(rows)}\n\n" + "\n".join(lines),
+            parse_mode='Markdown'
+        )
+    
+    def send_tag_stats(self, chat_id, tag: str, names: set):
+        """Live and ledger statistics summed over the clients of a tag"""
+        self.sample_traffic()
+        stats = self.get_peer_stats()
+        now = time.time()
+        today = self.fold_grace(self.traffic.totals(*parse_period('today')))
+        month = self.fold_grace(self.traffic.totals('month', datetime.now().strftime('%Y-%m')))
+        online = never = disabled = shaped = 0
+        today_bytes = month_bytes = 0
+        for client_name in names:
+            stat = stats.get(self.pool.address_of(client_name))
+            if stat is None or not stat.latest_handshake:
+                never += 1
+            elif now - stat.latest_handshake < ONLINE_WINDOW:
+                online += 1
+            record = self.store.get(client_name)
+            disabled += bool(record.get('disabled'))
+            shaped += bool(record.get('rate'))
+            today_bytes += sum(today.get(client_name, (0, 0)))
+            month_bytes += sum(month.get(client_name, (0, 0)))
+        self.bot.send_message(
+            chat_id,
+            f"🏷 **Статистика группы {self.escape_markdown(tag)}**\n\n"
+            f"👥 Клиентов: {len(names)}\n"
+            f"🟢 Онлайн: {online}\n"
+            f"⚪ Не подключались: {never}\n"
+            f"⏸ Отключены: {disabled}\n"
+            f"🚦 С ограничением скорости: {shaped}\n"
+            f"📈 Трафик: сегодня {self.format_bytes(today_bytes)}, за месяц {self.format_bytes(month_bytes)}",
+            parse_mode='Markdown'
+        )
+    
+    def chat_stub(self, chat_id):
+        """Stand-in for a message when a job reports after the original update is gone"""
+        return SimpleNamespace(chat=SimpleNamespace(id=chat_id))
+    
+    def format_job(self, job) -> str:
+        lines = [
+            f"{JOB_STATES.get(job.state, job.state)}: **{JOB_TITLES.get(job.kind, job.kind)}**",
+            f"📊 Прогресс: {job.position}/{job.total}",
+        ]
+        lines += [f"{label}: {job.count(bucket)}" for bucket, label in JOB_BUCKETS.items() if job.count(bucket)]
+        if job.kind == 'restore' and job.state == RUNNING and job.position < job.total:
+            lines.append(dict(RESTORE_PHASES).get(job.items[job.position], "") + "...")
+        if job.error:
+            lines.append(f"❌ {self.escape_markdown(job.error[:200])}")
+        return "\n".join(lines)
+    
+    def report_job(self, job, final: bool):
+        """Progress of a job in one message, edited in place; called by the job engine"""
+        markup = None
+        if not final:
+            markup = types.InlineKeyboardMarkup()
+            buttons = [types.InlineKeyboardButton("🔄 Статус", callback_data=f"job:status:{job.id}")]
+            if self.jobs.handlers[job.kind].cancellable:
+                buttons.append(types.InlineKeyboardButton("⛔ Отменить", callback_data=f"job:cancel:{job.id}"))
+            markup.row(*buttons)
+        text = self.format_job(job)
+        if job.message_id:
+            try:
+                self.bot.edit_message_text(chat_id=job.chat_id, message_id=job.message_id, text=text,
+                                           reply_markup=markup, parse_mode='Markdown')
+                return
+            except Exception as e:
+                # Unchanged text, or the message is gone: only the latter needs a new one
+                if 'not modified' in str(e):
+                    return
+        job.message_id = self.bot.send_message(job.chat_id, text, reply_markup=markup,
+                                               parse_mode='Markdown').message_id
+    
+    def jobs_command(self, message):
+        """/jobs: running and recently finished background jobs"""
+        if not self.is_authorized(message.chat.id):
+            self.send_unauthorized_message(message)
+            return
+        
+        jobs = self.jobs.jobs()
+        if not jobs:
+            self.bot.send_message(message.chat.id, "📭 Фоновых задач нет")
+            return
+        markup = types.InlineKeyboardMarkup()
+        for job in jobs:
+            if job.state == RUNNING:
+                markup.add(types.InlineKeyboardButton(
+                    f"🔄 {JOB_TITLES.get(job.kind, job.kind)} ({job.position}/{job.total})",
+                    callback_data=f"job:status:{job.id}"
+                ))
+        text = "🧵 **Фоновые задачи:**\n\n" + "\n\n".join(
+            f"`{job.id}` {datetime.fromtimestamp(job.created).strftime('%d.%m %H:%M')}\n{self.format_job(job)}"
+            for job in jobs[-10:]
+        )
+        self.bot.send_message(message.chat.id, text, reply_markup=markup if markup.keyboard else None,
+                              parse_mode='Markdown')
+    
+    def reconcile_command(self, message):
+        """/reconcile [path]: bring the clients to a desired-state document (preview first)"""
+        if not self.is_authorized(message.chat.id):
+            self.send_unauthorized_message(message)
+            return
+        
+        if self.fleet is not None:
+            self.bot.send_message(message.chat.id, "❌ Желаемое состояние применяется только к локальному серверу")
+            return
+        
+        args = message.text.split(maxsplit=1)[1:]
+        if args:
+            try:
+                with open(args[0].strip(), 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (OSError, ValueError) as e:
+                self.bot.send_message(message.chat.id, f"❌ Не удалось прочитать {args[0].strip()}: {str(e)[:200]}")
+                return
+            self.preview_reconcile(message.chat.id, data, args[0].strip())
+            return
+        
+        self.bot.send_message(
+            message.chat.id,
+            "🧾 **Желаемое состояние**\n\n"
+            "Отправьте JSON файл со списком клиентов или укажите путь на сервере: `/reconcile /path/state.json`\n\n"
+            "```\n"
+            '{"prune": true, "clients": [\n'
+            '  {"name": "phone", "address": "10.0.0.5", "profile": "mobile",\n'
+            '   "route": "nolan", "rate": "basic", "access": "lan",\n'
+            '   "enabled": true, "expires": "2026-12-31", "psk": true}\n'
+            "]}\n"
+            "```\n"
+            "Поля, не указанные у клиента, не меняются. С `\"prune\": true` (по умолчанию) клиенты, "
+            "которых нет в файле, удаляются. Перед применением бот покажет список изменений.",
+            parse_mode='Markdown'
+        )
+        self.bot.register_next_step_handler(message, self.handle_reconcile_file)
+    
+    def handle_reconcile_file(self, message):
+        """Handle an uploaded desired-state document"""
+        if not self.is_authorized(message.chat.id):
+            self.send_unauthorized_message(message)
+            return
+        
+        try:
+            if not message.document or not message.document.file_name.endswith('.json'):
+                self.bot.send_message(message.chat.id, "❌ Файл не найден. Отправьте JSON файл.")
+                return
+            if message.document.file_size > 10 * 1024 * 1024:
+                self.bot.send_message(message.chat.id, "❌ Файл слишком большой. Максимальный размер: 10MB")
+                return
+            
+            file_info = self.bot.get_file(message.document.file_id)
+            data = json.loads(self.bot.download_file(file_info.file_path).decode('utf-8'))
+            self.preview_reconcile(message.chat.id, data, message.document.file_name)
+        except ValueError:
+            self.bot.send_message(message.chat.id, "❌ Ошибка чтения файла. Файл поврежден или имеет неправильный формат.")
+        except Exception as e:
+            logger.error(f"Error handling desired-state file: {e}")
+            self.bot.send_message(message.chat.id, "❌ Ошибка при обработке файла")
+    
+    def normalize_desired(self, clients: dict) -> dict:
+        """Check the values of a parsed desired-state document and convert them to client store values"""
+        for client_name, fields in clients.items():
+            try:
+                if 'address' in fields:
+                    if fields['address'] in (None, '', 'auto'):
+                        del fields['address']
+                    else:
+                        fields['address'] = self.pool.parse_address(str(fields['address']))
+                if 'profile' in fields:
+                    profile = str(fields['profile'] or 'default').lower()
+                    if profile not in self.config_profiles:
+                        raise ValueError(f"неизвестный профиль конфигурации {profile}")
+                    fields['profile'] = None if profile == 'default' else profile
+                if fields.get('route') is not None:
+                    fields['route'] = str(fields['route']).lower()
+                    if fields['route'] not in self.route_profiles:
+                        raise ValueError(f"неизвестный профиль маршрутов {fields['route']}")
+                if 'rate' in fields:
+                    rate = fields['rate']
+                    fields['rate'] = None if rate in (None, '', 'off') else list(parse_limit(str(rate), self.rate_profiles))
+                if 'access' in fields:
+                    level = str(fields['access'] or 'default').lower()
+                    if level not in ACCESS_LEVELS:
+                        raise ValueError(f"неизвестный уровень доступа {level}")
+                    fields['access'] = ACCESS_LEVELS[level]
+            except (AddressPoolError, ValueError) as e:
+                raise ValueError(f"{client_name}: {e}")
+        return clients
+    
+    def current_state(self) -> dict:
+        """Live clients in the terms of a desired-state document"""
+        state = {}
+        for client_name, address in self.pool.items():
+            record = self.store.get(client_name)
+            state[client_name] = {
+                'address': address,
+                'profile': record.get('profile'),
+                'route': record.get('route'),
+                'rate': record.get('rate'),
+                'access': record.get('access'),
+                'enabled': not record.get('disabled'),
+                'expires': record.get('expires'),
+                'psk': Path(f"/etc/wireguard/{client_name}_presharedkey").exists(),
+                'tags': self.tag_index.tags_of(client_name),
+            }
+        return state
+    
+    def preview_reconcile(self, chat_id, data, source: str):
+        """Dry run: parse, diff against the live clients and show the plan with an apply button"""
+        try:
+            desired, prune = parse_document(data)
+            desired = self.normalize_desired(desired)
+        except ValueError as e:
+            self.bot.send_message(chat_id, f"❌ Некорректный документ: {self.escape_markdown(str(e)[:300])}")
+            return
+        
+        current = self.current_state()
+        conflicts = find_conflicts(desired, current, prune)
+        if conflicts:
+            lines = [f"{address}: {', '.join(names)}" for address, names in list(conflicts.items())[:RECONCILE_PREVIEW_LINES]]
+            self.bot.send_message(chat_id, "❌ Один адрес у нескольких клиентов:\n" + "\n".join(lines))
+            return
+        
+        plan = compute_plan(desired, current, prune)
+        if plan.empty:
+            self.bot.send_message(chat_id, f"✅ Сервер уже в желаемом состоянии ({plan.unchanged} клиентов)")
+            return
+        
+        def section(title, names):
+            if not names:
+                return ""
+            shown = ", ".join(self.escape_markdown(name) for name in names[:RECONCILE_PREVIEW_LINES])
+            more = f" и ещё {len(names) - RECONCILE_PREVIEW_LINES}" if len(names) > RECONCILE_PREVIEW_LINES else ""
+            return f"\n{title}: {len(names)}\n{shown}{more}\n"
+        
+        updates = [f"{name} ({', '.join(fields)})" for name, fields in plan.update.items()]
+        text = (
+            f"🧾 **Предпросмотр: {self.escape_markdown(source)}**\n"
+            f"Без изменений: {plan.unchanged}\n"
+            + section("➕ Создать", [name for name, _ in plan.create])
+            + section("🔁 Пересоздать с новым адресом и ключами", [name for name, _ in plan.recreate])
+            + section("✏️ Изменить", updates)
+            + section("🗑 Удалить", plan.delete)
+            + "\nИзменения применяются к WireGuard одним действием в конце."
+        )
+        self.pending_reconcile[chat_id] = (desired, prune)
+        markup = types.InlineKeyboardMarkup()
+        markup.row(
+            types.InlineKeyboardButton("✅ Применить", callback_data="reconcile:apply"),
+            types.InlineKeyboardButton("❌ Отмена", callback_data="reconcile:cancel")
+        )
+        self.bot.send_message(chat_id, text, reply_markup=markup, parse_mode='Markdown')
+    
+    def apply_reconcile(self, chat_id, message_id):
+        """Diff again (clients may have changed since the preview) and queue the plan as one job"""
+        desired, prune = self.pending_reconcile.pop(chat_id)
+        current = self.current_state()
+        plan = compute_plan(desired, current, prune)
+        # Deletions first so that their addresses are free, then fixed addresses before automatic ones
+        ops = [['delete', name, current[name]['address']] for name in plan.delete]
+        ops += [['delete', name, current[name]['address']] for name, _ in plan.recreate]
+        ops += [['update', name, fields] for name, fields in plan.update.items()]
+        creates = sorted(plan.create + plan.recreate, key=lambda item: not item[1].get('address'))
+        ops += [['create', name, fields] for name, fields in creates]
+        self.jobs.submit('reconcile', chat_id, ops, message_id=message_id)
+    
+    def reconcile_step(self, job, op):
+        """One client change of a reconcile job; WireGuard, tc and nft are applied in reconcile_finish"""
+        action, client_name, data = op
+        if job.position == 0:
+            self.sample_traffic()
+        try:
+            return self.run_reconcile_op(action, client_name, data)
+        except Exception as e:
+            logger.error(f"Reconcile: {action} {client_name} failed - {e}")
+            return "failed", {"name": client_name, "error": str(e)}
+    
+    def run_reconcile_op(self, action: str, client_name: str, data):
+        if action == 'delete':
+            address = self.pool.address_of(client_name)
+            if address != data:
+                # Already deleted, or already recreated at its new address before an interruption
+                return "deleted", client_name
+            success, result_msg = self.perform_client_deletion(client_name, address, None, restart=False)
+            if not success:
+                return "failed", {"name": client_name, "error": result_msg}
+            return "deleted", client_name
+        
+        if action == 'create':
+            if client_name in self.pool:
+                return "created", client_name
+            success, result_msg = self.add_vpn_config(
+                client_name, data.get('address') or "auto", data.get('expires'),
+                RateLimit(*data['rate']) if data.get('rate') else None,
+                data.get('route'), data.get('profile'), data.get('psk'),
+                apply_shaping=False, apply_config=False
+            )
+            if not success:
+                return "failed", {"name": client_name, "error": result_msg}
+            if data.get('tags'):
+                self.set_client_tags(client_name, data['tags'], save=False)
+            return "created", client_name
+        
+        fields = {key: data[key] for key in ('profile', 'route', 'rate', 'expires') if key in data}
+        if fields:
+            self.store.update(client_name, save=False, **fields)
+        if 'tags' in data:
+            self.set_client_tags(client_name, data['tags'], save=False)
+        return "updated", client_name
+    
+    def reconcile_finish(self, job):
+        """Batch the field changes, then apply WireGuard, shaping and the firewall once"""
+        failed = {entry['name'] for entry in job.results.get('failed', [])}
+        done = [(action, name, data) for action, name, data in job.items[:job.position]
+                if action != 'delete' and name not in failed and name in self.pool]
+        self.store.save()
+        self.load_expiry()
+        
+        access, psk, render, disable, enable = {}, [], [], [], []
+        for action, client_name, data in done:
+            if 'access' in data and (action == 'update' or data['access']):
+                access.setdefault(data['access'], []).append(client_name)
+            if action == 'update':
+                if data.get('psk'):
+                    psk.append(client_name)
+                if 'profile' in data or 'route' in data:
+                    render.append(client_name)
+                if data.get('enabled') is True:
+                    enable.append(client_name)
+            if data.get('enabled') is False:
+                disable.append(client_name)
+        
+        keys = {}
+        for client_name in psk:
+            public_key = read_key(Path(f"/etc/wireguard/{client_name}_publickey"))
+            if public_key:
+                keys[public_key] = self.new_preshared_key(client_name)
+        if keys:
+            self.set_preshared_keys(keys)
+        for level, names in access.items():
+            self.set_client_access(names, level)
+        self.disable_clients(disable, apply_config=False)
+        self.enable_clients(enable, apply_config=False)
+        
+        self.apply_wireguard_config()
+        self.apply_shaping()
+        self.sync_grace_peers()
+        
+        # New clients and clients whose config changed get their configs in one archive
+        created = [name for action, name, _ in done if action == 'create']
+        counts = self.render_clients(created + render + psk, collect=True)
+        self.send_configs_archive(job.chat_id, counts['configs'], "wireguard_configs_reconcile.zip")
+        
+        text = (
+            f"🧾 **Желаемое состояние применено**\n\n"
+            f"➕ Создано: {len(created)}\n"
+            f"✏️ Изменено: {job.count('updated')}\n"
+            f"🗑 Удалено: {job.count('deleted')}"
+        )
+        if failed:
+            errors = "\n".join(
+                f"• {self.escape_markdown(entry['name'])}: {self.escape_markdown(str(entry['error'])[:100])}"
+                for entry in job.results['failed'][:RECONCILE_PREVIEW_LINES]
+            )
+            text += f"\n❌ Ошибок: {len(failed)}\n{errors}"
+        if job.state == CANCELLED:
+            text += "\n\n⛔ Отменено: применена только выполненная часть, повторите документ для завершения"
+        self.bot.send_message(job.chat_id, text, parse_mode='Markdown')
+    
+    @with_state_lock
+    def read_drift_sources(self) -> Sources:
+        """Read every place a client lives in once: client configs, wg0.conf, key files, configs.txt, wg0"""
+        clients = {client_name: info['ip'] for client_name, info in self.scan_existing_configs().items()}
+        config_path = Path("/etc/wireguard/wg0.conf")
+        peers = []
+        if config_path.exists():
+            for block in split_peers(config_path.read_text(encoding='utf-8'))[1]:
+                if peer_public_key(block):
+                    peers.append((peer_public_key(block), peer_address(block)))
+        
+        public_keys = {}
+        for client_name in clients:
+            public_key = read_key(Path(f"/etc/wireguard/{client_name}_publickey"))
+            if public_key:
+                public_keys[client_name] = public_key
+        # Only new or rewritten private keys fork `wg pubkey`
+        derived_keys = self.derived_keys.derive(
+            {client_name: Path(f"/etc/wireguard/{client_name}_privatekey") for client_name in clients}
+        )
+        
+        listing_path = Path("configs.txt")
+        return Sources(
+            clients=clients,
+            peers=peers,
+            public_keys=public_keys,
+            derived_keys=derived_keys,
+            live=read_wg_dump('wg0') if Path("/sys/class/net/wg0").exists() else None,
+            listing=parse_listing(listing_path.read_text(encoding='utf-8')) if listing_path.exists() else None,
+            disabled={client_name for client_name, record in self.store.items() if record.get('disabled')}
+        )
+    
+    def format_drift(self, issues: list) -> str:
+        if not issues:
+            return "✅ Расхождений нет: wg0.conf, файлы клиентов, configs.txt и интерфейс совпадают"
+        counts = {}
+        for issue in issues:
+            counts[issue.kind] = counts.get(issue.kind, 0) + 1
+        lines = [f"⚠️ **Найдены расхождения: {len(issues)}**", ""]
+        lines += [f"• {DRIFT_LABELS.get(kind, kind)}: {count}" for kind, count in counts.items()]
+        lines.append("")
+        for issue in issues[:DRIFT_REPORT_LINES]:
+            subject = issue.name or issue.detail[:12] or "-"
+            lines.append(f"`{issue.address or '-'}` {self.escape_markdown(subject)}: {DRIFT_LABELS.get(issue.kind, issue.kind)}")
+        if len(issues) > DRIFT_REPORT_LINES:
+            lines.append(f"... и ещё {len(issues) - DRIFT_REPORT_LINES}")
+        manual = sum(1 for issue in issues if issue.kind not in REPAIRABLE)
+        if manual:
+            lines.append(f"\nТребуют ручного решения: {manual} (дубли адресов, потерянные ключи)")
+        return "\n".join(lines)
+    
+    @staticmethod
+    def drift_markup(issues: list):
+        if not any(issue.kind in REPAIRABLE for issue in issues):
+            return None
+        markup = types.InlineKeyboardMarkup()
+        markup.add(types.InlineKeyboardButton("🛠 Исправить", callback_data="drift:repair"))
+        return markup
+    
+    def check_drift(self):
+        """Periodic consistency check; admins hear about issues that persist across two checks"""
+        if any(job.state == RUNNING for job in self.jobs.jobs()):
+            return
+        try:
+            issues = detect_drift(self.read_drift_sources())
+        except Exception as e:
+            logger.error(f"Error checking drift: {e}")
+            return
+        # A client being added right now shows up as drift once; a real one is still there an hour later
+        current = set(issues)
+        persistent = current & self.drift_seen
+        self.drift_seen = current
+        if persistent - self.drift_notified:
+            kept = [issue for issue in issues if issue in persistent]
+            self.notify_admins(self.format_drift(kept), self.drift_markup(kept))
+        self.drift_notified = persistent
+        if issues:
+            logger.warning(f"Drift check: {len(issues)} issues")
+    
+    def drift_command(self, message):
+        """/drift: check wg0.conf, client files, key files, configs.txt and the live interface now"""
+        if not self.is_authorized(message.chat.id):
+            self.send_unauthorized_message(message)
+            return
+        
+        try:
+            issues = detect_drift(self.read_drift_sources())
+            self.bot.send_message(message.chat.id, self.format_drift(issues), reply_markup=self.drift_markup(issues),
+                                  parse_mode='Markdown')
+        except Exception as e:
+            logger.error(f"Error checking drift: {e}")
+            self.bot.send_message(message.chat.id, "❌ Ошибка при проверке конфигурации")
+    
+    def server_peer_block(self, client_name: str, address: str, public_key: str) -> str:
+        """[Peer] block of a client as add_cl.sh writes it, with the PSK when the client has one"""
+        lines = ["[Peer]", f"PublicKey = {public_key}"]
+        preshared_key = read_key(Path(f"/etc/wireguard/{client_name}_presharedkey"))
+        if preshared_key:
+            lines.append(f"PresharedKey = {preshared_key}")
+        address6 = self.pool.address6_of(address)
+        lines.append(f"AllowedIPs = {address}/32" + (f", {address6}/128" if address6 else ""))
+        return "\n".join(lines) + "\n"
+    
+    @with_state_lock
+    def repair_drift(self, chat_id):
+        """Fix the repairable issues with one rewrite of wg0.conf and one apply, then check again"""
+        try:
+            sources = self.read_drift_sources()
+            issues = detect_drift(sources)
+            kinds = {issue.kind for issue in issues}
+            
+            # The client config was rendered from the private key, so the public key file follows it
+            for issue in issues:
+                if issue.kind == KEY_PAIR:
+                    write_key(Path(f"/etc/wireguard/{issue.name}_publickey"), sources.derived_keys[issue.name], private=False)
+            
+            if kinds & {MISSING_PEER, PEER_KEY, ORPHAN_PEER, KEY_PAIR}:
+                config_path = Path("/etc/wireguard/wg0.conf")
+                head, peers = split_peers(config_path.read_text(encoding='utf-8'))
+                orphans = {(issue.detail, issue.address) for issue in issues if issue.kind == ORPHAN_PEER}
+                keys = {
+                    issue.address: sources.derived_keys.get(issue.name) or sources.public_keys.get(issue.name)
+                    for issue in issues if issue.kind == PEER_KEY
+                }
+                kept = []
+                for block in peers:
+                    if (peer_public_key(block), peer_address(block)) in orphans:
+                        continue
+                    if keys.get(peer_address(block)):
+                        block = set_peer_field(block, 'PublicKey', keys[peer_address(block)])
+                    kept.append(block)
+                for issue in issues:
+                    public_key = sources.derived_keys.get(issue.name) or sources.public_keys.get(issue.name)
+                    if issue.kind == MISSING_PEER and public_key:
+                        kept.append(self.server_peer_block(issue.name, issue.address, public_key))
+                config_path.write_text(join_peers(head, kept), encoding='utf-8')
+            
+            if kinds & (REPAIRABLE - {LISTING}):
+                self.apply_wireguard_config()
+                self.sync_grace_peers()
+                self.apply_shaping()
+            if LISTING in kinds:
+                self.recreate_configs_file(self.scan_existing_configs())
+            
+            remaining = detect_drift(self.read_drift_sources())
+            self.drift_seen = self.drift_notified = set(remaining)
+            logger.info(f"Drift repaired: {len(issues) - len(remaining)} of {len(issues)} issues")
+            self.bot.send_message(
+                chat_id,
+                f"🛠 Исправлено: {len(issues) - len(remaining)}\n\n" + self.format_drift(remaining),
+                parse_mode='Markdown'
+            )
+        except Exception as e:
+            logger.error(f"Error repairing drift: {e}")
+            self.bot.send_message(chat_id, f"❌ Ошибка при исправлении: {str(e)[:200]}")
+    
+    def sample_traffic(self):
+        """Add the counter growth since the last sample to the persistent traffic ledger"""
+        try:
+            stats = read_wg_dump('wg0')
+            if self.rotation:
+                # Migrated clients talk through the grace interface; their counters add up
+                grace = read_wg_dump(self.rotation['interface'])
+                stats.update({f"{key}@grace": stat for key, stat in grace.items()})
+            names = {address: client_name for client_name, address in self.pool.items()}
+            counters = {}
+            for key, stat in stats.items():
+                client_name = names.get(stat.address)
+                if client_name:
+                    counters[f"{client_name}@grace" if key.endswith("@grace") else client_name] = (stat.rx, stat.tx)
+            deltas = self.traffic.sample(counters)
+            self.traffic.save()
+            return deltas
+        except Exception as e:
+            logger.error(f"Error sampling traffic: {e}")
+            return {}
+    
+    def traffic_command(self, message):
+        """/traffic [period]: top consumers from the persistent ledger"""
+        if not self.is_authorized(message.chat.id):
+            self.send_unauthorized_message(message)
+            return
+        
+        args = message.text.split()[1:]
+        try:
+            kind, key = parse_period(args[0] if args else 'today')
+        except ValueError:
+            self.bot.send_message(
+                message.chat.id,
+                "📈 **Учёт трафика**\n\n"
+                "`/traffic` - за сегодня\n"
+                "`/traffic 7d` - за последние 7 дней\n"
+                "`/traffic month` - с начала месяца\n"
+                "`/traffic 2026-09` - за месяц\n"
+                "`/traffic 2026-10-01..2026-10-15` - за период",
+                parse_mode='Markdown'
+            )
+            return
+        
+        try:
+            self.sample_traffic()
+            totals = self.fold_grace(self.traffic.totals(kind, key))
+            
+            period = key.replace('..', ' - ') if kind == 'day' else key
+            if not totals:
+                self.bot.send_message(message.chat.id, f"📈 За {period} трафика нет")
+                return
+            
+            top = heapq.nlargest(TRAFFIC_TOP, totals.items(), key=lambda item: item[1][0] + item[1][1])
+            lines = [
+                f"{i}. **{self.escape_markdown(name)}** - {self.format_bytes(rx + tx)} "
+                f"(⬆️ {self.format_bytes(rx)}, ⬇️ {self.format_bytes(tx)})"
+                for i, (name, (rx, tx)) in enumerate(top, 1)
+            ]
+            total_bytes = sum(rx + tx for rx, tx in totals.values())
+            self.bot.send_message(
+                message.chat.id,
+                f"📈 **Трафик за {period}**\n\n"
+                f"Всего: {self.format_bytes(total_bytes)}, клиентов: {len(totals)}\n\n"
+                + "\n".join(lines),
+                parse_mode='Markdown'
+            )
+        except Exception as e:
+            logger.error(f"Error building traffic report: {e}")
+            self.bot.send_message(message.chat.id, "❌ Ошибка при построении отчёта о трафике")
+    
+    @with_state_lock
+    def find_idle_peers(self, idle_days: float) -> list:
+        """Enabled clients without a handshake for `idle_days`: (name, address, last seen or 0)"""
+        self.update_last_seen()
+        threshold = time.time() - idle_days * 86400
+        idle = []
+        changed = False
+        
+        for client_name, address in self.pool.items():
+            record = self.store.get(client_name)
+            if record.get('disabled'):
+                continue
+            
+            last_seen = record.get('last_seen', 0)
+            created = record.get('created')
+            if created is None:
+                # Clients created before the store existed: use the config file age once
+                config_path = Path(f"/etc/wireguard/{client_name}_cl.conf")
+                created = int(config_path.stat().st_mtime) if config_path.exists() else int(time.time())
+                self.store.update(client_name, save=False, created=created)
+                changed = True
+            
+            if max(last_seen, created) < threshold:
+                idle.append((client_name, address, last_seen))
+        
+        if changed:
+            self.store.save()
+        return sorted(idle, key=lambda item: item[2])
+    
+    @with_state_lock
+    def reap_idle_peers(self, chat_id=None):
+        """Report idle peers, or disable them in one batch when WG_REAPER_MODE=disable"""
+        idle = self.find_idle_peers(wg_idle_days)
+        send = (lambda text, markup=None: self.bot.send_message(chat_id, text, reply_markup=markup, parse_mode='Markdown')) \
+            if chat_id is not None else self.notify_admins
+        
+        if not idle:
+            if chat_id is not None:
+                send(f"✅ Нет клиентов без подключений дольше {wg_idle_days} дн.")
+            return
+        
+        lines = []
+        for client_name, address, last_seen in idle[:20]:
+            seen = datetime.fromtimestamp(last_seen).strftime('%d.%m.%Y') if last_seen else "никогда"
+            lines.append(f"• **{self.escape_markdown(client_name)}** ({address}) - {seen}")
+        if len(idle) > 20:
+            lines.append(f"... и ещё {len(idle) - 20} клиентов")
+        
+        names = [client_name for client_name, _, _ in idle]
+        if wg_reaper_mode == 'disable' and chat_id is None:
+            disabled = self.disable_clients(names)
+            send(f"⏸ **Отключено неактивных клиентов: {len(disabled)}** (> {wg_idle_days} дн.)\n\n" + "\n".join(lines))
+            return
+        
+        self.temp_idle_peers = names
+        markup = types.InlineKeyboardMarkup()
+        markup.row(types.InlineKeyboardButton(f"⏸ Отключить всех ({len(names)})", callback_data="reap:disable"))
+        send(f"💤 **Неактивные клиенты: {len(idle)}** (> {wg_idle_days} дн.)\n\n" + "\n".join(lines), markup)
+    
+    @with_state_lock
+    def disable_clients(self, names: list, apply_config: bool = True) -> list:
+        """Take peers out of wg0.conf in one rewrite and one apply; keys and client configs stay"""
+        addresses = {self.pool.address_of(name): name for name in names if self.pool.address_of(name)}
+        if not addresses:
+            return []
+        
+        config_path = Path("/etc/wireguard/wg0.conf")
+        head, peers = split_peers(config_path.read_text(encoding='utf-8'))
+        
+        kept, disabled = [], []
+        now = int(time.time())
+        for block in peers:
+            client_name = addresses.get(peer_address(block))
+            if client_name is None:
+                kept.append(block)
+                continue
+            self.store.update(client_name, save=False, disabled=now, peer_block=block)
+            disabled.append(client_name)
+        
+        if disabled:
+            config_path.write_text(join_peers(head, kept), encoding='utf-8')
+            self.store.save()
+            self.sample_traffic()
+            if apply_config:
+                self.apply_wireguard_config()
+                self.apply_shaping()
+            logger.info(f"Disabled {len(disabled)} clients: {', '.join(disabled[:20])}")
+        return disabled
+    
+    @with_state_lock
+    def enable_clients(self, names: list, apply_config: bool = True) -> list:
+        """Put disabled peers back from their saved blocks, with a single apply"""
+        blocks, enabled = [], []
+        for client_name in names:
+            block = self.store.get(client_name).get('peer_block')
+            if block:
+                blocks.append(block)
+                enabled.append(client_name)
+        if not blocks:
+            return []
+        
+        config_path = Path("/etc/wireguard/wg0.conf")
+        head, peers = split_peers(config_path.read_text(encoding='utf-8'))
+        config_path.write_text(join_peers(head, peers + blocks), encoding='utf-8')
+        for client_name in enabled:
+            self.store.update(client_name, save=False, disabled=None, peer_block=None)
+        self.store.save()
+        if apply_config:
+            self.apply_wireguard_config()
+            self.apply_shaping()
+        logger.info(f"Enabled {len(enabled)} clients: {', '.join(enabled[:20])}")
+        return enabled
+    
+    def idle_command(self, message):
+        """/idle: report clients idle longer than WG_IDLE_DAYS"""
+        if not self.is_authorized(message.chat.id):
+            self.send_unauthorized_message(message)
+            return
+        try:
+            self.reap_idle_peers(chat_id=message.chat.id)
+        except Exception as e:
+            logger.error(f"Error finding idle peers: {e}")
+            self.bot.send_message(message.chat.id, "❌ Ошибка при поиске неактивных клиентов")
+    
+    def disabled_command(self, message):
+        """/disabled: list disabled clients with enable buttons"""
+        if not self.is_authorized(message.chat.id):
+            self.send_unauthorized_message(message)
+            return
+        
+        disabled = sorted(name for name, record in self.store.items() if record.get('disabled'))
+        if not disabled:
+            self.bot.send_message(message.chat.id, "Отключенных клиентов нет")
+            return
+        
+        markup = types.InlineKeyboardMarkup()
+        for client_name in disabled[:20]:
+            markup.row(types.InlineKeyboardButton(f"▶️ {client_name}", callback_data=f"enable:{client_name}"))
+        markup.row(types.InlineKeyboardButton(f"▶️ Включить всех ({len(disabled)})", callback_data="enable:*"))
+        self.bot.send_message(message.chat.id, f"⏸ Отключенные клиенты: {len(disabled)}", reply_markup=markup)
+    
+    def enable_command(self, message):
+        """/enable <name|all>: re-enable disabled clients without new keys"""
+        if not self.is_authorized(message.chat.id):
+            self.send_unauthorized_message(message)
+            return
+        
+        target = message.text.partition(' ')[2].strip()
+        if target in ('all', '*'):
+            names = [name for name, record in self.store.items() if record.get('disabled')]
+        else:
+            names = [self.sanitize_input(target)]
+        
+        try:
+            enabled = self.enable_clients(names)
+            if enabled:
+                self.bot.send_message(message.chat.id, f"▶️ Включено клиентов: {len(enabled)}")
+            else:
+                self.bot.send_message(message.chat.id, "❌ Отключенные клиенты не найдены")
+        except Exception as e:
+            logger.error(f"Error enabling clients: {e}")
+            self.bot.send_message(message.chat.id, "❌ Ошибка при включении клиентов")
+    
+    def get_transfer_total(self) -> int:
+        """Sum of received and sent bytes over all peers of wg0"""
+        try:
+            wg_result = subprocess.run(['wg', 'show', 'wg0', 'transfer'], capture_output=True, text=True)
+            if wg_result.returncode != 0:
+                return 0
+            
+            total = 0
+            for line in wg_result.stdout.splitlines():
+                parts = line.split()
+                if len(parts) == 3:
+                    total += int(parts[1]) + int(parts[2])
+            return total
+        except Exception as e:
+            logger.error(f"Error getting transfer totals: {e}")
+            return 0
+    
+    @staticmethod
+    def format_bytes(size: float) -> str:
+        for unit in ['B', 'KiB', 'MiB', 'GiB']:
+            if size < 1024:
+                return f"{size:.1f} {unit}"
+            size /= 1024
+        return f"{size:.1f} TiB"
+    
+    # Peer operations exposed to the fleet (see agent.py)
+    
+    def rpc_info(self) -> dict:
+        """Node load summary used for placement"""
+        return {
+            'peers': len(self.pool),
+            'free': self.pool.free_count,
+            'traffic': self.get_transfer_total(),
+            'network': str(self.pool.network),
+            'status': self.get_server_status()['status']
+        }
+    
+    def rpc_create_client(self, name: str, address: Optional[str] = None, expires: Optional[int] = None,
+                          rate: Optional[list] = None, route: Optional[str] = None,
+                          profile: Optional[str] = None, psk: Optional[bool] = None) -> dict:
+        config_name = self.sanitize_input(name)
+        if route and route not in self.route_profiles:
+            raise Exception(f"Unknown route profile {route}")
+        if profile and profile not in self.config_profiles:
+            raise Exception(f"Unknown config profile {profile}")
+        success, message_text = self.add_vpn_config(
+            config_name, address or "auto", expires, RateLimit(*rate) if rate else None, route, profile, psk
+        )
+        if not success:
+            raise Exception(message_text)
+        
+        config_path = Path(f"/etc/wireguard/{config_name}_cl.conf")
+        return {
+            'name': config_name,
+            'address': self.pool.address_of(config_name),
+            'config': config_path.read_text(encoding='utf-8') if config_path.exists() else ''
+        }
+    
+    def rpc_delete_client(self, name: str) -> dict:
+        address = self.pool.address_of(name)
+        if address is None:
+            raise Exception(f"Client {name} not found")
+        
+        success, message_text = self.perform_client_deletion(name, address, None)
+        if not success:
+            raise Exception(message_text)
+        return {'name': name, 'address': address}
+    
+    def rpc_dump_stats(self) -> dict:
+        configs = self.scan_existing_configs()
+        return {
+            'clients': {name: {'ip': info['ip'], 'ip6': info.get('ip6')} for name, info in configs.items()},
+            'peers': self.get_active_peers(),
+            'status': self.get_server_status()['status']
+        }
+    
+    def rpc_backup(self) -> dict:
+        backup_data = self.create_backup_data()
+        if backup_data is None:
+            raise Exception("Backup failed")
+        return backup_data
+    
     def get_system_info(self) -> str:
         """Get basic system information"""
         try:
@@ -2535,7 +5422,13 @@ def main():
             logger.error("No authorized users configured")
             return
         
-        wg_bot = WireGuardBot(api_tg, mainid, wg_local_ip_hint)
+        wg_bot = WireGuardBot(api_tg, mainid, wg_address_pool, wg_address_pool6)
+        if wg_agents:
+            wg_bot.attach_fleet(parse_agents(wg_agents, wg_agent_secret, wg_agent_ca), wg_fleet_local, wg_placement)
+        wg_bot.apply_firewall()
+        wg_bot.apply_shaping()
+        wg_bot.start_background_jobs()
+        wg_bot.jobs.resume()
         logger.info("Starting WireGuard Telegram Bot...")
         logger.info(f"Authorized users: {mainid}")
         wg_bot.bot.polling(none_stop=True, interval=0)
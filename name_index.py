@@ -0,0 +1,76 @@
+import heapq
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Set
+
+# Every substring up to this length is indexed; longer queries intersect trigram postings
+GRAM_SIZE = 3
+
+
+class NameIndex:
+    """Incremental substring search over client names (n-gram inverted index)"""
+
+    def __init__(self, names: Iterable[str] = ()):
+        self._postings: Dict[str, Set[str]] = defaultdict(set)
+        self._names: Set[str] = set()
+        self._lock = threading.Lock()
+        for name in names:
+            self.add(name)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._names
+
+    @staticmethod
+    def _grams(text: str) -> Set[str]:
+        return {
+            text[i:i + size]
+            for size in range(1, GRAM_SIZE + 1)
+            for i in range(len(text) - size + 1)
+        }
+
+    def add(self, name: str):
+        with self._lock:
+            if name in self._names:
+                return
+            self._names.add(name)
+            for gram in self._grams(name.lower()):
+                self._postings[gram].add(name)
+
+    def remove(self, name: str):
+        with self._lock:
+            if name not in self._names:
+                return
+            self._names.discard(name)
+            for gram in self._grams(name.lower()):
+                posting = self._postings.get(gram)
+                if posting is not None:
+                    posting.discard(name)
+                    if not posting:
+                        del self._postings[gram]
+
+    def clear(self):
+        with self._lock:
+            self._postings.clear()
+            self._names.clear()
+
+    def search(self, query: str, limit: int = 20) -> List[str]:
+        """Names containing the query (case-insensitive), prefix matches first"""
+        query = query.strip().lower()
+        if not query:
+            return []
+
+        with self._lock:
+            if len(query) <= GRAM_SIZE:
+                candidates = set(self._postings.get(query, ()))
+            else:
+                postings = sorted(
+                    (self._postings.get(query[i:i + GRAM_SIZE], set()) for i in range(len(query) - GRAM_SIZE + 1)),
+                    key=len
+                )
+                candidates = set(postings[0]).intersection(*postings[1:])
+                candidates = {name for name in candidates if query in name.lower()}
+
+        return heapq.nsmallest(limit, candidates, key=lambda name: (not name.lower().startswith(query), len(name), name))
@@ -0,0 +1,64 @@
+import subprocess
+from typing import Dict, NamedTuple, Optional, Tuple
+
+
+class PeerStat(NamedTuple):
+    """One peer line of `wg show <interface> dump`"""
+    public_key: str
+    endpoint: Optional[str]
+    allowed_ips: Tuple[str, ...]
+    latest_handshake: int  # unix time, 0 if never
+    rx: int
+    tx: int
+
+    @property
+    def address(self) -> Optional[str]:
+        """Client IPv4 address (without mask) from allowed ips"""
+        for network in self.allowed_ips:
+            ip = network.split('/')[0]
+            if '.' in ip:
+                return ip
+        return None
+
+    @property
+    def address6(self) -> Optional[str]:
+        for network in self.allowed_ips:
+            ip = network.split('/')[0]
+            if ':' in ip:
+                return ip
+        return None
+
+    @property
+    def transfer(self) -> int:
+        return self.rx + self.tx
+
+
+def parse_wg_dump(text: str) -> Dict[str, PeerStat]:
+    """Parse `wg show <interface> dump` output into peers keyed by public key"""
+    peers = {}
+    for line in text.splitlines():
+        fields = line.split('\t')
+        # The interface line has 4 fields, peer lines have 8
+        if len(fields) != 8:
+            continue
+        public_key, _psk, endpoint, allowed_ips, handshake, rx, tx, _keepalive = fields
+        try:
+            peers[public_key] = PeerStat(
+                public_key=public_key,
+                endpoint=None if endpoint == '(none)' else endpoint,
+                allowed_ips=tuple(ip for ip in allowed_ips.split(',') if ip and ip != '(none)'),
+                latest_handshake=int(handshake),
+                rx=int(rx),
+                tx=int(tx)
+            )
+        except ValueError:
+            continue
+    return peers
+
+
+def read_wg_dump(interface: str = 'wg0') -> Dict[str, PeerStat]:
+    """Read live peer stats of an interface; empty if it is down"""
+    result = subprocess.run(['wg', 'show', interface, 'dump'], capture_output=True, text=True)
+    if result.returncode != 0:
+        return {}
+    return parse_wg_dump(result.stdout)
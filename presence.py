@@ -0,0 +1,135 @@
+import json
+import logging
+import os
+import threading
+import time
+from pathlib import Path
+from typing import Dict, Iterable, List, Mapping, NamedTuple, Optional, Tuple
+
+from peer_stats import PeerStat
+
+logger = logging.getLogger(__name__)
+
+SUBSCRIPTIONS_PATH = Path("/etc/wireguard/presence.json")
+
+ONLINE, OFFLINE, ROAMED = 'online', 'offline', 'endpoint'
+
+
+class PresenceEvent(NamedTuple):
+    kind: str                      # ONLINE, OFFLINE or ROAMED
+    public_key: str
+    address: Optional[str]
+    at: float
+    endpoint: Optional[str] = None
+    previous_endpoint: Optional[str] = None
+
+
+class PeerState(NamedTuple):
+    online: bool
+    endpoint: Optional[str]
+    latest_handshake: int
+
+
+class PresenceWatcher:
+    """Turns successive `wg show dump` snapshots into connect / disconnect / roaming events.
+
+    Only the fields of each typed PeerStat are compared against the previous
+    state of that peer, so a poll costs O(peers) and emits nothing for peers
+    whose state did not change. The first snapshot only sets the baseline.
+    """
+
+    def __init__(self, stale_after: float = 300):
+        self.stale_after = stale_after
+        self._state: Dict[str, PeerState] = {}
+        self._primed = False
+
+    def diff(self, stats: Mapping[str, PeerStat], now: Optional[float] = None) -> List[PresenceEvent]:
+        now = now or time.time()
+        events = []
+        state = {}
+        for public_key, stat in stats.items():
+            online = bool(stat.latest_handshake) and now - stat.latest_handshake < self.stale_after
+            current = PeerState(online, stat.endpoint, stat.latest_handshake)
+            state[public_key] = current
+            previous = self._state.get(public_key)
+            if not self._primed:
+                continue
+            if previous is None or not previous.online:
+                if online:
+                    events.append(PresenceEvent(ONLINE, public_key, stat.address, now, stat.endpoint))
+            elif not online:
+                events.append(PresenceEvent(OFFLINE, public_key, stat.address, now, previous.endpoint))
+            elif stat.endpoint and previous.endpoint and stat.endpoint != previous.endpoint:
+                events.append(PresenceEvent(ROAMED, public_key, stat.address, now, stat.endpoint, previous.endpoint))
+        # Removed peers are forgotten: a re-added peer is reported when it connects again
+        self._state = state
+        self._primed = True
+        return events
+
+
+class RateLimiter:
+    """Token bucket: `rate` sends per second with bursts up to `burst`; acquire() waits for a token"""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            wait = 0.0 if self._tokens >= 1 else (1 - self._tokens) / self.rate
+            self._tokens -= 1
+        if wait:
+            time.sleep(wait)
+
+
+class Subscriptions:
+    """Admins subscribed to presence digests, each to all clients or to a set of names"""
+
+    def __init__(self, path: Path = SUBSCRIPTIONS_PATH):
+        self.path = path
+        self._subscribers: Dict[str, Optional[List[str]]] = {}
+        self._lock = threading.Lock()
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self._subscribers = json.load(f).get('subscribers', {})
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            logger.error(f"Error loading presence subscriptions: {e}")
+
+    def _save(self):
+        if not self.path.parent.exists():
+            return
+        tmp_path = self.path.with_name(self.path.name + '.tmp')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'subscribers': self._subscribers}, f)
+        os.replace(tmp_path, self.path)
+
+    def subscribe(self, chat_id: int, names: Optional[Iterable[str]] = None):
+        """Subscribe to every client, or only to `names`"""
+        with self._lock:
+            self._subscribers[str(chat_id)] = sorted(set(names)) if names else None
+            self._save()
+
+    def unsubscribe(self, chat_id: int):
+        with self._lock:
+            if self._subscribers.pop(str(chat_id), 0) != 0:
+                self._save()
+
+    def get(self, chat_id: int) -> Tuple[bool, Optional[List[str]]]:
+        with self._lock:
+            key = str(chat_id)
+            return key in self._subscribers, self._subscribers.get(key)
+
+    def items(self) -> List[Tuple[int, Optional[List[str]]]]:
+        with self._lock:
+            return [(int(chat_id), names) for chat_id, names in self._subscribers.items()]
+
+    def __bool__(self) -> bool:
+        return bool(self._subscribers)
@@ -0,0 +1,128 @@
+import re
+from datetime import datetime
+from typing import Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+from tags import parse_tags
+
+# Client fields a desired-state document may manage; fields left out of a client stay as they are
+FIELDS = ('address', 'profile', 'route', 'rate', 'access', 'enabled', 'expires', 'psk', 'tags')
+NAME_PATTERN = re.compile(r'^[a-zA-Z0-9_-]{1,50}$')  # as in bulk creation
+
+
+class Plan(NamedTuple):
+    """Minimal set of changes that brings the server to a desired state"""
+    create: List[Tuple[str, dict]]     # (name, fields)
+    delete: List[str]
+    recreate: List[Tuple[str, dict]]   # address changes: (name, all fields for the new client)
+    update: Dict[str, dict]            # name -> {field: new value}
+    unchanged: int
+
+    @property
+    def empty(self) -> bool:
+        return not (self.create or self.delete or self.recreate or self.update)
+
+
+def parse_expires(value) -> Optional[int]:
+    """Unix time, `YYYY-MM-DD` or `YYYY-MM-DDTHH:MM` (local time); null for no expiry"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, bool):
+        raise ValueError(f"Invalid expiry: {value}")
+    if isinstance(value, (int, float)):
+        return int(value)
+    try:
+        return int(datetime.fromisoformat(str(value).strip()).timestamp())
+    except ValueError:
+        raise ValueError(f"Invalid expiry: {value}")
+
+
+def parse_document(data) -> Tuple[Dict[str, dict], bool]:
+    """Parse a desired-state document into ({name: fields}, prune).
+
+    Clients are a list of objects with a `name` or an object keyed by name.
+    With `"prune": true` (the default) clients missing from the document are
+    deleted; with false the document only adds and updates.
+    """
+    if not isinstance(data, dict) or 'clients' not in data:
+        raise ValueError("Document must be an object with a \"clients\" field")
+    prune = data.get('prune', True)
+    if not isinstance(prune, bool):
+        raise ValueError("\"prune\" must be true or false")
+
+    entries = data['clients']
+    if isinstance(entries, dict):
+        entries = [dict(fields or {}, name=name) for name, fields in entries.items()]
+    if not isinstance(entries, list):
+        raise ValueError("\"clients\" must be a list or an object")
+
+    clients: Dict[str, dict] = {}
+    for i, entry in enumerate(entries, 1):
+        if not isinstance(entry, dict):
+            raise ValueError(f"Client #{i}: must be an object")
+        name = str(entry.get('name', ''))
+        if not NAME_PATTERN.match(name):
+            raise ValueError(f"Client #{i}: invalid name '{name}'")
+        if name in clients:
+            raise ValueError(f"Client {name}: listed twice")
+        unknown = set(entry) - set(FIELDS) - {'name'}
+        if unknown:
+            raise ValueError(f"Client {name}: unknown fields {', '.join(sorted(unknown))}")
+        fields = {key: entry[key] for key in FIELDS if key in entry}
+        for flag in ('enabled', 'psk'):
+            if flag in fields and not isinstance(fields[flag], bool):
+                raise ValueError(f"Client {name}: \"{flag}\" must be true or false")
+        if 'expires' in fields:
+            fields['expires'] = parse_expires(fields['expires'])
+        if 'tags' in fields:
+            tags = fields['tags'] or []
+            if isinstance(tags, str):
+                tags = [tags]
+            if not isinstance(tags, list) or not all(isinstance(tag, str) for tag in tags):
+                raise ValueError(f"Client {name}: \"tags\" must be a list of strings")
+            try:
+                fields['tags'] = parse_tags(' '.join(tags))
+            except ValueError as e:
+                raise ValueError(f"Client {name}: {e}")
+        clients[name] = fields
+    return clients, prune
+
+
+def compute_plan(desired: Mapping[str, dict], current: Mapping[str, dict], prune: bool = True) -> Plan:
+    """Diff desired clients against current ones in one pass over each.
+
+    Both map names to field dicts as in FIELDS; only fields present in the
+    desired entry are compared. An address change cannot be done in place
+    (the peer, its keys and its config all carry it), so it becomes a recreate.
+    A PSK is only ever added: `"psk": false` does not remove an existing one.
+    """
+    create, recreate, update = [], [], {}
+    unchanged = 0
+    for name, fields in desired.items():
+        live = current.get(name)
+        if live is None:
+            create.append((name, dict(fields)))
+            continue
+        if fields.get('address') and fields['address'] != live.get('address'):
+            recreate.append((name, dict(live, **fields)))
+            continue
+        changes = {
+            key: value for key, value in fields.items()
+            if key != 'address' and value != live.get(key) and not (key == 'psk' and not value)
+        }
+        if changes:
+            update[name] = changes
+        else:
+            unchanged += 1
+    delete = [name for name in current if name not in desired] if prune else []
+    return Plan(create, delete, recreate, update, unchanged)
+
+
+def find_conflicts(desired: Mapping[str, dict], current: Mapping[str, dict], prune: bool = True) -> Dict[str, List[str]]:
+    """Addresses that more than one client would hold once the plan is applied"""
+    holders: Dict[str, List[str]] = {}
+    kept = list(desired) + ([] if prune else [name for name in current if name not in desired])
+    for name in kept:
+        address = desired.get(name, {}).get('address') or current.get(name, {}).get('address')
+        if address:
+            holders.setdefault(address, []).append(name)
+    return {address: names for address, names in holders.items() if len(names) > 1}
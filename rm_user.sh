@@ -2,7 +2,7 @@
 
 ip_address=$1
 ip_address=$wg_local_ip_hint.$ip_address
-file_path="cofigs.txt"
+file_path="configs.txt"
 
 # Проверяем, передан ли IP-адрес в качестве аргумента
 if [ -z "$ip_address" ]; then
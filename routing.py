@@ -0,0 +1,109 @@
+import ipaddress
+from typing import Dict, Iterable, List, NamedTuple, Tuple
+
+# Names usable inside profiles instead of listing the ranges
+ALIASES: Dict[str, List[str]] = {
+    'all': ['0.0.0.0/0', '::/0'],
+    'rfc1918': ['10.0.0.0/8', '172.16.0.0/12', '192.168.0.0/16'],
+    'lan': ['10.0.0.0/8', '172.16.0.0/12', '192.168.0.0/16', '169.254.0.0/16', '100.64.0.0/10',
+            'fc00::/7', 'fe80::/10'],
+    'multicast': ['224.0.0.0/4', 'ff00::/8'],
+}
+
+# Always available: full tunnel (the add_cl.sh default) and everything except local networks
+BUILTIN_PROFILES = {
+    'full': 'all',
+    'nolan': 'all -lan -multicast',
+}
+
+Interval = Tuple[int, int]
+
+
+class RouteProfile(NamedTuple):
+    name: str
+    include: Tuple[str, ...]
+    exclude: Tuple[str, ...]
+    allowed_ips: Tuple[str, ...]
+
+    def allowed_ips_for(self, dual_stack: bool) -> List[str]:
+        """AllowedIPs of a client; v4-only clients do not route v6 ranges"""
+        return [network for network in self.allowed_ips if dual_stack or ':' not in network]
+
+
+def expand(tokens: Iterable[str]) -> List[str]:
+    networks = []
+    for token in tokens:
+        networks += ALIASES.get(token.lower(), [token])
+    return networks
+
+
+def _merge(intervals: List[Interval]) -> List[Interval]:
+    merged: List[Interval] = []
+    for start, end in sorted(intervals):
+        if merged and start <= merged[-1][1] + 1:
+            if end > merged[-1][1]:
+                merged[-1] = (merged[-1][0], end)
+        else:
+            merged.append((start, end))
+    return merged
+
+
+def _subtract(included: List[Interval], excluded: List[Interval]) -> List[Interval]:
+    """Sweep two sorted, merged interval lists in one pass"""
+    result = []
+    j = 0
+    for start, end in included:
+        while j < len(excluded) and excluded[j][1] < start:
+            j += 1
+        k = j
+        while k < len(excluded) and excluded[k][0] <= end:
+            ex_start, ex_end = excluded[k]
+            if ex_start > start:
+                result.append((start, ex_start - 1))
+            start = max(start, ex_end + 1)
+            k += 1
+        if start <= end:
+            result.append((start, end))
+    return result
+
+
+def compute_allowed_ips(include: Iterable[str], exclude: Iterable[str] = ()) -> List[str]:
+    """Minimal CIDR list covering `include` minus `exclude`, v4 first then v6.
+
+    Networks become integer intervals that are merged and subtracted with a
+    linear sweep; each remaining interval is split into the fewest CIDR blocks.
+    """
+    result = []
+    for version in (4, 6):
+        def intervals(networks):
+            parsed = (ipaddress.ip_network(network.strip(), strict=False) for network in networks)
+            return _merge([
+                (int(net.network_address), int(net.broadcast_address)) for net in parsed if net.version == version
+            ])
+
+        remaining = _subtract(intervals(include), intervals(exclude))
+        address_class = ipaddress.IPv4Address if version == 4 else ipaddress.IPv6Address
+        for start, end in remaining:
+            result += [str(net) for net in ipaddress.summarize_address_range(address_class(start), address_class(end))]
+    return result
+
+
+def parse_profile(name: str, spec: str) -> RouteProfile:
+    """Parse `all -lan` or `10.10.0.0/16 172.20.0.0/14`: a leading '-' excludes a range or alias"""
+    tokens = spec.replace(',', ' ').split()
+    include = tuple(expand(token for token in tokens if not token.startswith('-')))
+    exclude = tuple(expand(token[1:] for token in tokens if token.startswith('-')))
+    allowed_ips = compute_allowed_ips(include, exclude)
+    if not allowed_ips:
+        raise ValueError(f"Route profile {name} is empty")
+    return RouteProfile(name, include, exclude, tuple(allowed_ips))
+
+
+def parse_route_profiles(spec: str) -> Dict[str, RouteProfile]:
+    """Built-in profiles plus `name=ranges;name=ranges` from the environment"""
+    profiles = {name: parse_profile(name, value) for name, value in BUILTIN_PROFILES.items()}
+    for item in spec.split(';'):
+        name, sep, value = item.partition('=')
+        if sep and name.strip():
+            profiles[name.strip().lower()] = parse_profile(name.strip().lower(), value)
+    return profiles
@@ -0,0 +1,53 @@
+import logging
+import threading
+import time
+from typing import Callable, List
+
+logger = logging.getLogger(__name__)
+
+
+class PeriodicJob:
+    def __init__(self, name: str, interval: float, func: Callable, delay: float = 0):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.next_run = time.time() + delay
+
+
+class BackgroundScheduler:
+    """Runs periodic jobs one at a time in a single daemon thread"""
+
+    def __init__(self):
+        self.jobs: List[PeriodicJob] = []
+        self._wakeup = threading.Event()
+        self._stopped = False
+        self._thread = None
+
+    def every(self, interval: float, func: Callable, name: str = None, delay: float = 0):
+        """Run `func` every `interval` seconds, first after `delay` seconds"""
+        self.jobs.append(PeriodicJob(name or func.__name__, interval, func, delay))
+        self._wakeup.set()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='scheduler', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stopped = True
+        self._wakeup.set()
+
+    def _run(self):
+        while not self._stopped:
+            now = time.time()
+            for job in self.jobs:
+                if job.next_run <= now:
+                    try:
+                        job.func()
+                    except Exception as e:
+                        logger.error(f"Background job {job.name} failed: {e}")
+                    job.next_run = time.time() + job.interval
+
+            timeout = min((job.next_run for job in self.jobs), default=now + 60) - time.time()
+            self._wakeup.wait(max(timeout, 0.1))
+            self._wakeup.clear()
@@ -2,6 +2,9 @@
 
 var_username=$1
 specified_ip=$2
+pool_prefix=${3:-24}
+client_ip6=$4
+pool6_prefix=${5:-64}
 
 # Get script directory
 SCRIPT_DIR="$(cd "$(dirname "${BASH_SOURCE[0]}")" && pwd)"
@@ -36,65 +39,64 @@ else
     exit 1
 fi
 
-# Get external IP
-if [ -z "$ip_address_glob" ]; then
-    ip_address_glob=$(curl -s -4 ifconfig.me 2>/dev/null || echo "YOUR_SERVER_IP")
-fi
+# The external IP is no longer looked up here: the bot keeps it cached for the client configs
 
-# Use specified IP if provided, otherwise find next available
+# Use specified IP if provided (full address or last octet), otherwise find next available
 if [ -n "$specified_ip" ]; then
+    case "$specified_ip" in
+        *.*) client_ip="$specified_ip" ;;
+        *) client_ip="$wg_local_ip_hint.${specified_ip}" ;;
+    esac
     # Check if specified IP is already in use
-    if grep -q "AllowedIPs = $wg_local_ip_hint.${specified_ip}/32" /etc/wireguard/wg0.conf; then
-        echo "Error: IP $wg_local_ip_hint.${specified_ip} is already in use"
+    if grep -q "AllowedIPs = ${client_ip}/32" /etc/wireguard/wg0.conf; then
+        echo "Error: IP ${client_ip} is already in use"
         exit 1
     fi
-    vap_ip_local=$specified_ip
 else
     # Find next available IP (starting from 2, since 1 is server)
     next_ip=2
     while grep -q "AllowedIPs = $wg_local_ip_hint.${next_ip}/32" /etc/wireguard/wg0.conf; do
         ((next_ip++))
     done
-    vap_ip_local=$next_ip
+    client_ip="$wg_local_ip_hint.${next_ip}"
+fi
+vap_ip_local=${client_ip##*.}
+
+# Dual-stack: the paired IPv6 address is routed to the peer when provided
+peer_allowed_ips="${client_ip}/32"
+if [ -n "$client_ip6" ]; then
+    peer_allowed_ips="${peer_allowed_ips}, ${client_ip6}/128"
 fi
 
 # Запрос имени пользователя
 #read -p "Введите имя пользователя: " var_username
 
-wg genkey | tee "/etc/wireguard/${var_username}_privatekey" | wg pubkey | tee "/etc/wireguard/${var_username}_publickey" > /dev/null
+# The bot writes the client keys from its key pool before calling the script
+if [ "$WG_PREGENERATED_KEYS" = "1" ] && [ -s "/etc/wireguard/${var_username}_privatekey" ] && [ -s "/etc/wireguard/${var_username}_publickey" ]; then
+    echo "Using pre-generated keys"
+else
+    wg genkey | tee "/etc/wireguard/${var_username}_privatekey" | wg pubkey | tee "/etc/wireguard/${var_username}_publickey" > /dev/null
+fi
 echo "[Peer]" >> /etc/wireguard/wg0.conf
 echo "PublicKey = $(cat "/etc/wireguard/${var_username}_publickey")" >> /etc/wireguard/wg0.conf
-echo "AllowedIPs = $wg_local_ip_hint.${vap_ip_local}/32" >> /etc/wireguard/wg0.conf
+echo "AllowedIPs = ${peer_allowed_ips}" >> /etc/wireguard/wg0.conf
 
-# Remove existing client config if exists
-if [ -e "/etc/wireguard/${var_username}_cl.conf" ]; then
-  rm "/etc/wireguard/${var_username}_cl.conf"
-fi
+# The client configuration (${var_username}_cl.conf) is rendered by the bot from its profile
 
-# Create client configuration file
-echo "[Interface]
-PrivateKey = $(cat "/etc/wireguard/${var_username}_privatekey")
-Address = $wg_local_ip_hint.${vap_ip_local}/24
-DNS = 8.8.8.8
-MTU = 1332
-
-[Peer]
-PublicKey = ${var_public_key}
-Endpoint = ${ip_address_glob}:51830
-AllowedIPs = 0.0.0.0/0
-PersistentKeepalive = 20" > /etc/wireguard/${var_username}_cl.conf
-
-# Restart WireGuard interface only once
-echo "Restarting WireGuard interface..."
-if ! wg-quick down wg0 2>/dev/null; then
-    echo "WireGuard interface was not running"
-fi
+# The bot applies wg0.conf itself (wg syncconf, once per batch) when it sets WG_SKIP_RESTART
+if [ "$WG_SKIP_RESTART" != "1" ]; then
+    # Restart WireGuard interface only once
+    echo "Restarting WireGuard interface..."
+    if ! wg-quick down wg0 2>/dev/null; then
+        echo "WireGuard interface was not running"
+    fi
 
-if wg-quick up wg0; then
-    echo "WireGuard interface started successfully"
-else
-    echo "Failed to start WireGuard interface"
-    exit 1
+    if wg-quick up wg0; then
+        echo "WireGuard interface started successfully"
+    else
+        echo "Failed to start WireGuard interface"
+        exit 1
+    fi
 fi
 
 # Update variables in variables.sh file
@@ -107,7 +109,6 @@ fi
 if [ -f "$VARIABLES_FILE" ]; then
     # Update existing file
     grep -q "vap_ip_local=" "$VARIABLES_FILE" && sed -i "s/vap_ip_local=.*/vap_ip_local=${vap_ip_local}/" "$VARIABLES_FILE" || echo "vap_ip_local=${vap_ip_local}" >> "$VARIABLES_FILE"
-    grep -q "ip_address_glob=" "$VARIABLES_FILE" && sed -i "s/ip_address_glob=.*/ip_address_glob=${ip_address_glob}/" "$VARIABLES_FILE" || echo "ip_address_glob=${ip_address_glob}" >> "$VARIABLES_FILE"
 else
     # Create new file
     cat > "$VARIABLES_FILE" << EOF
@@ -119,7 +120,7 @@ var_public_key="${var_public_key}"
 EOF
 fi
 echo "Новый клиент ${var_username} добавлен."
-echo "$wg_local_ip_hint.${vap_ip_local} = ${var_username}" >> cofigs.txt
+echo "${client_ip} = ${var_username}" >> configs.txt
 
 exit 0
 
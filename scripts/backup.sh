@@ -21,9 +21,8 @@ zip -r "$BACKUP_FILE" "$SOURCE_DIR"
 # Переходим в директорию с исходными файлами перед добавлением дополнительных файлов
 cd "$SOURCE_DIR"
 
-# Добавляем файл cofigs.txt в архив без сохранения пути
-zip -j "$BACKUP_FILE" "$SCRIPT_DIR/../cofigs.txt"
+# Добавляем файл configs.txt в архив без сохранения пути
+zip -j "$BACKUP_FILE" "$SCRIPT_DIR/../configs.txt"
 
-wg-quick down wg0
-wg-quick up wg0
+# Архивирование не меняет конфигурацию: интерфейс не перезапускается, счётчики трафика и handshake сохраняются
 
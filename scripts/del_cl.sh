@@ -3,10 +3,16 @@
 ip=$1
 wg_local_ip_hint=${WG_LOCAL_IP_HINT:-"10.20.20"}
 
-my_variable=$(grep -n "AllowedIPs = $wg_local_ip_hint.${ip}/32" /etc/wireguard/wg0.conf | cut -d ':' -f 1)
+# Accept a full address or the last octet of the /24 hint
+case "$ip" in
+    *.*) client_ip="$ip" ;;
+    *) client_ip="$wg_local_ip_hint.${ip}" ;;
+esac
+
+my_variable=$(grep -n "AllowedIPs = ${client_ip}/32" /etc/wireguard/wg0.conf | cut -d ':' -f 1)
 
 if [ -z "$my_variable" ]; then
-    echo "Client IP $wg_local_ip_hint.${ip} not found"
+    echo "Client IP ${client_ip} not found"
     exit 1
 fi
 
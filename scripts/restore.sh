@@ -24,14 +24,19 @@ cd "$DESTINATION_DIR"
 # Распаковываем архив
 unzip -j "$BACKUP_FILE"
 
+# Старые архивы содержат список клиентов под именем cofigs.txt
+if [ -f "$DESTINATION_DIR/cofigs.txt" ] && [ ! -f "$DESTINATION_DIR/configs.txt" ]; then
+  mv "$DESTINATION_DIR/cofigs.txt" "$DESTINATION_DIR/configs.txt"
+fi
+
 # Проверка наличия распакованного файла
-if [ ! -f "$DESTINATION_DIR/cofigs.txt" ]; then
-  echo "Распакованный файл cofigs.txt не найден в директории $DESTINATION_DIR."
+if [ ! -f "$DESTINATION_DIR/configs.txt" ]; then
+  echo "Распакованный файл configs.txt не найден в директории $DESTINATION_DIR."
   exit 1
 fi
 
-# Перемещаем файл cofigs.txt
-mv cofigs.txt "$SCRIPT_DIR"/..
+# Перемещаем файл configs.txt
+mv configs.txt "$SCRIPT_DIR"/..
 
 wg-quick down wg0
 wg-quick up wg0
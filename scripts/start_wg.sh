@@ -1,16 +1,27 @@
 #!/bin/bash
 source variables.sh
 source scripts/env.sh
+# Server address and prefix come from the bot's address pool (WG_ADDRESS_POOL)
+wg_local_ip=${WG_SERVER_ADDRESS:-$wg_local_ip}
+wg_pool_prefix=${WG_POOL_PREFIX:-24}
+server_address="${wg_local_ip}/${wg_pool_prefix}"
+if [ -n "$WG_SERVER_ADDRESS6" ]; then
+  server_address="${server_address}, ${WG_SERVER_ADDRESS6}/${WG_POOL6_PREFIX:-64}"
+fi
 apt update
-apt install -y wireguard iptables fish zip unzip iproute2
+apt install -y wireguard iptables nftables fish zip unzip iproute2
 
-rm cofigs.txt
-touch cofigs.txt
+rm -f configs.txt
+touch configs.txt
 echo "vap_ip_local=1" > variables.sh
-ip_address_glob=$(curl -s -4 ifconfig.me)
+ip_address_glob=$(curl -s -4 --max-time 5 ifconfig.me)
 echo "ip_address_glob=$ip_address_glob" >> variables.sh
 
-internet_interface=$(ip a | awk '/^[0-9]+: .* state UP/ {gsub(/:/,"",$2); print $2}' | grep -E '^ens[0-9]+')
+# Interface of the default route, then the first ens* interface that is up
+internet_interface=${WG_WAN_INTERFACE:-$(ip -o route show default | awk '{for (i = 1; i < NF; i++) if ($i == "dev") {print $(i + 1); exit}}')}
+if [ -z "$internet_interface" ]; then
+  internet_interface=$(ip a | awk '/^[0-9]+: .* state UP/ {gsub(/:/,"",$2); print $2}' | grep -E '^ens[0-9]+' | head -n 1)
+fi
 if [ -z "$internet_interface" ]; then
   echo "Интерфейс с доступом в интернет не найден."
   internet_interface="eth0"
@@ -28,25 +39,35 @@ var_private_key=$(cat /etc/wireguard/privatekey)
 var_public_key=$(cat /etc/wireguard/publickey)
 echo "var_private_key=\"$var_private_key\"" >> variables.sh
 echo "var_public_key=\"$var_public_key\"" >> variables.sh
-echo "[Interface]
-PrivateKey = ${var_private_key}
-Address = ${wg_local_ip}/24
-ListenPort = 51830
-PostUp = iptables -I INPUT -p udp --dport 49990 -j ACCEPT
-PostUp = iptables -I FORWARD -i eth0 -o wg0 -j ACCEPT
+if [ "$WG_FIREWALL" = "nftables" ]; then
+  # The bot renders /etc/wireguard/wg_bot.nft (sets and verdict maps per client) and loads it atomically
+  firewall_rules="PostUp = test -f /etc/wireguard/wg_bot.nft && nft -f /etc/wireguard/wg_bot.nft || true
+PostDown = nft delete table inet wg_bot || true"
+else
+  firewall_rules="PostUp = iptables -I INPUT -p udp --dport 51830 -j ACCEPT
+PostUp = iptables -I FORWARD -i ${internet_interface} -o wg0 -j ACCEPT
 PostUp = iptables -I FORWARD -i wg0 -j ACCEPT
-PostUp = iptables -t nat -A POSTROUTING -o eth0 -j MASQUERADE
+PostUp = iptables -t nat -A POSTROUTING -o ${internet_interface} -j MASQUERADE
 PostUp = ip6tables -I FORWARD -i wg0 -j ACCEPT
-PostUp = ip6tables -t nat -A POSTROUTING -o eth0 -j MASQUERADE
-PostDown = iptables -D INPUT -p udp --dport 49990 -j ACCEPT
-PostDown = iptables -D FORWARD -i eth0 -o wg0 -j ACCEPT
+PostUp = ip6tables -t nat -A POSTROUTING -o ${internet_interface} -j MASQUERADE
+PostDown = iptables -D INPUT -p udp --dport 51830 -j ACCEPT
+PostDown = iptables -D FORWARD -i ${internet_interface} -o wg0 -j ACCEPT
 PostDown = iptables -D FORWARD -i wg0 -j ACCEPT
-PostDown = iptables -t nat -D POSTROUTING -o eth0 -j MASQUERADE
+PostDown = iptables -t nat -D POSTROUTING -o ${internet_interface} -j MASQUERADE
 PostDown = ip6tables -D FORWARD -i wg0 -j ACCEPT
-PostDown = ip6tables -t nat -D POSTROUTING -o eth0 -j MASQUERADE
+PostDown = ip6tables -t nat -D POSTROUTING -o ${internet_interface} -j MASQUERADE"
+fi
+echo "[Interface]
+PrivateKey = ${var_private_key}
+Address = ${server_address}
+ListenPort = 51830
+${firewall_rules}
 " | tee -a /etc/wireguard/wg0.conf
 
 echo "net.ipv4.ip_forward=1" >> /etc/sysctl.conf
+if [ -n "$WG_SERVER_ADDRESS6" ]; then
+  echo "net.ipv6.conf.all.forwarding=1" >> /etc/sysctl.conf
+fi
 sysctl -p
 
 # Вместо использования systemctl
@@ -0,0 +1,149 @@
+import ipaddress
+import re
+import subprocess
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+RATE_RE = re.compile(r'^(\d+(?:\.\d+)?)\s*([kmg]?)(?:bit|b)?$')
+RATE_UNITS = {'': 1, 'k': 1, 'm': 1000, 'g': 1000 * 1000}
+
+# Handle of the u32 hash table that buckets clients by the last byte of their address
+HASH_TABLE = 0x100
+DEFAULT_CLASS = 0xffff
+# HTB class minors left for clients (1..0xfffe)
+MAX_SHAPED_CLIENTS = DEFAULT_CLASS - 1
+
+
+class RateLimit(NamedTuple):
+    """Per-client limits in kbit/s; 0 means unlimited in that direction"""
+    down: int
+    up: int
+
+    def __str__(self) -> str:
+        return f"{format_rate(self.down)}/{format_rate(self.up)}"
+
+
+class ShapedClient(NamedTuple):
+    class_id: int  # minor of the HTB class, unique per client
+    address: str
+    address6: Optional[str]
+    limit: RateLimit
+
+
+def number_classes(limits: Iterable[Tuple[str, Optional[str], RateLimit]]) -> List[ShapedClient]:
+    """Give (address, address6, limit) entries dense class ids 1, 2, ... in order.
+
+    The tree is rebuilt from scratch on every change, so ids need not be
+    stable; numbering only the limited clients keeps any pool size within
+    the 16-bit class space. Raises ValueError past MAX_SHAPED_CLIENTS.
+    """
+    clients = [ShapedClient(class_id, *entry) for class_id, entry in enumerate(limits, 1)]
+    if len(clients) > MAX_SHAPED_CLIENTS:
+        raise ValueError(f"At most {MAX_SHAPED_CLIENTS} clients can be shaped, got {len(clients)}")
+    return clients
+
+
+def parse_rate(text: str) -> int:
+    """Parse `512k`, `10m`, `1g` or `10mbit` into kbit/s (a bare number is kbit/s)"""
+    match = RATE_RE.match(text.strip().lower())
+    if not match:
+        raise ValueError(f"Invalid rate: {text}")
+    return int(float(match.group(1)) * RATE_UNITS[match.group(2)])
+
+
+def parse_limit(text: str, profiles: Optional[Dict[str, RateLimit]] = None) -> RateLimit:
+    """Parse a profile name, `down/up` or a single rate for both directions"""
+    text = text.strip()
+    if profiles and text.lower() in profiles:
+        return profiles[text.lower()]
+    down, _, up = text.partition('/')
+    return RateLimit(parse_rate(down), parse_rate(up or down))
+
+
+def parse_profiles(spec: str) -> Dict[str, RateLimit]:
+    """Parse `basic=10m/2m,premium=100m/20m` into named limits"""
+    profiles = {}
+    for item in spec.split(','):
+        name, sep, value = item.partition('=')
+        if sep and name.strip():
+            profiles[name.strip().lower()] = parse_limit(value)
+    return profiles
+
+
+def format_rate(kbit: int) -> str:
+    if not kbit:
+        return "∞"
+    if kbit % 1000000 == 0:
+        return f"{kbit // 1000000}g"
+    if kbit % 1000 == 0:
+        return f"{kbit // 1000}m"
+    return f"{kbit}k"
+
+
+def _direction_commands(device: str, clients: List[ShapedClient], direction: str, link_rate: int) -> List[str]:
+    """HTB tree on one device: a class per client and hashed u32 filters on its address"""
+    # Egress of wg0 carries downloads (match destination), the ifb carries uploads (match source)
+    match, offset = ('dst', 16) if direction == 'down' else ('src', 12)
+    commands = [
+        f"qdisc add dev {device} root handle 1: htb default {DEFAULT_CLASS:x}",
+        f"class add dev {device} parent 1: classid 1:{DEFAULT_CLASS:x} htb rate {link_rate}kbit",
+        f"filter add dev {device} parent 1: prio 1 handle {HASH_TABLE:x}: protocol ip u32 divisor 256",
+        f"filter add dev {device} parent 1: prio 1 protocol ip u32 ht 800:: "
+        f"match ip {match} 0.0.0.0/0 hashkey mask 0x000000ff at {offset} link {HASH_TABLE:x}:",
+    ]
+    for client in clients:
+        rate = getattr(client.limit, direction)
+        if not rate:
+            continue
+        commands += [
+            f"class add dev {device} parent 1: classid 1:{client.class_id:x} htb rate {rate}kbit ceil {rate}kbit",
+            f"qdisc add dev {device} parent 1:{client.class_id:x} fq_codel",
+            f"filter add dev {device} parent 1: prio 1 protocol ip u32 "
+            f"ht {HASH_TABLE:x}:{int(ipaddress.ip_address(client.address)) & 0xff:x}: "
+            f"match ip {match} {client.address}/32 flowid 1:{client.class_id:x}",
+        ]
+        if client.address6:
+            commands.append(
+                f"filter add dev {device} parent 1: prio 2 protocol ipv6 u32 "
+                f"match ip6 {match} {client.address6}/128 flowid 1:{client.class_id:x}"
+            )
+    return commands
+
+
+def build_tc_batch(clients: Iterable[ShapedClient], interface: str = 'wg0', ifb: str = 'ifb0',
+                   link_rate: int = 1000000) -> str:
+    """Build the whole shaping setup as one `tc -batch` script.
+
+    Existing qdiscs are deleted first, so the script is idempotent and
+    reapplying it after an interface restart or a client change rebuilds
+    the tree from scratch. Filters hash on the last address byte, so
+    classification cost does not grow with the number of clients.
+    """
+    clients = list(clients)
+    commands = [
+        f"qdisc del dev {interface} root",
+        f"qdisc del dev {interface} ingress",
+        f"qdisc del dev {ifb} root",
+    ]
+    if not any(client.limit.down or client.limit.up for client in clients):
+        return "\n".join(commands) + "\n"
+
+    commands += _direction_commands(interface, clients, 'down', link_rate)
+    commands += [
+        f"qdisc add dev {interface} handle ffff: ingress",
+        f"filter add dev {interface} parent ffff: protocol all u32 match u32 0 0 "
+        f"action mirred egress redirect dev {ifb}",
+    ]
+    commands += _direction_commands(ifb, clients, 'up', link_rate)
+    return "\n".join(commands) + "\n"
+
+
+def apply_tc_batch(script: str, ifb: str = 'ifb0') -> Tuple[bool, str]:
+    """Run a batch script with a single tc process; -force keeps going past the idempotent deletes"""
+    subprocess.run(['ip', 'link', 'add', ifb, 'type', 'ifb'], capture_output=True, text=True)
+    subprocess.run(['ip', 'link', 'set', ifb, 'up'], capture_output=True, text=True)
+    result = subprocess.run(['tc', '-force', '-batch', '-'], input=script, capture_output=True, text=True)
+    # Deleting qdiscs that do not exist is expected on the first run, any other failed line is an error
+    lines = script.splitlines()
+    failed = [lines[int(n) - 1] for n in re.findall(r'Command failed -:(\d+)', result.stderr) if int(n) <= len(lines)]
+    errors = [line for line in failed if not line.startswith('qdisc del')]
+    return not errors, "\n".join(errors)
@@ -0,0 +1,70 @@
+import re
+import threading
+from collections import defaultdict
+from typing import Dict, Iterable, List, Set, Tuple
+
+TAG_PATTERN = re.compile(r'^[a-z0-9_-]{1,32}$')
+
+
+def parse_tags(text: str) -> List[str]:
+    """Split `team-a dev`, `team-a|dev` or `team-a,dev` into sorted unique tags"""
+    tags = {tag.lower() for tag in re.split(r'[\s|,;]+', text.strip()) if tag}
+    for tag in tags:
+        if not TAG_PATTERN.match(tag):
+            raise ValueError(f"Invalid tag: {tag}")
+    return sorted(tags)
+
+
+class TagIndex:
+    """Inverted index of client tags: tag -> client names, plus each client's own tags.
+
+    The tags themselves are stored with the client in the client store; this
+    only mirrors them so a group resolves without scanning every record.
+    """
+
+    def __init__(self, items: Iterable[Tuple[str, Iterable[str]]] = ()):
+        self._names: Dict[str, Set[str]] = defaultdict(set)
+        self._tags: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.load(items)
+
+    def load(self, items: Iterable[Tuple[str, Iterable[str]]]):
+        with self._lock:
+            self._names.clear()
+            self._tags.clear()
+        for name, tags in items:
+            self.set(name, tags)
+
+    def set(self, name: str, tags: Iterable[str]):
+        """Replace the tags of a client; no tags drops it from the index"""
+        tags = set(tags or ())
+        with self._lock:
+            for tag in self._tags.pop(name, set()) - tags:
+                posting = self._names.get(tag)
+                if posting is not None:
+                    posting.discard(name)
+                    if not posting:
+                        del self._names[tag]
+            if tags:
+                self._tags[name] = tags
+                for tag in tags:
+                    self._names[tag].add(name)
+
+    def remove(self, name: str):
+        self.set(name, ())
+
+    def names(self, tag: str) -> Set[str]:
+        with self._lock:
+            return set(self._names.get(tag, ()))
+
+    def tags_of(self, name: str) -> List[str]:
+        with self._lock:
+            return sorted(self._tags.get(name, ()))
+
+    def counts(self) -> Dict[str, int]:
+        with self._lock:
+            return {tag: len(names) for tag, names in sorted(self._names.items())}
+
+    def __contains__(self, tag: str) -> bool:
+        with self._lock:
+            return tag in self._names
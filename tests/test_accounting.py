@@ -0,0 +1,94 @@
+from datetime import date, datetime
+
+import pytest
+
+from accounting import DAYS_KEPT, TrafficLedger, parse_period
+
+TODAY = date(2026, 10, 19)
+
+
+def at(*args):
+    return datetime(*args).timestamp()
+
+
+@pytest.fixture
+def ledger(tmp_path):
+    return TrafficLedger(tmp_path / 'traffic.json')
+
+
+def test_first_sample_counts_the_current_counters(ledger):
+    assert ledger.sample({'a': (100, 50)}, now=at(2026, 10, 19, 12)) == {'a': (100, 50)}
+    assert ledger.totals('day', '2026-10-19..2026-10-19') == {'a': (100, 50)}
+    # An unknown span gives no rates
+    assert ledger.rates() == ({}, at(2026, 10, 19, 12))
+
+
+def test_growth_and_rates(ledger):
+    ledger.sample({'a': (100, 50)}, now=at(2026, 10, 19, 12))
+    assert ledger.sample({'a': (400, 50)}, now=at(2026, 10, 19, 12, 5)) == {'a': (300, 0)}
+    assert ledger.totals('day', '2026-10-19..2026-10-19') == {'a': (400, 50)}
+    assert ledger.rates()[0] == {'a': (1.0, 0.0)}
+
+
+def test_counter_reset_counts_the_whole_new_value(ledger):
+    ledger.sample({'a': (1000, 1000)}, now=at(2026, 10, 19, 12))
+    # The interface restarted: counters below the previous values are all new traffic
+    assert ledger.sample({'a': (30, 2000)}, now=at(2026, 10, 19, 12, 5)) == {'a': (30, 1000)}
+    assert ledger.totals('month', '2026-10') == {'a': (1030, 2000)}
+
+
+def test_removed_peers_start_from_zero_when_they_return(ledger):
+    ledger.sample({'a': (500, 500), 'b': (10, 10)}, now=at(2026, 10, 19, 12))
+    assert ledger.sample({'b': (20, 20)}, now=at(2026, 10, 19, 12, 5)) == {'b': (10, 10)}
+    assert ledger.sample({'a': (40, 0), 'b': (20, 20)}, now=at(2026, 10, 19, 12, 10)) == {'a': (40, 0), 'b': (0, 0)}
+    assert ledger.totals('day', '2026-10-19..2026-10-19') == {'a': (540, 500), 'b': (20, 20)}
+
+
+def test_day_and_month_buckets(ledger):
+    ledger.sample({'a': (100, 0)}, now=at(2026, 9, 30, 23, 55))
+    ledger.sample({'a': (300, 0)}, now=at(2026, 10, 1, 0, 5))
+    ledger.sample({'a': (600, 0)}, now=at(2026, 10, 2, 9))
+    assert ledger.totals('day', '2026-09-30..2026-09-30') == {'a': (100, 0)}
+    assert ledger.totals('day', '2026-10-01..2026-10-01') == {'a': (200, 0)}
+    assert ledger.totals('day', '2026-09-30..2026-10-02') == {'a': (600, 0)}
+    assert ledger.totals('month', '2026-09') == {'a': (100, 0)}
+    assert ledger.totals('month', '2026-10') == {'a': (500, 0)}
+    assert ledger.totals('month', '2026-11') == {}
+
+
+def test_old_days_are_dropped_but_months_kept(ledger):
+    ledger.sample({'a': (100, 0)}, now=at(2026, 1, 1, 12))
+    later = at(2026, 6, 1, 12)
+    assert (later - at(2026, 1, 1, 12)) / 86400 > DAYS_KEPT
+    ledger.sample({'a': (200, 0)}, now=later)
+    assert ledger.totals('day', '2026-01-01..2026-01-01') == {}
+    assert ledger.totals('month', '2026-01') == {'a': (100, 0)}
+
+
+def test_ledger_survives_a_restart(tmp_path):
+    ledger = TrafficLedger(tmp_path / 'traffic.json')
+    ledger.sample({'a': (100, 50)}, now=at(2026, 10, 19, 12))
+    ledger.save()
+    restarted = TrafficLedger(tmp_path / 'traffic.json')
+    assert restarted.sample({'a': (150, 50)}, now=at(2026, 10, 19, 12, 5)) == {'a': (50, 0)}
+    assert restarted.totals('day', '2026-10-19..2026-10-19') == {'a': (150, 50)}
+
+
+@pytest.mark.parametrize('text, period', [
+    ('', ('day', '2026-10-19..2026-10-19')),
+    ('today', ('day', '2026-10-19..2026-10-19')),
+    ('7d', ('day', '2026-10-13..2026-10-19')),
+    ('1d', ('day', '2026-10-19..2026-10-19')),
+    ('month', ('day', '2026-10-01..2026-10-19')),
+    ('2026-09', ('month', '2026-09')),
+    ('2026-10-05', ('day', '2026-10-05..2026-10-05')),
+    ('2026-10-01..2026-10-15', ('day', '2026-10-01..2026-10-15')),
+])
+def test_parse_period(text, period):
+    assert parse_period(text, today=TODAY) == period
+
+
+@pytest.mark.parametrize('text', ['0d', 'week', '2026-10-15..2026-10-01', '2026-13-01', '2026/10', '7 d'])
+def test_parse_period_rejects(text):
+    with pytest.raises(ValueError):
+        parse_period(text, today=TODAY)
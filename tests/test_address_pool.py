@@ -0,0 +1,95 @@
+import pytest
+
+from address_pool import AddressPool, AddressPoolError
+
+
+def test_allocates_after_server_address():
+    pool = AddressPool('10.8.0.0/24')
+    assert pool.server_address == '10.8.0.1'
+    assert pool.allocate('a') == '10.8.0.2'
+    assert pool.allocate('b') == '10.8.0.3'
+    assert pool.free_count == 253 - 2
+
+
+def test_network_is_normalized_and_validated():
+    assert str(AddressPool('10.8.0.77/24').network) == '10.8.0.0/24'
+    with pytest.raises(AddressPoolError):
+        AddressPool('fd00::/64')
+    with pytest.raises(AddressPoolError):
+        AddressPool('10.8.0.0/31')
+
+
+def test_larger_network_spans_octets():
+    pool = AddressPool('10.8.0.0/23')
+    assert pool.assign('edge', '10.8.1.254') == '10.8.1.254'
+    with pytest.raises(AddressPoolError):
+        pool.assign('broadcast', '10.8.1.255')
+    assert pool.capacity == 510 - 1
+
+
+def test_octet_shorthand_only_for_slash_24():
+    assert AddressPool('10.8.0.0/24').parse_address('5') == '10.8.0.5'
+    with pytest.raises(AddressPoolError):
+        AddressPool('10.8.0.0/16').parse_address('5')
+
+
+def test_rejects_reserved_and_outside_addresses():
+    pool = AddressPool('10.8.0.0/24')
+    for address in ('10.8.0.0', '10.8.0.1', '10.8.0.255', '10.9.0.2', 'nope'):
+        with pytest.raises(AddressPoolError):
+            pool.assign('x', address)
+
+
+def test_assign_conflicts():
+    pool = AddressPool('10.8.0.0/24')
+    pool.assign('a', '10.8.0.10')
+    with pytest.raises(AddressPoolError):
+        pool.assign('b', '10.8.0.10')
+    with pytest.raises(AddressPoolError):
+        pool.assign('a', '10.8.0.11')
+    with pytest.raises(AddressPoolError):
+        pool.allocate('a')
+
+
+def test_release_and_reuse():
+    pool = AddressPool('10.8.0.0/24')
+    for name in 'abc':
+        pool.allocate(name)
+    assert pool.release('10.8.0.3') == 'b'
+    assert pool.release('10.8.0.3') is None
+    assert pool.lookup('10.8.0.3') is None
+    assert pool.allocate('d') == '10.8.0.3'
+    assert pool.allocate('e') == '10.8.0.5'
+
+
+def test_exhaustion():
+    pool = AddressPool('10.8.0.0/30')
+    assert pool.allocate('a') == '10.8.0.2'
+    with pytest.raises(AddressPoolError):
+        pool.allocate('b')
+
+
+def test_membership_is_by_client_name():
+    pool = AddressPool('10.8.0.0/24')
+    pool.allocate('phone')
+    assert 'phone' in pool
+    assert 'laptop' not in pool
+    assert '10.8.0.2' not in pool
+    assert pool.lookup('10.8.0.2') == 'phone'
+    assert pool.address_of('phone') == '10.8.0.2'
+
+
+def test_paired_ipv6():
+    pool = AddressPool('10.8.0.0/24', network6='fd00:8::/112')
+    pool.allocate('a')
+    assert pool.address6_of('10.8.0.2') == 'fd00:8::2'
+    assert pool.parse_address('fd00:8::2') == '10.8.0.2'
+    assert pool.lookup('fd00:8::2') == 'a'
+
+
+def test_free_addresses_skips_used():
+    pool = AddressPool('10.8.0.0/24')
+    pool.assign('a', '10.8.0.3')
+    free = pool.free_addresses()
+    assert [next(free), next(free)] == ['10.8.0.2', '10.8.0.4']
+    assert next(pool.free_addresses(start=1)) == '10.8.0.4'
@@ -0,0 +1,176 @@
+import json
+import logging
+import shutil
+import ssl
+import subprocess
+import threading
+import time
+import urllib.error
+import urllib.request
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+from agent import (MAX_SKEW, REPLY, AgentClient, AgentError, AgentServer, NonceCache, dispatch, parse_agents,
+                   sign)
+
+SECRET = 'secret'
+NONCE = 'ab' * 16
+
+
+class Service:
+    def rpc_info(self):
+        return {'peers': 3}
+
+    def rpc_delete_client(self, name):
+        return f"deleted {name}"
+
+    def rpc_shutdown(self):
+        raise AssertionError("not exposed")
+
+
+@pytest.fixture
+def server():
+    server = AgentServer(('127.0.0.1', 0), Service(), SECRET)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def url_of(server, scheme='http'):
+    return f"{scheme}://127.0.0.1:{server.server_address[1]}"
+
+
+def post(server, body, timestamp, nonce, signature):
+    request = urllib.request.Request(url_of(server) + '/rpc', data=body, method='POST', headers={
+        'X-Agent-Timestamp': timestamp, 'X-Agent-Nonce': nonce, 'X-Agent-Signature': signature,
+    })
+    with urllib.request.urlopen(request, timeout=5) as response:
+        return response.status
+
+
+def test_sign_covers_every_part():
+    base = sign(SECRET, '100', NONCE, b'{}')
+    assert base == sign(SECRET, '100', NONCE, b'{}')
+    assert len({base, sign('other', '100', NONCE, b'{}'), sign(SECRET, '101', NONCE, b'{}'),
+                sign(SECRET, '100', 'cd' * 16, b'{}'), sign(SECRET, '100', NONCE, b'[]'),
+                sign(SECRET, REPLY, NONCE, b'{}')}) == 6
+
+
+def test_dispatch_allows_only_listed_methods():
+    assert dispatch(Service(), 'info', {}) == {'peers': 3}
+    assert dispatch(Service(), 'delete_client', {'name': 'a'}) == 'deleted a'
+    for method in ('shutdown', '__init__', ''):
+        with pytest.raises(AgentError):
+            dispatch(Service(), method, {})
+
+
+def test_parse_agents(caplog):
+    with caplog.at_level(logging.WARNING):
+        agents = parse_agents('msk=https://10.0.0.2:8790/, ,http://127.0.0.1:8791,ams = http://10.0.0.3:8790', SECRET)
+    assert [(agent.name, agent.url) for agent in agents] == [
+        ('msk', 'https://10.0.0.2:8790/rpc'),
+        ('http://127.0.0.1:8791', 'http://127.0.0.1:8791/rpc'),
+        ('ams', 'http://10.0.0.3:8790/rpc'),
+    ]
+    assert all(agent.secret == SECRET and agent.context is agents[0].context for agent in agents)
+    # Only the plain-HTTP agent outside loopback is worth a warning
+    assert [record.getMessage() for record in caplog.records] == [
+        "Agent ams is reached over plain HTTP: use https:// or a tunnel"
+    ]
+
+
+def test_nonce_cache_forgets_expired_nonces():
+    cache = NonceCache()
+    assert cache.add('a', expires=110, now=100)
+    assert not cache.add('a', expires=120, now=105)
+    assert cache.add('b', expires=200, now=105)
+    assert cache.add('a', expires=220, now=111)
+    assert len(cache) == 2
+
+
+def test_authenticate_rejects_skew_and_bad_signatures(server):
+    now = 1_800_000_000
+    body = b'{"method": "info"}'
+
+    def check(timestamp, nonce, signature=None, at=now):
+        return server.authenticate(timestamp, nonce, body, signature or sign(SECRET, timestamp, nonce, body), now=at)
+
+    assert not check(str(now - MAX_SKEW - 1), 'a' * 32)
+    assert not check(str(now + MAX_SKEW + 1), 'b' * 32)
+    assert not check('soon', 'c' * 32)
+    assert not check(str(now), 'short')
+    assert not check(str(now), 'd' * 32, signature=sign('other', str(now), 'd' * 32, body))
+    # Rejected requests do not use up their nonce
+    assert check(str(now), 'd' * 32)
+    assert check(str(now - MAX_SKEW), 'e' * 32)
+
+
+def test_authenticate_rejects_replays(server):
+    now = 1_800_000_000
+    body = b'{"method": "delete_client", "params": {"name": "a"}}'
+    signature = sign(SECRET, str(now), NONCE, body)
+    assert server.authenticate(str(now), NONCE, body, signature, now=now)
+    assert not server.authenticate(str(now), NONCE, body, signature, now=now + MAX_SKEW)
+
+
+def test_signed_round_trip_and_replay_over_http(server):
+    client = AgentClient('node', url_of(server), SECRET)
+    assert client.call('info') == {'peers': 3}
+    with pytest.raises(AgentError, match='Unknown method'):
+        client.call('shutdown')
+    with pytest.raises(AgentError, match='HTTP 401'):
+        AgentClient('node', url_of(server), 'wrong').call('info')
+
+    body = json.dumps({'method': 'delete_client', 'params': {'name': 'a'}}).encode()
+    timestamp = str(int(time.time()))
+    signature = sign(SECRET, timestamp, NONCE, body)
+    assert post(server, body, timestamp, NONCE, signature) == 200
+    with pytest.raises(urllib.error.HTTPError) as error:
+        post(server, body, timestamp, NONCE, signature)
+    assert error.value.code == 401
+
+
+def test_unsigned_replies_are_rejected():
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers['Content-Length']))
+            data = b'{"ok": true, "result": "forged"}'
+            self.send_response(200)
+            self.send_header('Content-Length', str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, format, *args):
+            pass
+
+    fake = HTTPServer(('127.0.0.1', 0), Handler)
+    threading.Thread(target=fake.serve_forever, daemon=True).start()
+    try:
+        with pytest.raises(AgentError, match='signature mismatch'):
+            AgentClient('node', url_of(fake), SECRET).call('info')
+    finally:
+        fake.shutdown()
+        fake.server_close()
+
+
+@pytest.mark.skipif(not shutil.which('openssl'), reason='openssl is not installed')
+def test_tls_agent(tmp_path):
+    cert, key = tmp_path / 'cert.pem', tmp_path / 'key.pem'
+    subprocess.run(['openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-days', '1', '-subj', '/CN=127.0.0.1',
+                    '-addext', 'subjectAltName=IP:127.0.0.1', '-keyout', str(key), '-out', str(cert)],
+                   check=True, capture_output=True)
+    tls = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    tls.load_cert_chain(str(cert), str(key))
+    server = AgentServer(('127.0.0.1', 0), Service(), SECRET, tls)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    try:
+        agent, = parse_agents(f"tls={url_of(server, 'https')}", SECRET, str(cert))
+        assert agent.call('info') == {'peers': 3}
+        with pytest.raises(AgentError):
+            parse_agents(f"tls={url_of(server, 'https')}", SECRET)[0].call('info')
+    finally:
+        server.shutdown()
+        server.server_close()
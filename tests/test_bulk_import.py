@@ -0,0 +1,46 @@
+import io
+
+import pytest
+
+from bulk_import import ImportRow, iter_import_rows
+from tags import parse_tags
+
+
+def rows(text):
+    return list(iter_import_rows(io.StringIO(text, newline='')))
+
+
+def test_csv_with_header():
+    result = rows("# clients\nname,tags,address\nphone,team-a|dev,10.8.0.5\n\nlaptop,,\n")
+    assert result == [
+        ImportRow(3, 'phone', {'tags': 'team-a|dev', 'address': '10.8.0.5'}),
+        ImportRow(5, 'laptop', {}),
+    ]
+
+
+def test_positional_csv_with_other_delimiters():
+    assert rows("phone;10.8.0.5;mobile\n") == [ImportRow(1, 'phone', {'address': '10.8.0.5', 'profile': 'mobile'})]
+    assert rows("tv\t\tfull\n")[0].values == {'profile': 'full'}
+
+
+def test_quoted_csv_cells():
+    assert rows('name,tags\n"phone","a, b"\n')[0].values == {'tags': 'a, b'}
+
+
+def test_txt_rows_keep_fields_and_directives():
+    result = rows("@ profile=mobile\nphone:10.8.0.5:30d\n# skip\nlaptop\n")
+    assert result == [
+        ImportRow(1, '@ profile=mobile', {}, []),
+        ImportRow(2, 'phone', {}, ['10.8.0.5', '30d']),
+        ImportRow(4, 'laptop', {}, []),
+    ]
+
+
+def test_empty_file():
+    assert rows("\n# nothing\n") == []
+
+
+def test_parse_tags():
+    assert parse_tags("Team-A dev|team-a, phone;") == ['dev', 'phone', 'team-a']
+    with pytest.raises(ValueError):
+        parse_tags("ok bad!")
@@ -0,0 +1,33 @@
+import io
+
+import pytest
+
+Image = pytest.importorskip('PIL.Image')
+
+from charts import downsample_minmax, render_activity_heatmap, render_throughput_chart  # noqa: E402
+
+
+def test_minmax_keeps_peaks_that_averaging_would_flatten():
+    # 1000 samples per column with a single spike and a single dip
+    points = [(t, 10.0) for t in range(4000)]
+    points[1500] = (1500, 900.0)
+    points[2500] = (2500, 0.0)
+    columns = downsample_minmax(points, 0, 4000, 4)
+    assert columns == [(10.0, 10.0), (10.0, 900.0), (0.0, 10.0), (10.0, 10.0)]
+
+
+def test_gaps_and_points_outside_the_window():
+    columns = downsample_minmax([(-5, 99.0), (0, 1.0), (9, 2.0), (10, 3.0), (11, 99.0)], 0, 10, 5)
+    # The window end falls into the last column, the middle has no data
+    assert columns == [(1.0, 1.0), None, None, None, (2.0, 3.0)]
+    assert downsample_minmax([], 0, 10, 3) == [None, None, None]
+
+
+def test_charts_render_to_png():
+    now = 1_800_000_000
+    png = render_throughput_chart([(now - 3600, 100.0), (now - 60, 5000.0)], 86400, now=now, title='t')
+    image = Image.open(io.BytesIO(png))
+    assert image.format == 'PNG' and image.size == (800, 300)
+
+    png = render_activity_heatmap({'a': [now // 3600], 'b': []}, 24, now=now, cell=5)
+    assert Image.open(io.BytesIO(png)).format == 'PNG'
@@ -0,0 +1,63 @@
+import stat
+
+import pytest
+
+from client_config import ConfigProfile, parse_config_profiles, read_key, render_client_config, write_if_changed
+
+DEFAULT = ConfigProfile('default')
+
+
+def test_render_matches_the_add_cl_layout():
+    text = render_client_config('PRIV', ['10.8.0.2/24', 'fd00::2/64'], 'SERVER', '203.0.113.7:51830',
+                                ['0.0.0.0/0', '::/0'], DEFAULT)
+    assert text == (
+        "[Interface]\n"
+        "PrivateKey = PRIV\n"
+        "Address = 10.8.0.2/24, fd00::2/64\n"
+        "DNS = 8.8.8.8\n"
+        "MTU = 1332\n"
+        "\n"
+        "[Peer]\n"
+        "PublicKey = SERVER\n"
+        "Endpoint = 203.0.113.7:51830\n"
+        "AllowedIPs = 0.0.0.0/0, ::/0\n"
+        "PersistentKeepalive = 20\n"
+    )
+
+
+def test_render_with_psk_and_empty_profile_fields():
+    profile = DEFAULT._replace(dns='', mtu=0, keepalive=0)
+    lines = render_client_config('PRIV', ['10.8.0.2/24'], 'SERVER', 'vpn:51830', ['10.10.0.0/16'], profile,
+                                 preshared_key='PSK').splitlines()
+    assert "PresharedKey = PSK" in lines
+    assert lines.index("PublicKey = SERVER") < lines.index("PresharedKey = PSK") < lines.index("Endpoint = vpn:51830")
+    assert not any(line.startswith(("DNS", "MTU", "PersistentKeepalive")) for line in lines)
+
+
+def test_parse_profiles():
+    profiles = parse_config_profiles(
+        "Mobile:dns=1.1.1.1 1.0.0.1,mtu=1280,keepalive=25;office:endpoint=vpn.example.com:443,route=corp;broken", DEFAULT)
+    assert set(profiles) == {'default', 'mobile', 'office'}
+    assert profiles['mobile'] == ConfigProfile('mobile', '1.1.1.1, 1.0.0.1', 1280, 25)
+    assert profiles['office'] == ConfigProfile('office', endpoint='vpn.example.com:443', route='corp')
+    with pytest.raises(ValueError):
+        parse_config_profiles("x:colour=red", DEFAULT)
+    with pytest.raises(ValueError):
+        parse_config_profiles("x:mtu=big", DEFAULT)
+
+
+def test_write_if_changed(tmp_path):
+    path = tmp_path / 'a_cl.conf'
+    assert write_if_changed(path, "one\n")
+    assert stat.S_IMODE(path.stat().st_mode) == 0o600
+    assert not write_if_changed(path, "one\n")
+    assert write_if_changed(path, "two\n")
+    assert path.read_text() == "two\n"
+
+
+def test_read_key(tmp_path):
+    (tmp_path / 'key').write_text("KEY\n")
+    (tmp_path / 'empty').write_text("\n")
+    assert read_key(tmp_path / 'key') == "KEY"
+    assert read_key(tmp_path / 'empty') is None
+    assert read_key(tmp_path / 'missing') is None
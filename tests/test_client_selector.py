@@ -0,0 +1,90 @@
+import pytest
+
+from address_pool import AddressPool
+from client_selector import (ADDRESS, ALL, GLOB, IDLE, NAME, NEVER, RANGE, REGEX, TAG, Candidate, parse_selectors,
+                             required_facts, select)
+
+NOW = 1_800_000_000
+DAY = 86400
+POOL = AddressPool('10.8.0.0/24')
+
+CLIENTS = [
+    Candidate('test-1', '10.8.0.2', (), NOW, NOW),
+    Candidate('tmp5', '10.8.0.3', (), NOW, NOW),
+    Candidate('guest', '10.8.0.20', ('guests',), NOW - 40 * DAY, NOW - 90 * DAY),
+    Candidate('guest2', '10.8.0.21', ('guests',), NOW - DAY, NOW - 90 * DAY),
+    Candidate('new', '10.8.0.30', (), 0, NOW - DAY),
+    Candidate('alice', '10.8.0.40', (), NOW, NOW),
+]
+
+
+def parse(text):
+    selectors, errors = parse_selectors(text, POOL.parse_address)
+    assert errors == []
+    return selectors
+
+
+def kinds(text):
+    return [[term.kind for term in selector.terms] for selector in parse(text)]
+
+
+def test_term_kinds():
+    text = "all\ntest-*\nre:^tmp\\d+$\n/^x/\n10-40\ntag:guests\nidle > 30d\nnever\nalice\n10.8.0.5\n7"
+    assert kinds(text) == [[ALL], [GLOB], [REGEX], [REGEX], [RANGE], [TAG], [IDLE], [NEVER], [NAME], [ADDRESS], [ADDRESS]]
+    assert kinds("tag:guests & idle>12h") == [[TAG, IDLE]]
+
+
+def test_idle_durations():
+    assert [selector.terms[0].value for selector in parse("idle>12h\nidle 30\nidle > 2w")] == [12 * 3600, 30 * DAY, 14 * DAY]
+
+
+@pytest.mark.parametrize('text', ['re:(', 'tag:Bad!', '10.9.0.1', '10.8.0.2-300'])
+def test_parse_errors_name_the_line(text):
+    selectors, errors = parse_selectors("# header\n" + text, POOL.parse_address)
+    assert selectors == []
+    assert len(errors) == 1 and errors[0].startswith("Строка 2:")
+
+
+def test_select_each_kind():
+    cases = {
+        'test-*': {'test-1'},
+        're:^tmp\\d+$': {'tmp5'},
+        '2-21': {'test-1', 'tmp5', 'guest', 'guest2'},
+        '21-10': {'guest', 'guest2'},
+        '10.8.0.30-10.8.0.40': {'new', 'alice'},
+        'tag:guests': {'guest', 'guest2'},
+        'idle > 30d': {'guest'},
+        'never': {'new'},
+        'tag:guests & idle > 7d': {'guest'},
+        'all': {client.name for client in CLIENTS},
+    }
+    for text, expected in cases.items():
+        selected, counts = select(parse(text), CLIENTS, now=NOW)
+        assert set(selected) == expected, text
+        assert counts == {1: len(expected)}
+
+
+def test_lines_are_a_union_with_counts_per_line():
+    selected, counts = select(parse("alice\n30\nnobody\ntag:guests"), CLIENTS, now=NOW)
+    assert selected == {'alice': '10.8.0.40', 'new': '10.8.0.30', 'guest': '10.8.0.20', 'guest2': '10.8.0.21'}
+    assert counts == {1: 1, 2: 1, 3: 0, 4: 2}
+
+
+def test_repeated_names_and_addresses_count_on_every_line():
+    selected, counts = select(parse("alice\nalice\n10.8.0.40\n40"), CLIENTS, now=NOW)
+    assert selected == {'alice': '10.8.0.40'}
+    assert counts == {1: 1, 2: 1, 3: 1, 4: 1}
+
+
+def test_lone_tags_use_the_index():
+    index = {'guests': {'guest'}}
+    selected, counts = select(parse("tag:guests\ntag:guests"), CLIENTS, now=NOW, tagged=lambda tag: index.get(tag, set()))
+    # The index wins over the candidates' own tags for lone tag selectors
+    assert selected == {'guest': '10.8.0.20'}
+    assert counts == {1: 1, 2: 1}
+
+
+def test_required_facts():
+    assert required_facts(parse("alice\ntest-*")) == set()
+    assert required_facts(parse("tag:x")) == {'tags'}
+    assert required_facts(parse("never\ntag:x & idle>1d")) == {'tags', 'activity'}
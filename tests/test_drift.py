@@ -0,0 +1,85 @@
+import wg_keys
+from drift import (DUPLICATE_ADDRESS, KEY_PAIR, LISTING, MISSING_KEYS, MISSING_PEER, NOT_APPLIED, ORPHAN_PEER,
+                   PEER_KEY, Sources, detect_drift, parse_listing)
+from peer_stats import PeerStat
+
+
+def sources(**overrides):
+    base = dict(
+        clients={'a': '10.8.0.2', 'b': '10.8.0.3'},
+        peers=[('A', '10.8.0.2'), ('B', '10.8.0.3')],
+        public_keys={'a': 'A', 'b': 'B'},
+        derived_keys={'a': 'A', 'b': 'B'},
+        live=None,
+        listing=None,
+        disabled=set(),
+    )
+    base.update(overrides)
+    return Sources(**base)
+
+
+def kinds(issues):
+    return sorted(((issue.kind, issue.name, issue.address) for issue in issues), key=str)
+
+
+def test_consistent_sources():
+    assert detect_drift(sources()) == []
+
+
+def test_peer_issues():
+    issues = detect_drift(sources(peers=[('X', '10.8.0.3'), ('Z', '10.8.0.9')]))
+    assert kinds(issues) == [
+        (MISSING_PEER, 'a', '10.8.0.2'),
+        (ORPHAN_PEER, None, '10.8.0.9'),
+        (PEER_KEY, 'b', '10.8.0.3'),
+    ]
+
+
+def test_disabled_clients_need_no_peer():
+    assert detect_drift(sources(peers=[('B', '10.8.0.3')], disabled={'a'})) == []
+
+
+def test_key_issues():
+    issues = detect_drift(sources(public_keys={'a': 'A'}))
+    assert kinds(issues) == [(MISSING_KEYS, 'b', '10.8.0.3')]
+    issues = detect_drift(sources(derived_keys={'a': 'A', 'b': 'other'}, peers=[('A', '10.8.0.2'), ('other', '10.8.0.3')]))
+    assert kinds(issues) == [(KEY_PAIR, 'b', '10.8.0.3')]
+
+
+def test_duplicates():
+    issues = detect_drift(sources(clients={'a': '10.8.0.2', 'b': '10.8.0.2'}, peers=[('A', '10.8.0.2'), ('B', '10.8.0.2')]))
+    assert (DUPLICATE_ADDRESS, 'a, b', '10.8.0.2') in kinds(issues)
+    assert (DUPLICATE_ADDRESS, None, '10.8.0.2') in kinds(issues)
+
+
+def test_live_interface_differences():
+    live = {
+        'A': PeerStat('A', None, ('10.8.0.2/32',), 0, 0, 0),
+        'C': PeerStat('C', None, ('10.8.0.7/32',), 0, 0, 0),
+    }
+    issues = detect_drift(sources(live=live))
+    assert kinds(issues) == [(NOT_APPLIED, None, '10.8.0.3'), (NOT_APPLIED, None, '10.8.0.7')]
+
+
+def test_listing():
+    listing = parse_listing("Clients:\n  a: 10.8.0.2, fd00::2\n10.8.0.9 = ghost\n")
+    assert listing == {'a': '10.8.0.2', 'ghost': '10.8.0.9'}
+    issues = detect_drift(sources(listing=listing))
+    assert kinds(issues) == [(LISTING, 'b', '10.8.0.3'), (LISTING, 'ghost', '10.8.0.9')]
+
+
+def test_derived_keys_are_cached_per_file(tmp_path, monkeypatch):
+    calls = []
+    monkeypatch.setattr(wg_keys, 'public_key_of', lambda key: calls.append(key) or f"pub-{key}")
+    (tmp_path / 'a').write_text('A\n')
+    (tmp_path / 'b').write_text('B\n')
+    paths = {'a': tmp_path / 'a', 'b': tmp_path / 'b', 'gone': tmp_path / 'gone'}
+    cache = wg_keys.DerivedKeyCache()
+
+    assert cache.derive(paths) == {'a': 'pub-A', 'b': 'pub-B'}
+    assert cache.derive(paths) == {'a': 'pub-A', 'b': 'pub-B'}
+    assert calls == ['A', 'B']
+
+    (tmp_path / 'b').write_text('BB\n')
+    assert cache.derive(paths)['b'] == 'pub-BB'
+    assert calls == ['A', 'B', 'BB']
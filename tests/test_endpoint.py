@@ -0,0 +1,65 @@
+import io
+import json
+
+import endpoint
+from endpoint import EndpointCache, discover_public_address, format_endpoint, parse_address
+
+
+def fake_urlopen(replies):
+    def urlopen(url, timeout=None):
+        reply = replies[url]
+        if isinstance(reply, Exception):
+            raise reply
+        return io.BytesIO(reply)
+    return urlopen
+
+
+def test_parse_address():
+    assert parse_address(" 203.0.113.7\n") == "203.0.113.7"
+    assert parse_address("2001:DB8:0::1\n") == "2001:db8::1"
+    assert parse_address("<html><body>Login") is None
+    assert parse_address("") is None
+
+
+def test_format_endpoint():
+    assert format_endpoint("203.0.113.7", 51830) == "203.0.113.7:51830"
+    assert format_endpoint("203.0.113.7:443", 51830) == "203.0.113.7:443"
+    assert format_endpoint("vpn.example.com", 51830) == "vpn.example.com:51830"
+    assert format_endpoint("vpn.example.com:443", 51830) == "vpn.example.com:443"
+    assert format_endpoint("2001:db8::1", 51830) == "[2001:db8::1]:51830"
+    assert format_endpoint("[2001:db8::1]", 51830) == "[2001:db8::1]:51830"
+    assert format_endpoint("[2001:db8::1]:443", 51830) == "[2001:db8::1]:443"
+
+
+def test_discovery_prefers_ipv4_services_and_skips_garbage(monkeypatch):
+    monkeypatch.setattr(endpoint.urllib.request, 'urlopen', fake_urlopen({
+        'v4-down': OSError('Network is unreachable'),
+        'portal': b'<html>Please log in</html>',
+        'v4': b'203.0.113.7\n',
+        'dual': b'2001:db8::1\n',
+    }))
+    assert discover_public_address(['v4-down', 'portal', 'v4', 'dual']) == '203.0.113.7'
+    # An IPv6-only server still gets an address from the dual-stack service
+    assert discover_public_address(['v4-down', 'dual']) == '2001:db8::1'
+    assert discover_public_address(['portal']) is None
+
+
+def test_refresh_keeps_the_cached_address_when_discovery_fails(tmp_path, monkeypatch):
+    path = tmp_path / 'endpoint.json'
+    path.write_text(json.dumps({'address': '203.0.113.7', 'resolved_at': 0}))
+    cache = EndpointCache(ttl=60, path=path)
+    assert cache.get() == '203.0.113.7'
+    monkeypatch.setattr(endpoint, 'discover_public_address', lambda: None)
+    assert cache.refresh() == '203.0.113.7'
+    monkeypatch.setattr(endpoint, 'discover_public_address', lambda: '198.51.100.1')
+    assert cache.refresh() == '198.51.100.1'
+    assert json.loads(path.read_text())['address'] == '198.51.100.1'
+
+
+def test_invalid_cached_address_is_ignored(tmp_path, monkeypatch):
+    monkeypatch.setattr(endpoint, 'read_variables_address', lambda: None)
+    path = tmp_path / 'endpoint.json'
+    path.write_text(json.dumps({'address': '<html>', 'resolved_at': 1e12}))
+    cache = EndpointCache(path=path)
+    assert cache.get() == endpoint.FALLBACK
+    assert cache.stale()
@@ -0,0 +1,67 @@
+import pytest
+
+from expiry import ExpiryQueue, parse_duration
+
+
+@pytest.mark.parametrize('text, seconds', [
+    ('90m', 5400), ('12h', 43200), ('30d', 2592000), ('2w', 1209600), (' 1D ', 86400),
+    ('0d', None), ('30', None), ('30y', None), ('d', None), ('-1d', None),
+])
+def test_parse_duration(text, seconds):
+    assert parse_duration(text) == seconds
+
+
+def test_heap_order():
+    queue = ExpiryQueue()
+    queue.load([('c', 300), ('a', 100)])
+    queue.schedule('b', 200)
+    assert queue.upcoming() == [('a', 100), ('b', 200), ('c', 300)]
+    assert queue.upcoming(limit=1) == [('a', 100)]
+    assert queue.pop_due(1000) == ['a', 'b', 'c']
+    assert len(queue) == 0
+
+
+def test_rescheduling_leaves_a_stale_entry_that_is_skipped():
+    queue = ExpiryQueue()
+    queue.schedule('a', 100)
+    queue.schedule('a', 500)
+    assert queue.expires_at('a') == 500
+    assert queue.upcoming() == [('a', 500)]
+    assert queue.pop_due(200) == []
+    assert len(queue) == 1
+    assert queue.pop_due(500) == ['a']
+    # Moving an expiry earlier works the same way
+    queue.schedule('b', 900)
+    queue.schedule('b', 50)
+    assert queue.pop_due(100) == ['b']
+    assert queue.pop_due(1000) == []
+
+
+def test_cancel():
+    queue = ExpiryQueue()
+    queue.load([('a', 100), ('b', 200)])
+    queue.cancel('a')
+    queue.cancel('missing')
+    assert queue.expires_at('a') is None
+    assert queue.upcoming() == [('b', 200)]
+    assert queue.pop_due(1000) == ['b']
+    # A cancelled client that is scheduled again expires at its new time only
+    queue.schedule('a', 300)
+    assert queue.pop_due(299) == []
+    assert queue.pop_due(300) == ['a']
+
+
+def test_due_boundary():
+    queue = ExpiryQueue()
+    queue.load([('a', 100)])
+    assert queue.pop_due(99.999) == []
+    assert queue.pop_due(100) == ['a']
+    assert queue.pop_due(100) == []
+
+
+def test_stale_entries_are_compacted():
+    queue = ExpiryQueue()
+    for expires in range(1000):
+        queue.schedule('a', expires + 1)
+    assert len(queue._heap) < 100
+    assert queue.upcoming() == [('a', 1000)]
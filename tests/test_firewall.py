@@ -0,0 +1,49 @@
+from firewall import build_access_update, build_ruleset, parse_networks
+
+
+def test_ruleset_with_access_maps_and_lan():
+    ruleset = build_ruleset(['wg0'], 'eth0', [51830], {'10.8.0.2': 'blocked', 'fd00::3': 'lan', '10.8.0.4': 'lan'},
+                            ['192.168.0.0/16', 'fd10::/64'])
+    lines = [line.strip() for line in ruleset.splitlines()]
+    # Flushed and redefined in one transaction
+    assert lines[:3] == ["table inet wg_bot", "delete table inet wg_bot", "table inet wg_bot {"]
+    assert "map access4 { type ipv4_addr : verdict; elements = { 10.8.0.2 : drop, 10.8.0.4 : accept } }" in lines
+    assert "map access6 { type ipv6_addr : verdict; elements = { fd00::3 : accept } }" in lines
+    assert "set lan4 { type ipv4_addr; flags interval; elements = { 192.168.0.0/16 } }" in lines
+    assert "set lan6 { type ipv6_addr; flags interval; elements = { fd10::/64 } }" in lines
+    assert "udp dport { 51830 } accept" in lines
+    assert 'oifname "eth0" masquerade' in lines
+    # The access verdict comes before the LAN drop, so "lan" clients get through
+    forward = lines[lines.index("chain forward {") + 2:]
+    assert forward[:5] == [
+        'iifname "wg0" ip saddr vmap @access4',
+        'iifname "wg0" ip6 saddr vmap @access6',
+        'iifname "wg0" ip daddr @lan4 drop',
+        'iifname "wg0" ip6 daddr @lan6 drop',
+        'iifname "wg0" accept',
+    ]
+
+
+def test_ruleset_without_clients_or_lan():
+    ruleset = build_ruleset(['wg0', 'wg1'], 'ens3', [51830, 51831], {})
+    lines = [line.strip() for line in ruleset.splitlines()]
+    assert "map access4 { type ipv4_addr : verdict;  }" in lines
+    assert "udp dport { 51830, 51831 } accept" in lines
+    assert 'iifname { "wg0", "wg1" } accept' in lines
+    # Without WG_LAN_NETWORKS nothing is dropped
+    assert not any(line.endswith(" drop") for line in lines)
+    assert ruleset.count("{") == ruleset.count("}")
+
+
+def test_access_update():
+    assert build_access_update([], {}) == ""
+    assert build_access_update(['10.8.0.2', 'fd00::2'], {'10.8.0.3': 'blocked'}).splitlines() == [
+        "delete element inet wg_bot access4 { 10.8.0.2 }",
+        "delete element inet wg_bot access6 { fd00::2 }",
+        "add element inet wg_bot access4 { 10.8.0.3 : drop }",
+    ]
+
+
+def test_parse_networks():
+    assert parse_networks(" 10.0.0.0/8, ,192.168.0.0/16 ") == ['10.0.0.0/8', '192.168.0.0/16']
+    assert parse_networks("") == []
@@ -0,0 +1,86 @@
+import json
+import threading
+
+from jobs import DONE, FAILED, JobEngine, JobHandler
+
+
+def run(engine, kind, items, **kwargs):
+    finished = threading.Event()
+    reports = []
+
+    def report(job, final):
+        if final:
+            reports.append(job)
+            finished.set()
+
+    engine.report = report
+    engine.submit(kind, 1, items, **kwargs)
+    assert finished.wait(5)
+    return reports[0]
+
+
+def test_failed_steps_are_named_by_the_handler(tmp_path):
+    engine = JobEngine(None, directory=tmp_path)
+    seen = []
+
+    def step(job, item):
+        if item['name'] == 'bad':
+            raise RuntimeError('boom')
+        return 'created', item
+
+    def finish(job):
+        seen.extend(entry['name'] for entry in job.results['failed'])
+
+    engine.register('create', JobHandler(step, finish, describe=lambda item: item['name']))
+    job = run(engine, 'create', [{'name': 'ok'}, {'name': 'bad'}])
+    assert job.state == DONE
+    assert seen == ['bad']
+    assert job.results['failed'][0]['error'] == 'boom'
+    assert not list(tmp_path.glob('*.json'))
+
+
+def test_stop_on_error(tmp_path):
+    engine = JobEngine(None, directory=tmp_path)
+    done = []
+
+    def step(job, item):
+        if item == 2:
+            raise RuntimeError('broken')
+        done.append(item)
+        return 'ok', item
+
+    engine.register('restore', JobHandler(step, lambda job: None, stop_on_error=True))
+    job = run(engine, 'restore', [1, 2, 3])
+    assert job.state == FAILED
+    assert job.error == 'broken'
+    assert done == [1]
+
+
+def test_resume_continues_from_checkpoint(tmp_path):
+    (tmp_path / 'abc.json').write_text(json.dumps({
+        'id': 'abc', 'kind': 'count', 'chat_id': 1, 'items': [1, 2, 3], 'position': 2,
+        'results': {'ok': [1, 2]}, 'state': 'running',
+    }))
+    finished = threading.Event()
+    engine = JobEngine(lambda job, final: final and finished.set(), directory=tmp_path)
+    engine.register('count', JobHandler(lambda job, item: ('ok', item), lambda job: None))
+    assert [job.id for job in engine.resume()] == ['abc']
+    assert finished.wait(5)
+    assert engine.get('abc').results == {'ok': [1, 2, 3]}
+
+
+def test_steps_hold_the_shared_lock(tmp_path):
+    lock = threading.RLock()
+    engine = JobEngine(None, directory=tmp_path, lock=lock)
+    held = []
+
+    def step(job, item):
+        # Another thread cannot take the lock while a step runs
+        probe = threading.Thread(target=lambda: held.append(lock.acquire(blocking=False)))
+        probe.start()
+        probe.join()
+        return 'ok', item
+
+    engine.register('locked', JobHandler(step, lambda job: None))
+    run(engine, 'locked', [1, 2])
+    assert held == [False, False]
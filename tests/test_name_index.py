@@ -0,0 +1,54 @@
+from name_index import NameIndex
+
+NAMES = ['alice-phone', 'Alice-Laptop', 'bob', 'office-printer', 'phone-guest', 'al']
+
+
+def brute_force(names, query):
+    return {name for name in names if query.lower() in name.lower()}
+
+
+def test_short_and_long_queries():
+    index = NameIndex(NAMES)
+    assert len(index) == len(NAMES)
+    assert set(index.search('a')) == brute_force(NAMES, 'a')
+    assert set(index.search('ph')) == brute_force(NAMES, 'ph')
+    # Longer than a trigram: postings are intersected, then false positives are filtered out
+    assert set(index.search('phone')) == {'alice-phone', 'phone-guest'}
+    assert index.search('ohpne') == []
+    assert index.search('  ') == []
+
+
+def test_case_insensitive_with_prefix_matches_first():
+    index = NameIndex(NAMES)
+    # Then shorter names, then by name
+    assert index.search('ALICE') == ['alice-phone', 'Alice-Laptop']
+    assert index.search('phone') == ['phone-guest', 'alice-phone']
+    assert index.search('al')[:1] == ['al']
+    assert index.search('e', limit=2) == ['alice-phone', 'phone-guest']
+
+
+def test_add_and_remove():
+    index = NameIndex(NAMES)
+    index.add('tablet-phone')
+    index.add('bob')
+    assert len(index) == len(NAMES) + 1
+    assert set(index.search('phone')) == {'alice-phone', 'phone-guest', 'tablet-phone'}
+
+    index.remove('alice-phone')
+    index.remove('missing')
+    assert 'alice-phone' not in index
+    assert set(index.search('phone')) == {'phone-guest', 'tablet-phone'}
+    assert index.search('alice') == ['Alice-Laptop']
+    # Postings of removed names are dropped once empty
+    index.remove('tablet-phone')
+    assert 'tab' not in index._postings
+
+    index.clear()
+    assert len(index) == 0 and index.search('a') == []
+
+
+def test_matches_brute_force_for_every_substring():
+    index = NameIndex(NAMES)
+    queries = {name[i:j].lower() for name in NAMES for i in range(len(name)) for j in range(i + 1, len(name) + 1)}
+    for query in queries:
+        assert set(index.search(query, limit=100)) == brute_force(NAMES, query), query
@@ -0,0 +1,101 @@
+import presence
+from peer_stats import PeerStat
+from presence import OFFLINE, ONLINE, ROAMED, PresenceWatcher, RateLimiter, Subscriptions
+
+NOW = 1_800_000_000
+
+
+def peer(key, handshake, endpoint='198.51.100.1:51820', address='10.8.0.2'):
+    return {key: PeerStat(key, endpoint, (f'{address}/32',), handshake, 0, 0)}
+
+
+def kinds(events):
+    return [(event.kind, event.public_key, event.endpoint, event.previous_endpoint) for event in events]
+
+
+def test_first_snapshot_only_sets_the_baseline():
+    watcher = PresenceWatcher(stale_after=300)
+    stats = {**peer('A', NOW - 10), **peer('B', NOW - 20, address='10.8.0.3'), **peer('C', 0, endpoint=None)}
+    assert watcher.diff(stats, now=NOW) == []
+    # Nothing changed, so nothing is reported either
+    assert watcher.diff(stats, now=NOW + 30) == []
+
+
+def test_online_offline_and_roaming():
+    watcher = PresenceWatcher(stale_after=300)
+    watcher.diff(peer('A', 0, endpoint=None), now=NOW)
+
+    events = watcher.diff(peer('A', NOW + 5), now=NOW + 10)
+    assert kinds(events) == [(ONLINE, 'A', '198.51.100.1:51820', None)]
+    assert events[0].address == '10.8.0.2' and events[0].at == NOW + 10
+
+    events = watcher.diff(peer('A', NOW + 100, endpoint='203.0.113.9:4000'), now=NOW + 120)
+    assert kinds(events) == [(ROAMED, 'A', '203.0.113.9:4000', '198.51.100.1:51820')]
+
+    # No handshake for longer than stale_after: offline, reported with the last known endpoint
+    assert watcher.diff(peer('A', NOW + 100, endpoint='203.0.113.9:4000'), now=NOW + 399) == []
+    events = watcher.diff(peer('A', NOW + 100, endpoint='203.0.113.9:4000'), now=NOW + 400)
+    assert kinds(events) == [(OFFLINE, 'A', '203.0.113.9:4000', None)]
+    assert watcher.diff(peer('A', NOW + 100), now=NOW + 500) == []
+
+    # Back again
+    assert kinds(watcher.diff(peer('A', NOW + 600), now=NOW + 600)) == [(ONLINE, 'A', '198.51.100.1:51820', None)]
+
+
+def test_new_and_removed_peers():
+    watcher = PresenceWatcher(stale_after=300)
+    watcher.diff(peer('A', NOW), now=NOW)
+    # A peer added after the baseline is reported once it has a fresh handshake
+    assert kinds(watcher.diff({**peer('A', NOW), **peer('B', NOW + 5)}, now=NOW + 10)) == [
+        (ONLINE, 'B', '198.51.100.1:51820', None)
+    ]
+    # Removed peers disappear silently and are reported again when re-added and connected
+    assert watcher.diff(peer('A', NOW), now=NOW + 20) == []
+    assert kinds(watcher.diff({**peer('A', NOW), **peer('B', NOW + 5)}, now=NOW + 30)) == [
+        (ONLINE, 'B', '198.51.100.1:51820', None)
+    ]
+
+
+def test_rate_limiter_allows_a_burst_then_spaces_sends(monkeypatch):
+    class Clock:
+        now = 100.0
+        slept = []
+
+        @classmethod
+        def monotonic(cls):
+            return cls.now
+
+        @classmethod
+        def sleep(cls, seconds):
+            cls.slept.append(round(seconds, 6))
+            cls.now += seconds
+
+    monkeypatch.setattr(presence, 'time', Clock)
+    limiter = RateLimiter(rate=2, burst=3)
+    for _ in range(3):
+        limiter.acquire()
+    assert Clock.slept == []
+    limiter.acquire()
+    limiter.acquire()
+    assert Clock.slept == [0.5, 0.5]
+    # Idle time refills the bucket, but never beyond the burst size
+    Clock.now += 60
+    for _ in range(3):
+        limiter.acquire()
+    assert Clock.slept == [0.5, 0.5]
+    limiter.acquire()
+    assert Clock.slept == [0.5, 0.5, 0.5]
+
+
+def test_subscriptions_persist(tmp_path):
+    path = tmp_path / 'presence.json'
+    subscriptions = Subscriptions(path)
+    assert not subscriptions
+    subscriptions.subscribe(1)
+    subscriptions.subscribe(2, ['b', 'a', 'b'])
+    subscriptions.unsubscribe(3)
+    reloaded = Subscriptions(path)
+    assert reloaded.get(1) == (True, None)
+    assert reloaded.get(2) == (True, ['a', 'b'])
+    reloaded.unsubscribe(1)
+    assert Subscriptions(path).items() == [(2, ['a', 'b'])]
@@ -0,0 +1,82 @@
+import pytest
+
+from reconcile import compute_plan, find_conflicts, parse_document, parse_expires
+
+CURRENT = {
+    'phone': {'address': '10.8.0.2', 'profile': None, 'rate': None, 'enabled': True, 'psk': False, 'tags': []},
+    'laptop': {'address': '10.8.0.3', 'profile': 'mobile', 'rate': None, 'enabled': True, 'psk': True, 'tags': []},
+    'old': {'address': '10.8.0.4', 'profile': None, 'rate': None, 'enabled': True, 'psk': False, 'tags': []},
+}
+
+
+def test_parse_document_list_and_object_forms():
+    listed, prune = parse_document({'clients': [{'name': 'phone', 'enabled': False}]})
+    keyed, _ = parse_document({'prune': False, 'clients': {'phone': {'enabled': False}, 'tv': None}})
+    assert listed == {'phone': {'enabled': False}}
+    assert prune is True
+    assert keyed == {'phone': {'enabled': False}, 'tv': {}}
+
+
+@pytest.mark.parametrize('data', [
+    [],
+    {'clients': 'phone'},
+    {'clients': [{'name': 'bad name'}]},
+    {'clients': [{'name': 'a'}, {'name': 'a'}]},
+    {'clients': [{'name': 'a', 'colour': 'red'}]},
+    {'clients': [{'name': 'a', 'psk': 'yes'}]},
+    {'clients': [{'name': 'a', 'tags': ['Bad!']}]},
+    {'prune': 'no', 'clients': []},
+])
+def test_parse_document_rejects(data):
+    with pytest.raises(ValueError):
+        parse_document(data)
+
+
+def test_parse_expires_and_tags():
+    assert parse_expires(None) is None
+    assert parse_expires(1700000000) == 1700000000
+    with pytest.raises(ValueError):
+        parse_expires(True)
+    clients, _ = parse_document({'clients': [{'name': 'a', 'tags': ['Team-A', 'phone', 'team-a']}]})
+    assert clients['a']['tags'] == ['phone', 'team-a']
+
+
+def test_plan_creates_updates_recreates_and_deletes():
+    desired = {
+        'phone': {'address': '10.8.0.2', 'rate': [1000, 1000]},
+        'laptop': {'address': '10.8.0.9', 'profile': 'mobile'},
+        'tv': {'profile': 'full'},
+    }
+    plan = compute_plan(desired, CURRENT)
+    assert plan.create == [('tv', {'profile': 'full'})]
+    assert plan.update == {'phone': {'rate': [1000, 1000]}}
+    assert plan.recreate == [('laptop', dict(CURRENT['laptop'], address='10.8.0.9'))]
+    assert plan.delete == ['old']
+    assert plan.unchanged == 0
+    assert not plan.empty
+
+
+def test_plan_without_prune_keeps_unlisted_clients():
+    plan = compute_plan({'phone': {'enabled': True}}, CURRENT, prune=False)
+    assert plan.delete == []
+    assert plan.unchanged == 1
+    assert plan.empty
+
+
+def test_psk_is_only_added():
+    plan = compute_plan({'laptop': {'psk': False}, 'phone': {'psk': True}}, CURRENT, prune=False)
+    assert plan.update == {'phone': {'psk': True}}
+
+
+def test_applying_the_same_state_is_a_no_op():
+    desired = {name: dict(fields) for name, fields in CURRENT.items()}
+    plan = compute_plan(desired, CURRENT)
+    assert plan.empty
+    assert plan.unchanged == len(CURRENT)
+
+
+def test_conflicts():
+    desired = {'tv': {'address': '10.8.0.2'}, 'phone': {}}
+    assert find_conflicts(desired, CURRENT, prune=True) == {'10.8.0.2': ['tv', 'phone']}
+    assert find_conflicts({'tv': {'address': '10.8.0.4'}}, CURRENT, prune=False) == {'10.8.0.4': ['tv', 'old']}
+    assert find_conflicts({'tv': {'address': '10.8.0.4'}}, CURRENT, prune=True) == {}
@@ -0,0 +1,80 @@
+import ipaddress
+
+import pytest
+
+from routing import ALIASES, compute_allowed_ips, parse_profile, parse_route_profiles
+
+
+def reference(include, exclude):
+    """Same result the slow way, with ipaddress.address_exclude"""
+    networks = [ipaddress.ip_network(network) for network in include]
+    for excluded in map(ipaddress.ip_network, exclude):
+        networks = [part for network in networks for part in (
+            network.address_exclude(excluded) if network.version == excluded.version and excluded.subnet_of(network)
+            else [] if network.version == excluded.version and network.subnet_of(excluded) else [network])]
+    return [str(network) for version in (4, 6)
+            for network in ipaddress.collapse_addresses(n for n in networks if n.version == version)]
+
+
+def test_excluding_private_ranges_from_everything():
+    allowed = compute_allowed_ips(['0.0.0.0/0'], ['10.0.0.0/8', '172.16.0.0/12', '192.168.0.0/16'])
+    assert allowed == [
+        '0.0.0.0/5', '8.0.0.0/7', '11.0.0.0/8', '12.0.0.0/6', '16.0.0.0/4', '32.0.0.0/3', '64.0.0.0/2',
+        '128.0.0.0/3', '160.0.0.0/5', '168.0.0.0/6', '172.0.0.0/12', '172.32.0.0/11', '172.64.0.0/10',
+        '172.128.0.0/9', '173.0.0.0/8', '174.0.0.0/7', '176.0.0.0/4', '192.0.0.0/9', '192.128.0.0/11',
+        '192.160.0.0/13', '192.169.0.0/16', '192.170.0.0/15', '192.172.0.0/14', '192.176.0.0/12',
+        '192.192.0.0/10', '193.0.0.0/8', '194.0.0.0/7', '196.0.0.0/6', '200.0.0.0/5', '208.0.0.0/4',
+        '224.0.0.0/3',
+    ]
+
+
+def test_single_exclusion_splits_into_minimal_blocks():
+    assert compute_allowed_ips(['10.0.0.0/24'], ['10.0.0.0/25']) == ['10.0.0.128/25']
+    assert compute_allowed_ips(['10.0.0.0/24'], ['10.0.0.128/32']) == [
+        '10.0.0.0/25', '10.0.0.129/32', '10.0.0.130/31', '10.0.0.132/30', '10.0.0.136/29',
+        '10.0.0.144/28', '10.0.0.160/27', '10.0.0.192/26',
+    ]
+
+
+def test_adjacent_and_overlapping_ranges_merge():
+    # Adjacent halves become one block, overlaps and duplicates collapse
+    assert compute_allowed_ips(['10.0.0.0/25', '10.0.0.128/25']) == ['10.0.0.0/24']
+    assert compute_allowed_ips(['10.0.0.0/16', '10.0.5.0/24', '10.0.0.0/16']) == ['10.0.0.0/16']
+    assert compute_allowed_ips(['10.0.0.0/24', '10.0.0.128/24']) == ['10.0.0.0/24']
+    # Host bits are ignored like `strict=False`
+    assert compute_allowed_ips(['10.0.0.7/24']) == ['10.0.0.0/24']
+
+
+def test_exclusions_touching_both_ends_and_several_ranges():
+    assert compute_allowed_ips(['10.0.0.0/24'], ['10.0.0.0/26', '10.0.0.192/26']) == ['10.0.0.64/26', '10.0.0.128/26']
+    assert compute_allowed_ips(['10.0.0.0/24', '10.0.2.0/24'], ['10.0.0.0/23']) == ['10.0.2.0/24']
+    assert compute_allowed_ips(['10.0.0.0/24'], ['10.0.0.0/8']) == []
+    assert compute_allowed_ips(['10.0.0.0/24'], ['192.168.0.0/16', '::/0']) == ['10.0.0.0/24']
+
+
+def test_ipv6():
+    assert compute_allowed_ips(['::/0'], ['::/1']) == ['8000::/1']
+    assert compute_allowed_ips(['::/0'], ['fc00::/7', 'fe80::/10', 'ff00::/8']) == [
+        '::/1', '8000::/2', 'c000::/3', 'e000::/4', 'f000::/5', 'f800::/6', 'fe00::/9', 'fec0::/10',
+    ]
+    # v4 ranges come first, each family is computed on its own
+    assert compute_allowed_ips(['::/0', '0.0.0.0/0'], ['0.0.0.0/1']) == ['128.0.0.0/1', '::/0']
+
+
+@pytest.mark.parametrize('exclude', [['lan'], ['lan', 'multicast'], ['rfc1918']])
+def test_matches_address_exclude(exclude):
+    excluded = [network for alias in exclude for network in ALIASES[alias]]
+    assert compute_allowed_ips(ALIASES['all'], excluded) == reference(ALIASES['all'], excluded)
+
+
+def test_profiles():
+    profiles = parse_route_profiles('corp=10.10.0.0/16, 172.20.0.0/14;Office=all -rfc1918')
+    assert profiles['full'].allowed_ips == ('0.0.0.0/0', '::/0')
+    assert profiles['corp'].allowed_ips == ('10.10.0.0/16', '172.20.0.0/14')
+    assert '10.0.0.0/8' not in profiles['office'].allowed_ips and '::/0' in profiles['office'].allowed_ips
+    assert profiles['nolan'].allowed_ips_for(dual_stack=False) == [
+        network for network in profiles['nolan'].allowed_ips if ':' not in network
+    ]
+    assert not any(network.startswith('fe80') for network in profiles['nolan'].allowed_ips)
+    with pytest.raises(ValueError):
+        parse_profile('empty', '10.0.0.0/8 -10.0.0.0/8')
@@ -0,0 +1,81 @@
+import pytest
+
+from shaping import (MAX_SHAPED_CLIENTS, RateLimit, ShapedClient, build_tc_batch, format_rate, number_classes,
+                     parse_limit, parse_profiles, parse_rate)
+
+
+@pytest.mark.parametrize('text, kbit', [
+    ('512', 512), ('512k', 512), ('10m', 10000), ('10mbit', 10000), ('1.5m', 1500), ('1g', 1000000), (' 2M ', 2000),
+])
+def test_parse_rate(text, kbit):
+    assert parse_rate(text) == kbit
+
+
+@pytest.mark.parametrize('text', ['', 'fast', '10x', '-1m'])
+def test_parse_rate_rejects(text):
+    with pytest.raises(ValueError):
+        parse_rate(text)
+
+
+def test_parse_limit_and_profiles():
+    profiles = parse_profiles('basic=10m/2m, Premium=100m,broken')
+    assert profiles == {'basic': RateLimit(10000, 2000), 'premium': RateLimit(100000, 100000)}
+    assert parse_limit('BASIC', profiles) == RateLimit(10000, 2000)
+    assert parse_limit('5m/0') == RateLimit(5000, 0)
+    assert str(RateLimit(10000, 512)) == '10m/512k'
+    assert format_rate(0) == '∞'
+    assert format_rate(2000000) == '2g'
+
+
+def test_no_limits_only_clears_qdiscs():
+    script = build_tc_batch([ShapedClient(2, '10.8.0.2', None, RateLimit(0, 0))])
+    assert script == "qdisc del dev wg0 root\nqdisc del dev wg0 ingress\nqdisc del dev ifb0 root\n"
+
+
+def test_batch_script():
+    clients = [
+        ShapedClient(2, '10.8.0.2', 'fd00::2', RateLimit(10000, 2000)),
+        ShapedClient(3, '10.8.1.7', None, RateLimit(0, 512)),
+    ]
+    lines = build_tc_batch(clients, link_rate=100000).splitlines()
+
+    # Idempotent: the old tree goes first, then one HTB tree per direction
+    assert lines[:3] == ["qdisc del dev wg0 root", "qdisc del dev wg0 ingress", "qdisc del dev ifb0 root"]
+    assert "qdisc add dev wg0 root handle 1: htb default ffff" in lines
+    assert "qdisc add dev ifb0 root handle 1: htb default ffff" in lines
+    assert "class add dev wg0 parent 1: classid 1:ffff htb rate 100000kbit" in lines
+    assert ("filter add dev wg0 parent ffff: protocol all u32 match u32 0 0 "
+            "action mirred egress redirect dev ifb0") in lines
+
+    # Downloads match the destination on wg0, uploads the source on the ifb
+    assert "class add dev wg0 parent 1: classid 1:2 htb rate 10000kbit ceil 10000kbit" in lines
+    assert ("filter add dev wg0 parent 1: prio 1 protocol ip u32 ht 100:2: "
+            "match ip dst 10.8.0.2/32 flowid 1:2") in lines
+    assert ("filter add dev wg0 parent 1: prio 2 protocol ipv6 u32 "
+            "match ip6 dst fd00::2/128 flowid 1:2") in lines
+    assert "class add dev ifb0 parent 1: classid 1:2 htb rate 2000kbit ceil 2000kbit" in lines
+    assert ("filter add dev ifb0 parent 1: prio 1 protocol ip u32 ht 100:2: "
+            "match ip src 10.8.0.2/32 flowid 1:2") in lines
+
+    # Unlimited directions get no class; buckets hash on the last address byte
+    assert not any(line.startswith("class add dev wg0 parent 1: classid 1:3 ") for line in lines)
+    assert ("filter add dev ifb0 parent 1: prio 1 protocol ip u32 ht 100:7: "
+            "match ip src 10.8.1.7/32 flowid 1:3") in lines
+
+
+def test_hash_filters_are_set_up_per_device():
+    lines = build_tc_batch([ShapedClient(2, '10.8.0.2', None, RateLimit(1000, 1000))]).splitlines()
+    for device, match, offset in (('wg0', 'dst', 16), ('ifb0', 'src', 12)):
+        assert f"filter add dev {device} parent 1: prio 1 handle 100: protocol ip u32 divisor 256" in lines
+        assert (f"filter add dev {device} parent 1: prio 1 protocol ip u32 ht 800:: "
+                f"match ip {match} 0.0.0.0/0 hashkey mask 0x000000ff at {offset} link 100:") in lines
+
+
+def test_class_ids_are_dense_whatever_the_addresses():
+    limit = RateLimit(1000, 1000)
+    # Addresses deep in a /15 pool would be past 0xfffe as pool indexes
+    clients = number_classes([('10.1.255.250', None, limit), ('10.1.255.251', 'fd00::1', limit)])
+    assert clients == [ShapedClient(1, '10.1.255.250', None, limit), ShapedClient(2, '10.1.255.251', 'fd00::1', limit)]
+    assert len(number_classes([('10.8.0.2', None, limit)] * MAX_SHAPED_CLIENTS)) == 0xfffe
+    with pytest.raises(ValueError):
+        number_classes([('10.8.0.2', None, limit)] * (MAX_SHAPED_CLIENTS + 1))
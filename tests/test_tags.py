@@ -0,0 +1,29 @@
+from tags import TagIndex
+
+
+def test_index_follows_tag_changes():
+    index = TagIndex([('a', ['x', 'y']), ('b', ['x'])])
+    assert index.names('x') == {'a', 'b'}
+    assert index.counts() == {'x': 2, 'y': 1}
+
+    index.set('a', ['y', 'z'])
+    assert index.names('x') == {'b'}
+    assert index.counts() == {'x': 1, 'y': 1, 'z': 1}
+
+    index.remove('b')
+    assert 'x' not in index
+    assert index.tags_of('a') == ['y', 'z']
+    assert index.tags_of('b') == []
+
+
+def test_load_replaces_the_index():
+    index = TagIndex([('a', ['x'])])
+    index.load([('b', ['y'])])
+    assert index.counts() == {'y': 1}
+
+
+def test_names_is_a_copy():
+    index = TagIndex([('a', ['x'])])
+    index.names('x').add('intruder')
+    assert index.names('x') == {'a'}
+    assert index.names('missing') == set()
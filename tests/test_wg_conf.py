@@ -0,0 +1,70 @@
+from wg_conf import (join_peers, peer_address, peer_allowed_ips, peer_field, peer_public_key,
+                     set_interface_field, set_peer_field, split_peers)
+
+CONFIG = (
+    "[Interface]\n"
+    "PrivateKey = server\n"
+    "ListenPort = 51830\n"
+    "\n"
+    "[Peer]\n"
+    "# phone\n"
+    "PublicKey = key1\n"
+    "PresharedKey = psk1\n"
+    "AllowedIPs = 10.8.0.2/32, fd00::2/128\n"
+    "\n"
+    "[Peer]\n"
+    "PublicKey = key2\n"
+    "AllowedIPs = 10.8.0.3/32\n"
+)
+
+
+def test_split_and_join_round_trip():
+    head, peers = split_peers(CONFIG)
+    assert head.startswith("[Interface]")
+    assert len(peers) == 2
+    assert peers[0].startswith("[Peer]\n# phone\n")
+    assert join_peers(head, peers) == CONFIG
+
+
+def test_join_after_dropping_a_peer():
+    head, peers = split_peers(CONFIG)
+    text = join_peers(head, peers[1:])
+    assert "key1" not in text
+    assert split_peers(text)[1] == peers[1:]
+
+
+def test_join_adds_missing_newlines():
+    assert join_peers("[Interface]", ["[Peer]\nPublicKey = k"]) == "[Interface]\n[Peer]\nPublicKey = k\n"
+    assert join_peers("", []) == ""
+
+
+def test_config_without_peers():
+    head, peers = split_peers("[Interface]\nPrivateKey = s\n")
+    assert peers == []
+    assert head == "[Interface]\nPrivateKey = s\n"
+
+
+def test_peer_fields():
+    peers = split_peers(CONFIG)[1]
+    assert peer_public_key(peers[0]) == "key1"
+    assert peer_field(peers[0], "presharedkey") == "psk1"
+    assert peer_field(peers[1], "PresharedKey") is None
+    assert peer_allowed_ips(peers[0]) == ["10.8.0.2/32", "fd00::2/128"]
+    assert peer_address(peers[0]) == "10.8.0.2"
+    assert peer_address("[Peer]\nAllowedIPs = fd00::9/128\n") is None
+
+
+def test_set_peer_field():
+    block = split_peers(CONFIG)[1][1]
+    with_psk = set_peer_field(block, "PresharedKey", "new")
+    assert with_psk == "[Peer]\nPublicKey = key2\nPresharedKey = new\nAllowedIPs = 10.8.0.3/32\n"
+    assert set_peer_field(with_psk, "PresharedKey", "other").count("PresharedKey") == 1
+    assert set_peer_field(with_psk, "PresharedKey", None) == block
+
+
+def test_set_interface_field_keeps_peers():
+    text = set_interface_field(CONFIG, "ListenPort", "51831")
+    assert "ListenPort = 51831\n" in text
+    assert split_peers(text)[1] == split_peers(CONFIG)[1]
+    added = set_interface_field(CONFIG, "MTU", "1380")
+    assert added.startswith("[Interface]\nMTU = 1380\n")
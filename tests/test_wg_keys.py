@@ -0,0 +1,89 @@
+import base64
+import itertools
+import stat
+import threading
+
+import wg_keys
+from wg_keys import KeyPool
+
+
+def counting_keypairs(monkeypatch, delay=None):
+    counter = itertools.count()
+
+    def generate_keypair():
+        number = next(counter)
+        if delay is not None:
+            delay.wait(1)
+        return f"private-{number}", f"public-{number}"
+
+    monkeypatch.setattr(wg_keys, 'generate_keypair', generate_keypair)
+    return counter
+
+
+def test_fill_tops_up_to_size(monkeypatch):
+    counting_keypairs(monkeypatch)
+    pool = KeyPool(size=3)
+    assert pool.fill() == 3
+    assert len(pool) == 3
+    assert pool.fill() == 0
+    assert pool.take() == ("private-0", "public-0")
+    assert pool.fill() == 1
+    assert [pool.take() for _ in range(3)] == [("private-1", "public-1"), ("private-2", "public-2"),
+                                                ("private-3", "public-3")]
+
+
+def test_empty_pool_generates_on_demand(monkeypatch):
+    counting_keypairs(monkeypatch)
+    pool = KeyPool(size=0)
+    assert pool.fill() == 0
+    assert pool.take() == ("private-0", "public-0")
+
+
+def test_concurrent_fills_do_not_overshoot(monkeypatch):
+    release = threading.Event()
+    counting_keypairs(monkeypatch, delay=release)
+    pool = KeyPool(size=4)
+    threads = [threading.Thread(target=pool.fill) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(pool) == 4
+
+
+def test_no_keypair_is_handed_out_twice(monkeypatch):
+    counting_keypairs(monkeypatch)
+    pool = KeyPool(size=8)
+    taken = []
+
+    def take_many():
+        for _ in range(50):
+            taken.append(pool.take())
+
+    takers = [threading.Thread(target=take_many) for _ in range(4)]
+    filler = threading.Thread(target=lambda: [pool.fill() for _ in range(50)])
+    for thread in takers + [filler]:
+        thread.start()
+    for thread in takers + [filler]:
+        thread.join()
+    assert len(taken) == 200
+    assert len(set(taken)) == 200
+    assert not set(taken) & set(pool._keys)
+
+
+def test_preshared_keys_look_like_wg_genpsk():
+    keys = {wg_keys.generate_preshared_key() for _ in range(100)}
+    assert len(keys) == 100
+    for key in keys:
+        assert len(key) == 44 and key.endswith('=')
+        assert len(base64.b64decode(key)) == 32
+
+
+def test_write_key_modes(tmp_path):
+    wg_keys.write_key(tmp_path / 'a_presharedkey', 'PSK')
+    wg_keys.write_key(tmp_path / 'a_publickey', 'PUB', private=False)
+    assert (tmp_path / 'a_presharedkey').read_text() == 'PSK\n'
+    assert stat.S_IMODE((tmp_path / 'a_presharedkey').stat().st_mode) == 0o600
+    # Public keys follow the umask, at most 0644
+    assert stat.S_IMODE((tmp_path / 'a_publickey').stat().st_mode) & ~0o644 == 0
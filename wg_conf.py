@@ -0,0 +1,90 @@
+from typing import List, Optional, Tuple
+
+
+def split_peers(text: str) -> Tuple[str, List[str]]:
+    """Split a wg-quick config into the part before the first [Peer] and the peer blocks.
+
+    Each block keeps its own lines verbatim (including PresharedKey, comments
+    and trailing blank lines), so joining them back reproduces the file.
+    """
+    head, peers = [], []
+    current = None
+    for line in text.splitlines(keepends=True):
+        if line.strip().lower() == '[peer]':
+            current = [line]
+            peers.append(current)
+        elif current is not None:
+            current.append(line)
+        else:
+            head.append(line)
+    return ''.join(head), [''.join(block) for block in peers]
+
+
+def join_peers(head: str, peers: List[str]) -> str:
+    parts = [head]
+    for block in peers:
+        if parts[-1] and not parts[-1].endswith('\n'):
+            parts.append('\n')
+        parts.append(block)
+    text = ''.join(parts)
+    return text if text.endswith('\n') or not text else text + '\n'
+
+
+def peer_field(block: str, key: str) -> Optional[str]:
+    for line in block.splitlines():
+        name, sep, value = line.partition('=')
+        if sep and name.strip().lower() == key.lower():
+            return value.strip()
+    return None
+
+
+def peer_public_key(block: str) -> Optional[str]:
+    return peer_field(block, 'PublicKey')
+
+
+def peer_allowed_ips(block: str) -> List[str]:
+    value = peer_field(block, 'AllowedIPs') or ''
+    return [ip.strip() for ip in value.split(',') if ip.strip()]
+
+
+def peer_address(block: str) -> Optional[str]:
+    """Client IPv4 address (without mask) of a peer block"""
+    for network in peer_allowed_ips(block):
+        ip = network.split('/')[0]
+        if '.' in ip:
+            return ip
+    return None
+
+
+def set_interface_field(text: str, key: str, value: str) -> str:
+    """Set a field of the [Interface] section, keeping peers and the rest verbatim"""
+    head, peers = split_peers(text)
+    lines = head.splitlines(keepends=True)
+    for i, line in enumerate(lines):
+        name, sep, _ = line.partition('=')
+        if sep and name.strip().lower() == key.lower():
+            lines[i] = f"{key} = {value}\n"
+            break
+    else:
+        for i, line in enumerate(lines):
+            if line.strip().lower() == '[interface]':
+                lines.insert(i + 1, f"{key} = {value}\n")
+                break
+    return join_peers(''.join(lines), peers)
+
+
+def set_peer_field(block: str, key: str, value: Optional[str]) -> str:
+    """Set (or with None remove) a field of a peer block; a new field goes right after PublicKey"""
+    lines = block.splitlines(keepends=True)
+    for i, line in enumerate(lines):
+        name, sep, _ = line.partition('=')
+        if sep and name.strip().lower() == key.lower():
+            if value is None:
+                del lines[i]
+            else:
+                lines[i] = f"{key} = {value}\n"
+            return ''.join(lines)
+    if value is not None:
+        position = next((i + 1 for i, line in enumerate(lines) if line.partition('=')[0].strip().lower() == 'publickey'), 1)
+        lines.insert(position, f"{key} = {value}\n")
+    return ''.join(lines)
@@ -0,0 +1,120 @@
+import base64
+import logging
+import os
+import subprocess
+import threading
+from collections import deque
+from pathlib import Path
+from typing import Deque, Dict, Mapping, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def generate_keypair() -> Tuple[str, str]:
+    """New WireGuard keypair as (private, public)"""
+    private_key = subprocess.run(['wg', 'genkey'], capture_output=True, text=True, check=True).stdout.strip()
+    public_key = subprocess.run(['wg', 'pubkey'], input=private_key, capture_output=True, text=True,
+                                check=True).stdout.strip()
+    return private_key, public_key
+
+
+def public_key_of(private_key: str) -> str:
+    """`wg pubkey` of a private key"""
+    return subprocess.run(['wg', 'pubkey'], input=private_key, capture_output=True, text=True,
+                          check=True).stdout.strip()
+
+
+class DerivedKeyCache:
+    """Public keys derived from private key files, re-derived only when a file changes.
+
+    Entries are keyed by client and checked against the file's (mtime, size,
+    inode), so a periodic scan forks `wg pubkey` only for new or rewritten
+    keys however many clients there are; clients missing from a scan are dropped.
+    """
+
+    def __init__(self):
+        self._keys: Dict[str, Tuple[Tuple[int, int, int], str]] = {}
+
+    def derive(self, paths: Mapping[str, Path]) -> Dict[str, str]:
+        """Public key per client from {client: private key path}; missing or unreadable files are skipped"""
+        keys, cached = {}, {}
+        for name, path in paths.items():
+            try:
+                stat = path.stat()
+            except OSError:
+                continue
+            signature = (stat.st_mtime_ns, stat.st_size, stat.st_ino)
+            entry = self._keys.get(name)
+            if entry is None or entry[0] != signature:
+                try:
+                    private_key = path.read_text(encoding='utf-8').strip()
+                    if not private_key:
+                        continue
+                    entry = (signature, public_key_of(private_key))
+                except (OSError, subprocess.CalledProcessError) as e:
+                    logger.error(f"Error deriving the public key of {name}: {e}")
+                    continue
+            cached[name] = entry
+            keys[name] = entry[1]
+        self._keys = cached
+        return keys
+
+
+def generate_preshared_key() -> str:
+    """Same as `wg genpsk`: 32 random bytes, base64; cheap enough to need no pool or subprocess"""
+    return base64.b64encode(os.urandom(32)).decode('ascii')
+
+
+def write_key(path: Path, key: str, private: bool = True):
+    """Write a key file; private keys get 0600 from the start, never a wider mode"""
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600 if private else 0o644)
+    with os.fdopen(fd, 'w', encoding='utf-8') as f:
+        f.write(key + '\n')
+
+
+class KeyPool:
+    """Ready keypairs so client creation does not wait for key generation.
+
+    Keys live only in process memory: a private key reaches disk when it is
+    handed to a client and written with write_key, never before.
+    """
+
+    def __init__(self, size: int = 16):
+        self.size = size
+        self._keys: Deque[Tuple[str, str]] = deque()
+        self._pending = 0     # keypairs being generated by fill() calls right now
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def take(self) -> Tuple[str, str]:
+        """A pooled keypair, or a fresh one when the pool is empty"""
+        with self._lock:
+            if self._keys:
+                return self._keys.popleft()
+        return generate_keypair()
+
+    def fill(self) -> int:
+        """Top the pool up to its size; returns the number of keypairs generated.
+
+        Generation runs outside the lock so take() is never blocked by it; a
+        slot is reserved under the lock first, so concurrent fills (the
+        background top-up and the add path) never overshoot the size.
+        """
+        generated = 0
+        while True:
+            with self._lock:
+                if len(self._keys) + self._pending >= self.size:
+                    return generated
+                self._pending += 1
+            try:
+                keypair = generate_keypair()
+            except BaseException:
+                with self._lock:
+                    self._pending -= 1
+                raise
+            with self._lock:
+                self._pending -= 1
+                self._keys.append(keypair)
+            generated += 1